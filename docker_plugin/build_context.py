@@ -0,0 +1,277 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from contextlib import contextmanager
+
+from docker_plugin.concurrency import run_parallel
+from docker_plugin.locks import shared_lock, try_file_lock
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'cloudify-docker-build-contexts')
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 32
+DEFAULT_SWEEP_MAX_AGE = 24 * 60 * 60
+DEFAULT_DOWNLOAD_CONCURRENCY = 4
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def read_manifest(download_func, base_path):
+    try:
+        files_lst = download_func(base_path)
+    except IOError:
+        return ['Dockerfile']
+    with open(files_lst) as f:
+        return [filename.strip() for filename in f if filename.strip()]
+
+
+def read_manifest_content(get_resource, base_path):
+    try:
+        content = get_resource(base_path)
+    except IOError:
+        return ['Dockerfile']
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    return [filename.strip() for filename in content.splitlines() if filename.strip()]
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _hash_json(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def source_key(source, base_path, build_args):
+    return _hash_json([source, base_path, build_args or {}])
+
+
+def hash_context(build_dir, files, build_args):
+    digest = context_digest(build_args)
+    for filename in sorted(files):
+        digest.update(filename.encode('utf-8') + b'\0')
+        with open(os.path.join(build_dir, filename), 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def download_files(download_func, base_path, files, build_dir, concurrency=DEFAULT_DOWNLOAD_CONCURRENCY):
+    def download(filename):
+        target_path = os.path.join(build_dir, filename)
+        _makedirs(os.path.dirname(target_path))
+        download_func(os.path.join(base_path, filename), target_path=target_path)
+
+    run_parallel(download, files, concurrency)
+
+
+def stream_context(download_func, base_path, files, chunk_size=DEFAULT_CHUNK_SIZE, digest=None):
+    """Yield a tar archive of the build context, one resource at a time.
+
+    Suitable as ``fileobj`` for ``images.build(custom_context=True)``: requests
+    sends a generator with chunked transfer encoding, so the archive is never
+    assembled on disk or in memory. Each resource is downloaded, sent from disk
+    and removed before the next one, so no file is held in memory whole either.
+    When ``digest`` is given it is updated the same way as ``hash_context``.
+    """
+    for filename in sorted(files):
+        path = download_func(os.path.join(base_path, filename))
+        try:
+            size = os.path.getsize(path)
+            info = tarfile.TarInfo(name=filename)
+            info.size = size
+            info.mode = 0o644
+            yield info.tobuf(format=tarfile.GNU_FORMAT)
+
+            if digest is not None:
+                digest.update(filename.encode('utf-8') + b'\0')
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    if digest is not None:
+                        digest.update(chunk)
+                    yield chunk
+            if digest is not None:
+                digest.update(b'\0')
+            if size % tarfile.BLOCKSIZE:
+                yield b'\0' * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+        finally:
+            os.remove(path)
+    yield b'\0' * (2 * tarfile.BLOCKSIZE)
+
+
+def context_digest(build_args):
+    digest = hashlib.sha256()
+    digest.update(_hash_json(build_args or {}).encode('utf-8'))
+    return digest
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+
+class BuildContextCache(object):
+    """On-disk store of build contexts, addressed by the hash of their content.
+
+    ``index/`` maps a source key (blueprint upload, context path and build args)
+    to a content hash, so a context that was already fetched from the same
+    upload of a blueprint is not downloaded again; ``contexts/`` holds the files.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES,
+                 concurrency=DEFAULT_DOWNLOAD_CONCURRENCY):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.concurrency = concurrency
+        self.index_dir = os.path.join(self.cache_dir, 'index')
+        self.contexts_dir = os.path.join(self.cache_dir, 'contexts')
+
+    def get(self, download_func, source, base_path, build_args):
+        """Return ``(path, content_hash, cached)`` for the given build context."""
+        with self.checkout(download_func, source, base_path, build_args) as result:
+            return result
+
+    @contextmanager
+    def checkout(self, download_func, source, base_path, build_args):
+        """Like get, with the context kept from eviction by any process until the block ends."""
+        _makedirs(self.index_dir)
+        _makedirs(self.contexts_dir)
+        index_path = os.path.join(self.index_dir, source_key(source, base_path, build_args))
+
+        content_hash = self._read_index(index_path)
+        if content_hash:
+            with shared_lock(*self._lock_key(content_hash)):
+                path = os.path.join(self.contexts_dir, content_hash)
+                # checked under the lock, an eviction may just have removed it
+                if os.path.isdir(path):
+                    self._touch(path)
+                    yield path, content_hash, True
+                    return
+
+        staging = tempfile.mkdtemp(dir=self.cache_dir, prefix='.staging-')
+        try:
+            files = read_manifest(download_func, base_path)
+            download_files(download_func, base_path, files, staging, self.concurrency)
+            content_hash = hash_context(staging, files, build_args)
+            with shared_lock(*self._lock_key(content_hash)):
+                path = os.path.join(self.contexts_dir, content_hash)
+                cached = os.path.isdir(path)
+                if not cached:
+                    try:
+                        os.rename(staging, path)
+                    except OSError:
+                        # another process stored the same context in the meantime
+                        cached = True
+                shutil.rmtree(staging, ignore_errors=True)
+
+                self._write_index(index_path, content_hash)
+                self._touch(path)
+                self.evict(keep=content_hash)
+                yield path, content_hash, cached
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _lock_key(self, content_hash):
+        return 'build-context', self.contexts_dir, content_hash
+
+    def _remove_unused(self, name, path):
+        # contexts checked out by a build hold a shared lock on it
+        with try_file_lock(*self._lock_key(name)) as unused:
+            if unused:
+                shutil.rmtree(path, ignore_errors=True)
+            return unused
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.contexts_dir):
+            path = os.path.join(self.contexts_dir, name)
+            try:
+                used = os.stat(path).st_mtime
+            except OSError:
+                continue
+            entries.append((used, name, path, _dir_size(path)))
+        entries.sort()
+
+        total = sum(size for _, _, _, size in entries)
+        count = len(entries)
+        for _, name, path, size in entries:
+            if total <= self.max_bytes and count <= self.max_entries:
+                break
+            if name == keep or not self._remove_unused(name, path):
+                continue
+            total -= size
+            count -= 1
+
+    def sweep(self, max_age, clock=time.time):
+        """Remove staging leftovers and contexts unused for ``max_age`` seconds; return the bytes freed."""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        now = clock()
+        reclaimed = 0
+        staging = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                   if name.startswith('.staging-')]
+        contexts = os.listdir(self.contexts_dir) if os.path.isdir(self.contexts_dir) else []
+        candidates = [(None, path) for path in staging]
+        candidates.extend((name, os.path.join(self.contexts_dir, name)) for name in contexts)
+        for name, path in candidates:
+            try:
+                used = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if now - used >= max_age:
+                size = _dir_size(path)
+                if name is None:
+                    shutil.rmtree(path, ignore_errors=True)
+                elif not self._remove_unused(name, path):
+                    continue
+                reclaimed += size
+
+        if os.path.isdir(self.index_dir):
+            for name in os.listdir(self.index_dir):
+                index_path = os.path.join(self.index_dir, name)
+                content_hash = self._read_index(index_path)
+                if not content_hash or not os.path.isdir(os.path.join(self.contexts_dir, content_hash)):
+                    try:
+                        os.remove(index_path)
+                    except OSError:
+                        pass
+        return reclaimed
+
+    @staticmethod
+    def _read_index(index_path):
+        try:
+            with open(index_path) as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    @staticmethod
+    def _write_index(index_path, content_hash):
+        tmp_path = '{0}.{1}.tmp'.format(index_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(content_hash)
+        os.rename(tmp_path, index_path)
+
+    @staticmethod
+    def _touch(path):
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
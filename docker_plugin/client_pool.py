@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import docker
+import six
+from docker.tls import TLSConfig
+
+from docker_plugin.metrics import instrument
+
+DEFAULT_MAX_SIZE = 16
+DEFAULT_MAX_IDLE = 300
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+
+
+def normalize_connkwargs(connkwargs):
+    normalized = {k: v for k, v in (connkwargs or {}).items() if v is not None}
+    if not normalized.get('tls_enabled'):
+        normalized.pop('tls_enabled', None)
+        normalized.pop('tls_settings', None)
+    elif not normalized.get('tls_settings'):
+        normalized.pop('tls_settings', None)
+    return normalized
+
+
+def connkwargs_key(connkwargs):
+    return json.dumps(normalize_connkwargs(connkwargs), sort_keys=True, default=str)
+
+
+def host_key(client):
+    """Identifies the Docker host of a client for what is shared per host, like locks and the image inventory.
+
+    docker-py gives every unix socket the same base_url, so pooled clients are
+    told apart by their connection settings instead.
+    """
+    key = getattr(client, 'cloudify_host_key', None)
+    return key if isinstance(key, six.string_types) else client.api.base_url
+
+
+def make_docker_client(connkwargs):
+    connkwargs = connkwargs.copy()
+
+    tls_enabled = connkwargs.pop('tls_enabled', False)
+    tls_settings = connkwargs.pop('tls_settings', {})
+    tls = tls_enabled
+    if tls_enabled and tls_settings:
+        tls = TLSConfig(**tls_settings)
+
+    return docker.DockerClient(tls=tls, **connkwargs)
+
+
+def close_client(client):
+    try:
+        client.api.close()
+    except Exception:
+        pass
+
+
+class _PoolEntry(object):
+    def __init__(self, client, now):
+        self.client = client
+        self.last_used = now
+        self.last_checked = now
+
+
+class ClientPool(object):
+    """Process-wide cache of Docker clients keyed by connection settings.
+
+    Each DockerClient holds a requests session, so reusing it keeps the
+    HTTP/TLS connections to the daemon alive between operations.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_idle=DEFAULT_MAX_IDLE,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL, clock=time.time):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, connkwargs):
+        key = connkwargs_key(connkwargs)
+        with self._lock:
+            now = self._clock()
+            self._evict_idle(now)
+            entry = self._entries.pop(key, None)
+            if entry is not None and not self._is_healthy(entry, now):
+                close_client(entry.client)
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                entry = _PoolEntry(instrument(make_docker_client(normalize_connkwargs(connkwargs))), now)
+                entry.client.cloudify_host_key = key
+            else:
+                self.hits += 1
+                entry.last_used = now
+
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                _, oldest = self._entries.popitem(last=False)
+                close_client(oldest.client)
+                self.evictions += 1
+            return entry.client
+
+    def discard(self, connkwargs):
+        with self._lock:
+            entry = self._entries.pop(connkwargs_key(connkwargs), None)
+        if entry is not None:
+            close_client(entry.client)
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+        for entry in entries:
+            close_client(entry.client)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _evict_idle(self, now):
+        for key, entry in list(self._entries.items()):
+            if now - entry.last_used > self.max_idle:
+                del self._entries[key]
+                close_client(entry.client)
+                self.evictions += 1
+
+    def _is_healthy(self, entry, now):
+        if now - entry.last_checked < self.health_check_interval:
+            return True
+        try:
+            healthy = bool(entry.client.ping())
+        except Exception:
+            healthy = False
+        entry.last_checked = now
+        return healthy
+
+
+CLIENT_POOL = ClientPool()
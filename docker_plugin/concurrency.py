@@ -0,0 +1,26 @@
+from multiprocessing.pool import ThreadPool
+
+from docker_plugin import metrics
+
+DEFAULT_PARALLELISM = 8
+
+
+def run_parallel(func, items, limit=DEFAULT_PARALLELISM):
+    """Call ``func`` on every item using at most ``limit`` threads; return the results in order."""
+    items = list(items)
+    if len(items) <= 1 or not limit or limit <= 1:
+        return [func(item) for item in items]
+
+    recorder = metrics.current()
+
+    def call(item):
+        # keep recording the API calls of the worker threads for the calling operation
+        with metrics.recording(recorder):
+            return func(item)
+
+    pool = ThreadPool(min(limit, len(items)))
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,56 @@
+import time
+
+import six
+from docker.utils import split_command
+
+from docker_plugin.logs import STDERR, LogFollower, read_frames
+
+
+def run_exec(client, container_id, command, forward_stdout, forward_stderr, settings, user='', environment=None,
+             workdir=None, tty=False, clock=time.time):
+    """Run ``command`` in a running container, forwarding its output while it runs.
+
+    Returns the exit code, the duration and a bounded tail of each stream.
+    """
+    api = client.api
+    config = {
+        'AttachStdin': False,
+        'AttachStdout': True,
+        'AttachStderr': True,
+        'Tty': tty,
+        'Cmd': split_command(command) if isinstance(command, six.string_types) else command,
+        'User': user or '',
+        'Env': ['{0}={1}'.format(k, v) for k, v in sorted((environment or {}).items())],
+    }
+    if workdir:
+        config['WorkingDir'] = workdir
+
+    def follower(forward):
+        return LogFollower(forward, batch_lines=settings['batch_lines'], batch_seconds=settings['batch_seconds'],
+                           max_lines_per_second=settings['max_lines_per_second'], tail_lines=settings['tail_lines'],
+                           tail_bytes=settings['tail_bytes'], clock=clock)
+
+    streams = {1: follower(forward_stdout), STDERR: follower(forward_stderr)}
+    started = clock()
+    exec_id = api._result(api._post_json(api._url('/containers/{0}/exec', container_id), data=config), True)['Id']
+    # without the connection upgrade the daemon answers with a plain raw-stream body,
+    # which is read through the response instead of the hijacked socket
+    response = api._post_json(api._url('/exec/{0}/start', exec_id), data={'Tty': tty, 'Detach': False},
+                              stream=True)
+    api._raise_for_status(response)
+    try:
+        api._disable_socket_timeout(api._get_raw_response_socket(response))
+        for stream, data in read_frames(response, tty):
+            streams[STDERR if stream == STDERR else 1].feed(data)
+    finally:
+        response.close()
+        for output in streams.values():
+            output.close()
+
+    return {
+        'container_id': container_id,
+        'exit_code': api.exec_inspect(exec_id).get('ExitCode'),
+        'seconds': round(clock() - started, 3),
+        'stdout': streams[1].tail(),
+        'stderr': streams[STDERR].tail(),
+    }
@@ -0,0 +1,81 @@
+import json
+import tarfile
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def compression(path):
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+
+def _zstd_reader(path, f):
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('{0} is zstd compressed, loading it needs the zstandard package'.format(path))
+    return zstandard.ZstdDecompressor().stream_reader(f)
+
+
+def _image_id(config):
+    # "<hex>.json" in the classic docker save layout, "blobs/sha256/<hex>" in the OCI one
+    name = config.rsplit('/', 1)[-1]
+    if name.endswith('.json'):
+        name = name[:-len('.json')]
+    return 'sha256:' + name
+
+
+def read_manifest(path):
+    """The ids and tags of the images in a ``docker save`` archive, from its manifest.json.
+
+    A compressed archive is read as a stream, so it is never held in memory; an
+    uncompressed one is seeked through, so only its headers are read.
+    """
+    kind = compression(path)
+    modes = {'gzip': 'r|gz', 'zstd': 'r|', None: 'r:'}
+    with open(path, 'rb') as f:
+        fileobj = _zstd_reader(path, f) if kind == 'zstd' else f
+        with tarfile.open(fileobj=fileobj, mode=modes[kind]) as tar:
+            for member in tar:
+                if member.name.lstrip('./') == 'manifest.json':
+                    manifest = json.loads(tar.extractfile(member).read().decode('utf-8'))
+                    return [{'id': _image_id(entry['Config']), 'tags': entry.get('RepoTags') or []}
+                            for entry in manifest]
+    raise RuntimeError('{0} has no manifest.json, it is not an image archive made by docker save'.format(path))
+
+
+def iter_archive(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the archive in chunks for ``/images/load``.
+
+    The daemon decompresses gzip itself; zstd is decompressed here, as older
+    daemons do not know it.
+    """
+    kind = compression(path)
+    with open(path, 'rb') as f:
+        reader = _zstd_reader(path, f) if kind == 'zstd' else f
+        while True:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def load_archive(api, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Send the archive to ``/images/load`` and fail on the errors the daemon reports in the body.
+
+    The daemon answers 200 and tells about a corrupt or truncated archive in
+    the response stream, where docker-py's ``load_image`` does not look.
+    """
+    response = api._post(api._url('/images/load'), data=iter_archive(path, chunk_size), stream=True)
+    api._raise_for_status(response)
+    for message in api._stream_helper(response, decode=True):
+        if message.get('error') or message.get('errorDetail'):
+            error = message.get('error') or message['errorDetail'].get('message')
+            raise RuntimeError('Could not load {0}: {1}'.format(path, error))
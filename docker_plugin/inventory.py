@@ -0,0 +1,97 @@
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from docker_plugin.locks import file_lock
+
+INVENTORY_DIR = os.path.join(tempfile.gettempdir(), 'cloudify-docker-inventory')
+DEFAULT_TTL = 30
+
+
+def normalize_reference(ref):
+    if ref.startswith('sha256:') or '@' in ref:
+        return ref
+    if ':' not in ref.rsplit('/', 1)[-1]:
+        return '{0}:latest'.format(ref)
+    return ref
+
+
+class ImageInventory(object):
+    """Images present on one Docker host, shared by all operations on this machine.
+
+    The inventory is filled from a single ``/images/json`` call and kept in a
+    JSON file for ``ttl`` seconds; pulls, builds and deletes update it in place.
+    """
+
+    def __init__(self, host, ttl=DEFAULT_TTL, clock=time.time):
+        self.host = host
+        self.ttl = ttl
+        self._clock = clock
+        name = hashlib.sha256(str(host).encode('utf-8')).hexdigest()
+        self.path = os.path.join(INVENTORY_DIR, '{0}.json'.format(name))
+
+    def lookup(self, client, ref):
+        data = self._load()
+        if data is None or self._clock() - data['updated'] > self.ttl:
+            data = self.refresh(client)
+        image_id = data['refs'].get(normalize_reference(ref))
+        if image_id is None:
+            return None
+        return dict(data['images'][image_id], id=image_id)
+
+    def refresh(self, client):
+        data = {'updated': self._clock(), 'images': {}, 'refs': {}}
+        for image in client.api.images():
+            _add(data, image['Id'], image.get('RepoTags'), image.get('RepoDigests'), image.get('Labels'))
+        with file_lock('inventory', self.host):
+            self._save(data)
+        return data
+
+    def add(self, image_id, tags=None, digests=None, labels=None):
+        with file_lock('inventory', self.host):
+            data = self._load()
+            if data is not None:
+                _add(data, image_id, tags, digests, labels)
+                self._save(data)
+
+    def remove(self, image_id):
+        with file_lock('inventory', self.host):
+            data = self._load()
+            if data is not None and data['images'].pop(image_id, None) is not None:
+                data['refs'] = {ref: i for ref, i in data['refs'].items() if i != image_id}
+                self._save(data)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _save(self, data):
+        try:
+            os.makedirs(INVENTORY_DIR)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, self.path)
+
+
+def _add(data, image_id, tags, digests, labels):
+    entry = data['images'].setdefault(image_id, {'tags': [], 'digests': [], 'labels': {}})
+    for tag in tags or []:
+        if tag != '<none>:<none>' and tag not in entry['tags']:
+            entry['tags'].append(tag)
+            data['refs'][normalize_reference(tag)] = image_id
+    for digest in digests or []:
+        if digest != '<none>@<none>' and digest not in entry['digests']:
+            entry['digests'].append(digest)
+            data['refs'][digest] = image_id
+    entry['labels'].update(labels or {})
+    data['refs'][image_id] = image_id
@@ -0,0 +1,87 @@
+import errno
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+LOCK_DIR = os.path.join(tempfile.gettempdir(), 'cloudify-docker-locks')
+
+
+def _lock_path(*parts):
+    try:
+        os.makedirs(LOCK_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    name = hashlib.sha256('\0'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return os.path.join(LOCK_DIR, name)
+
+
+@contextmanager
+def file_lock(*parts):
+    """Exclusive lock shared by every process on this machine using the same key."""
+    with open(_lock_path(*parts), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def shared_lock(*parts):
+    """Shared lock on the same key as file_lock; any number of holders keep an exclusive one out."""
+    with open(_lock_path(*parts), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def try_file_lock(*parts):
+    """Take file_lock's lock if nobody holds the key, without waiting; yields whether it was taken."""
+    with open(_lock_path(*parts), 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def bounded_slot(limit, *parts, **kwargs):
+    """Hold one of ``limit`` slots for the given key; no limit when ``limit`` is falsy."""
+    if not limit:
+        yield
+        return
+
+    poll_interval = kwargs.get('poll_interval', 0.2)
+    handles = [open(_lock_path('slot', slot, *parts), 'a') for slot in range(limit)]
+    try:
+        while True:
+            for f in handles:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    continue
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                return
+            time.sleep(poll_interval)
+    finally:
+        for f in handles:
+            f.close()
@@ -0,0 +1,208 @@
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+DEFAULT_SETTINGS = {
+    'seconds': 30,
+    'history_lines': 100,
+    'batch_lines': 100,
+    'batch_seconds': 1.0,
+    'max_lines_per_second': 1000,
+    'tail_lines': 100,
+    'tail_bytes': 16 * 1024,
+}
+MAX_LINE_BYTES = 16 * 1024
+
+
+def log_settings(*overrides):
+    settings = dict(DEFAULT_SETTINGS)
+    for override in overrides:
+        settings.update({k: v for k, v in (override or {}).items() if v is not None})
+    return settings
+
+
+class LogFollower(object):
+    """Split a log stream into lines and forward them in batches, keeping only a bounded tail.
+
+    Lines beyond ``max_lines_per_second`` are not forwarded, only counted, and
+    still enter the tail; nothing grows with the length of the log.
+    """
+
+    def __init__(self, forward, batch_lines=100, batch_seconds=1.0, max_lines_per_second=1000, tail_lines=100,
+                 tail_bytes=16 * 1024, clock=time.time):
+        self.forward = forward
+        self.batch_lines = batch_lines
+        self.batch_seconds = batch_seconds
+        self.max_lines_per_second = max_lines_per_second
+        self.tail_bytes = tail_bytes
+        self._clock = clock
+        self._tail = deque(maxlen=tail_lines)
+        self._partial = b''
+        self._batch = []
+        self._flushed_at = clock()
+        self._window_start = clock()
+        self._window_lines = 0
+        self.lines = 0
+        self.bytes = 0
+        self.dropped = 0
+        self._dropped_unreported = 0
+
+    def feed(self, chunk):
+        self.bytes += len(chunk)
+        data = self._partial + chunk
+        lines = data.split(b'\n')
+        self._partial = lines.pop()
+        while len(self._partial) > MAX_LINE_BYTES:
+            lines.append(self._partial[:MAX_LINE_BYTES])
+            self._partial = self._partial[MAX_LINE_BYTES:]
+        for line in lines:
+            self._add(line)
+        if self._clock() - self._flushed_at >= self.batch_seconds:
+            self.flush()
+
+    def close(self):
+        if self._partial:
+            self._add(self._partial)
+            self._partial = b''
+        self.flush()
+
+    def flush(self):
+        self._flushed_at = self._clock()
+        if self._dropped_unreported:
+            self._batch.append('[{0} lines not forwarded, over {1} lines/s]'.format(
+                self._dropped_unreported, self.max_lines_per_second))
+            self._dropped_unreported = 0
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self.forward(batch)
+
+    def tail(self):
+        """The last lines, at most ``tail_lines`` of them and ``tail_bytes`` long."""
+        lines = []
+        size = 0
+        for line in reversed(self._tail):
+            size += len(line.encode('utf-8')) + 1
+            if size > self.tail_bytes:
+                break
+            lines.append(line)
+        return '\n'.join(reversed(lines))
+
+    def summary(self):
+        return {'lines': self.lines, 'bytes': self.bytes, 'dropped': self.dropped, 'tail': self.tail()}
+
+    def _add(self, raw_line):
+        line = raw_line.rstrip(b'\r').decode('utf-8', 'replace')
+        self.lines += 1
+        self._tail.append(line)
+
+        now = self._clock()
+        if now - self._window_start >= 1:
+            self._window_start = now
+            self._window_lines = 0
+        self._window_lines += 1
+        if self.max_lines_per_second and self._window_lines > self.max_lines_per_second:
+            self.dropped += 1
+            self._dropped_unreported += 1
+            return
+
+        self._batch.append(line)
+        if len(self._batch) >= self.batch_lines:
+            self.flush()
+
+
+STDOUT = 1
+STDERR = 2
+
+
+def _read_exactly(raw, size):
+    data = b''
+    while len(data) < size:
+        chunk = raw.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frames(response, tty=False, chunk_size=64 * 1024):
+    """Yield ``(stream, data)`` from a raw-stream response as it arrives.
+
+    Without a TTY the daemon prefixes every frame with an 8 byte header naming
+    its stream; with one there is a single unframed stdout stream.
+    """
+    raw = response.raw
+    if tty:
+        for chunk in response.iter_content(chunk_size=None):
+            yield STDOUT, chunk
+        return
+    while True:
+        header = _read_exactly(raw, 8)
+        if not header:
+            return
+        stream, size = struct.unpack('>BxxxL', header)
+        while size > 0:
+            data = raw.read(min(size, chunk_size))
+            if not data:
+                return
+            size -= len(data)
+            yield stream, data
+
+
+def _shutdown(sock, done):
+    done.set()
+    # docker-py hands out the socket.SocketIO wrapper for plain HTTP on Python 3
+    sock = getattr(sock, '_sock', sock) if not hasattr(sock, 'shutdown') else sock
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except (socket.error, OSError):
+        pass
+
+
+def stream_logs(client, container_id, tty=False, history_lines='all', seconds=None):
+    """Yield raw log chunks of a container as they are written, for at most ``seconds``.
+
+    ``container.logs(stream=True)`` gives no way to stop a quiet stream, so the
+    request is made here and its socket shut down once the time is up.
+    """
+    api = client.api
+    params = {'stdout': 1, 'stderr': 1, 'follow': 1, 'timestamps': 0, 'tail': history_lines}
+    response = api._get(api._url('/containers/{0}/logs', container_id), params=params, stream=True)
+    api._raise_for_status(response)
+    watchdog = None
+    timed_out = threading.Event()
+    if seconds:
+        watchdog = threading.Timer(seconds, _shutdown, [api._get_raw_response_socket(response), timed_out])
+        watchdog.daemon = True
+        watchdog.start()
+    try:
+        api._disable_socket_timeout(api._get_raw_response_socket(response))
+        for _, chunk in read_frames(response, tty):
+            yield chunk
+    except Exception:
+        # when the watchdog shut the socket down under a pending read, whatever that raised is expected
+        if not timed_out.is_set():
+            raise
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+        response.close()
+
+
+def follow_logs(client, container_id, forward, settings, tty=False):
+    follower = LogFollower(
+        forward,
+        batch_lines=settings['batch_lines'],
+        batch_seconds=settings['batch_seconds'],
+        max_lines_per_second=settings['max_lines_per_second'],
+        tail_lines=settings['tail_lines'],
+        tail_bytes=settings['tail_bytes'],
+    )
+    try:
+        for chunk in stream_logs(client, container_id, tty=tty, history_lines=settings['history_lines'],
+                                 seconds=settings['seconds']):
+            follower.feed(chunk)
+    finally:
+        follower.close()
+    return follower.summary()
@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from docker_plugin.locks import file_lock
+
+COLLECTIONS = ('containers', 'images', 'networks', 'volumes', 'exec', 'secrets', 'services', 'nodes',
+               'plugins', 'tasks', 'swarm', 'distribution')
+COLLECTION_VERBS = ('json', 'create', 'prune', 'load', 'search', 'get', 'build')
+
+_local = threading.local()
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+
+@contextmanager
+def recording(recorder):
+    previous = current()
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+
+def call_name(method, url, base_url=None):
+    """Turn a request into a stable name, e.g. ``POST /containers/{id}/start``."""
+    path = url
+    if base_url and path.startswith(base_url):
+        path = path[len(base_url):]
+    elif '://' in path:
+        path = '/' + path.split('://', 1)[1].partition('/')[2]
+    segments = [s for s in path.split('?', 1)[0].split('/') if s]
+    if segments and segments[0].startswith('v1.'):
+        segments = segments[1:]
+    if len(segments) > 1 and segments[0] in COLLECTIONS and segments[1] not in COLLECTION_VERBS:
+        segments = segments[:1] + ['{id}'] + (segments[-1:] if len(segments) > 2 else [])
+    return '{0} /{1}'.format(method.upper(), '/'.join(segments))
+
+
+def _payload_size(data):
+    if isinstance(data, (bytes, str)):
+        return len(data)
+    return 0
+
+
+def instrument(client):
+    """Record every HTTP request the client makes in the current thread's recorder."""
+    api = client.api
+    if getattr(api, '_cloudify_instrumented', False) is True:
+        return client
+    request = api.request
+
+    def instrumented_request(method, url, *args, **kwargs):
+        recorder = current()
+        if recorder is None:
+            return request(method, url, *args, **kwargs)
+        started = time.time()
+        response = None
+        try:
+            response = request(method, url, *args, **kwargs)
+            return response
+        finally:
+            received = retries = 0
+            if response is not None:
+                received = int(response.headers.get('Content-Length') or 0)
+                retries = len(getattr(getattr(response.raw, 'retries', None), 'history', None) or ())
+            recorder.record(call_name(method, url, api.base_url), api.base_url, time.time() - started,
+                            sent=_payload_size(kwargs.get('data')), received=received, retries=retries,
+                            failed=response is None)
+
+    api.request = instrumented_request
+    api._cloudify_instrumented = True
+    return client
+
+
+class OperationMetrics(object):
+    """Docker API calls made while one lifecycle operation was running."""
+
+    def __init__(self, operation, node_instance=None):
+        self.operation = operation
+        self.node_instance = node_instance
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def record(self, name, host, seconds, sent=0, received=0, retries=0, failed=False):
+        with self._lock:
+            self.calls.append({
+                'call': name,
+                'host': host,
+                'seconds': seconds,
+                'sent': sent,
+                'received': received,
+                'retries': retries,
+                'failed': failed,
+            })
+
+    @contextmanager
+    def timed(self, name, host):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, host, time.time() - started)
+
+    def aggregate(self, by_host=True):
+        by_key = {}
+        with self._lock:
+            calls = list(self.calls)
+        for call in calls:
+            key = (call['host'], call['call']) if by_host else call['call']
+            stats = by_key.setdefault(key, {
+                'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                'sent': 0, 'received': 0, 'retries': 0, 'failed': 0,
+            })
+            stats['count'] += 1
+            stats['seconds'] += call['seconds']
+            stats['max_seconds'] = max(stats['max_seconds'], call['seconds'])
+            stats['sent'] += call['sent']
+            stats['received'] += call['received']
+            stats['retries'] += call['retries']
+            stats['failed'] += int(call['failed'])
+        return by_key
+
+    def summary(self):
+        by_call = self.aggregate(by_host=False)
+        return {
+            'calls': sum(s['count'] for s in by_call.values()),
+            'seconds': round(sum(s['seconds'] for s in by_call.values()), 6),
+            'by_call': {
+                call: dict(stats, seconds=round(stats['seconds'], 6), max_seconds=round(stats['max_seconds'], 6))
+                for call, stats in by_call.items()
+            },
+        }
+
+    def write_jsonl(self, path):
+        with file_lock('metrics', path):
+            with open(path, 'a') as f:
+                for call in self.calls:
+                    f.write(json.dumps(dict(call, operation=self.operation, node_instance=self.node_instance),
+                                       default=str))
+                    f.write('\n')
+
+    def write_prometheus(self, path):
+        """Merge this operation's calls into a node-exporter textfile-collector file."""
+        state_path = '{0}.state.json'.format(path)
+        with file_lock('metrics', path):
+            try:
+                with open(state_path) as f:
+                    state = json.load(f)
+            except (IOError, ValueError):
+                state = {}
+            for (host, call), stats in self.aggregate().items():
+                key = json.dumps([host, call, self.operation])
+                totals = state.setdefault(key, {})
+                for field, value in stats.items():
+                    if field == 'max_seconds':
+                        totals[field] = max(totals.get(field, 0), value)
+                    else:
+                        totals[field] = totals.get(field, 0) + value
+            _write_atomic(state_path, json.dumps(state))
+            _write_atomic(path, _prometheus_text(state))
+
+
+PROMETHEUS_METRICS = (
+    ('count', 'docker_plugin_api_calls_total', 'counter', 'Docker API calls made by the plugin'),
+    ('seconds', 'docker_plugin_api_call_seconds_total', 'counter', 'Time spent in Docker API calls'),
+    ('max_seconds', 'docker_plugin_api_call_seconds_max', 'gauge', 'Slowest Docker API call'),
+    ('sent', 'docker_plugin_api_sent_bytes_total', 'counter', 'Request payload bytes'),
+    ('received', 'docker_plugin_api_received_bytes_total', 'counter', 'Response payload bytes'),
+    ('retries', 'docker_plugin_api_retries_total', 'counter', 'Retried Docker API requests'),
+    ('failed', 'docker_plugin_api_failures_total', 'counter', 'Docker API requests that raised'),
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _prometheus_text(state):
+    lines = []
+    for field, metric, kind, description in PROMETHEUS_METRICS:
+        lines.append('# HELP {0} {1}'.format(metric, description))
+        lines.append('# TYPE {0} {1}'.format(metric, kind))
+        for key in sorted(state):
+            host, call, operation = json.loads(key)
+            lines.append('{0}{{host="{1}",call="{2}",operation="{3}"}} {4}'.format(
+                metric, _escape(host), _escape(call), _escape(operation), state[key].get(field, 0)))
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomic(path, content):
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.rename(tmp_path, path)
@@ -0,0 +1,131 @@
+import json
+import os
+import tempfile
+import time
+
+import docker.errors
+import requests.exceptions
+from docker.utils import parse_bytes
+
+from docker_plugin.concurrency import DEFAULT_PARALLELISM, run_parallel
+from docker_plugin.locks import file_lock
+from docker_plugin.stats import cpu_cores, memory_bytes
+
+SPREAD = 'spread'
+BINPACK = 'binpack'
+# how long a placement is counted against its host on top of the measured load,
+# until its container runs and shows up in the host's own stats
+RESERVATION_TTL = 60
+RESERVATION_DIR = os.path.join(tempfile.gettempdir(), 'cloudify-docker-placement')
+
+
+def requested_resources(parameters):
+    """The cores and bytes of memory a container asks for in its create parameters."""
+    cpus = 0.0
+    if parameters.get('nano_cpus'):
+        cpus = parameters['nano_cpus'] / 1e9
+    elif parameters.get('cpu_quota') and parameters.get('cpu_period'):
+        cpus = float(parameters['cpu_quota']) / parameters['cpu_period']
+    memory = parameters.get('mem_reservation') or parameters.get('mem_limit') or 0
+    return cpus, parse_bytes(memory) if memory else 0
+
+
+def _sample(client, container_id):
+    try:
+        sample = client.api.stats(container_id, stream=False)
+    except docker.errors.NotFound:
+        # exited between the list and the stats call
+        return 0.0, 0
+    return cpu_cores(sample), memory_bytes(sample)
+
+
+def measure(client, limit=DEFAULT_PARALLELISM):
+    """Capacity of a Docker host and what its running containers use of it."""
+    info = client.api.info()
+    running = client.api.containers()
+    samples = run_parallel(lambda container: _sample(client, container['Id']), running, limit)
+    return {
+        'cpus': info.get('NCPU') or 0,
+        'memory': info.get('MemTotal') or 0,
+        'used_cpus': sum(cpus for cpus, _ in samples),
+        'used_memory': sum(memory for _, memory in samples),
+        'containers': len(running),
+    }
+
+
+def measure_hosts(clients, limit=DEFAULT_PARALLELISM):
+    """Measure every host of ``clients`` concurrently; returns the loads and the errors of unreachable hosts."""
+    def safe_measure(key):
+        try:
+            return key, measure(clients[key], limit), None
+        except (docker.errors.DockerException, requests.exceptions.RequestException) as e:
+            return key, None, e
+
+    results = run_parallel(safe_measure, sorted(clients), len(clients))
+    return ({key: load for key, load, _ in results if load is not None},
+            {key: error for key, _, error in results if error is not None})
+
+
+def _headroom(load, cpus, memory):
+    """The smaller share of the host's CPU or memory left after placing the container, None if it does not fit."""
+    free_cpus = load['cpus'] - load['used_cpus'] - cpus
+    free_memory = load['memory'] - load['used_memory'] - memory
+    if free_cpus < 0 or free_memory < 0 or not load['cpus'] or not load['memory']:
+        return None
+    return min(float(free_cpus) / load['cpus'], float(free_memory) / load['memory'])
+
+
+def choose(loads, cpus, memory, strategy=SPREAD):
+    """Pick the key of the host in ``loads`` to place a container on.
+
+    ``spread`` picks the host with the most headroom left, ``binpack`` the one
+    with the least that still fits the container, keeping the others free.
+    """
+    fitting = []
+    for key, load in sorted(loads.items()):
+        headroom = _headroom(load, cpus, memory)
+        if headroom is not None:
+            fitting.append((headroom, -load['containers'], key))
+    if not fitting:
+        raise RuntimeError('None of the {0} candidate hosts has {1} cores and {2} bytes of memory free'.format(
+            len(loads), cpus, memory))
+    return max(fitting)[2] if strategy == SPREAD else min(fitting)[2]
+
+
+def _reservations_path(scope):
+    try:
+        os.makedirs(RESERVATION_DIR)
+    except OSError:
+        if not os.path.isdir(RESERVATION_DIR):
+            raise
+    return os.path.join(RESERVATION_DIR, '{0}.json'.format(scope))
+
+
+def place(loads, cpus, memory, strategy=SPREAD, scope='default', clock=time.time):
+    """Choose a host and reserve the container's resources on it.
+
+    Placements made at the same time all measure the same loads, so the ones
+    made on this machine in the last ``RESERVATION_TTL`` seconds are added to
+    them before choosing.
+    """
+    path = _reservations_path(scope)
+    with file_lock('placement', scope):
+        try:
+            with open(path) as f:
+                reservations = json.load(f)
+        except (IOError, ValueError):
+            reservations = []
+        now = clock()
+        reservations = [r for r in reservations if now - r['at'] < RESERVATION_TTL]
+        loads = {key: dict(load) for key, load in loads.items()}
+        for reservation in reservations:
+            load = loads.get(reservation['host'])
+            if load is not None:
+                load['used_cpus'] += reservation['cpus']
+                load['used_memory'] += reservation['memory']
+                load['containers'] += 1
+        key = choose(loads, cpus, memory, strategy)
+        reservations.append({'host': key, 'cpus': cpus, 'memory': memory, 'at': now})
+        with open(path, 'w') as f:
+            json.dump(reservations, f)
+    return key
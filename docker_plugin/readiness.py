@@ -0,0 +1,107 @@
+import socket
+import time
+
+from docker_plugin.concurrency import run_parallel
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_PORT_TIMEOUT = 30
+INITIAL_BACKOFF = 0.05
+MAX_BACKOFF = 2.0
+
+
+def _has_healthcheck(container):
+    healthcheck = (container.attrs.get('Config') or {}).get('Healthcheck') or {}
+    return bool(healthcheck.get('Test')) and healthcheck['Test'] != ['NONE']
+
+
+def _is_ready(container, wait_for):
+    state = container.attrs.get('State') or {}
+    if wait_for == 'healthy':
+        return (state.get('Health') or {}).get('Status') == 'healthy'
+    return bool(state.get('Running'))
+
+
+def start_and_wait(client, container, wait_for, timeout=DEFAULT_TIMEOUT, logger=None, clock=time.time):
+    """Start ``container`` and block until the daemon reports it running or healthy.
+
+    The ``/events`` stream is opened from just before the start, filtered to
+    this container, and bounded with ``until`` so it ends at the deadline. The
+    final state is confirmed with a single reload, which also covers events
+    lost to clock skew between this machine and the daemon.
+    """
+    if wait_for == 'healthy' and not _has_healthcheck(container):
+        if logger:
+            logger.warning('{0} has no healthcheck, waiting until it is running'.format(container.name))
+        wait_for = 'running'
+
+    started_at = int(clock()) - 1
+    deadline = started_at + 1 + timeout
+    container.start()
+
+    events = client.api.events(since=started_at, until=deadline, decode=True, filters={
+        'type': 'container',
+        'container': container.id,
+    })
+    try:
+        for event in events:
+            action = event.get('Action') or event.get('status') or ''
+            if action == 'die':
+                break
+            if action == 'start' and wait_for == 'running':
+                break
+            if action == 'health_status: healthy':
+                break
+            if logger and action.startswith('health_status'):
+                logger.info('{0}: {1}'.format(container.name, action))
+    finally:
+        close = getattr(events, 'close', None)
+        if close is not None:
+            close()
+
+    container.reload()
+    if not _is_ready(container, wait_for):
+        raise RuntimeError('Container {0} did not become {1} within {2}s'.format(
+            container.name, wait_for, timeout))
+
+
+def published_ports(container, port_bindings, default_host):
+    """Return ``{container_port: (host, host_port)}`` for the declared bindings that got published."""
+    ports = (container.attrs.get('NetworkSettings') or {}).get('Ports') or {}
+    published = {}
+    for port in port_bindings or {}:
+        key = str(port) if '/' in str(port) else '{0}/tcp'.format(port)
+        if not key.endswith('/tcp'):
+            continue
+        for binding in ports.get(key) or []:
+            host_ip = binding.get('HostIp')
+            if not host_ip or host_ip in ('0.0.0.0', '::'):
+                host_ip = default_host
+            published[key] = (host_ip, int(binding['HostPort']))
+            break
+    return published
+
+
+def probe_port(address, timeout=DEFAULT_PORT_TIMEOUT, clock=time.time, sleep=time.sleep):
+    """Connect to ``address`` until it accepts, backing off exponentially; return the seconds it took."""
+    started = clock()
+    delay = INITIAL_BACKOFF
+    while True:
+        remaining = timeout - (clock() - started)
+        if remaining <= 0:
+            raise RuntimeError('{0}:{1} did not accept connections within {2}s'.format(
+                address[0], address[1], timeout))
+        try:
+            conn = socket.create_connection(address, timeout=min(remaining, MAX_BACKOFF))
+        except (socket.error, socket.timeout):
+            sleep(min(delay, max(remaining, 0)))
+            delay = min(delay * 2, MAX_BACKOFF)
+        else:
+            conn.close()
+            return clock() - started
+
+
+def probe_ports(published, timeout=DEFAULT_PORT_TIMEOUT):
+    """Probe all ports at once; return ``{container_port: seconds to first accept}``."""
+    items = sorted(published.items())
+    results = run_parallel(lambda item: probe_port(item[1], timeout), items, limit=len(items))
+    return {port: round(elapsed, 3) for (port, _), elapsed in zip(items, results)}
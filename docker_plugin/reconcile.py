@@ -0,0 +1,97 @@
+from docker_plugin.concurrency import run_parallel
+from docker_plugin.teardown import DEFAULT_CONCURRENCY, ignore_missing, remove_network
+
+INSTANCE_LABEL = 'cloudify.node_instance'
+
+
+def observe(client, labels):
+    """What the daemon has for ``labels``: one list call per kind of resource."""
+    filters = {'label': labels}
+    return {
+        'containers': {c['Id']: c for c in client.api.containers(all=True, filters=filters)},
+        'networks': {n['Id']: n for n in client.api.networks(filters=filters)},
+        'volumes': {v['Name']: v for v in client.api.volumes(filters=filters).get('Volumes') or []},
+    }
+
+
+def _orphans(resources, live_instance_ids):
+    orphans = []
+    for key, resource in resources.items():
+        owner = (resource.get('Labels') or {}).get(INSTANCE_LABEL)
+        if owner and owner not in live_instance_ids:
+            orphans.append(key)
+    return orphans
+
+
+def reconcile(client, labels, instances, live_instance_ids, create_container, remove_orphans=True,
+              limit=DEFAULT_CONCURRENCY):
+    """Bring the resources of ``instances`` back in line with their runtime properties.
+
+    Only resources recorded with a ``create_spec`` are recreated; containers of
+    started instances that are not running are restarted; labelled resources of
+    node instances that no longer exist are removed. Returns the changes per
+    action and the runtime property updates per node instance.
+    """
+    observed = observe(client, labels)
+    changes = {'recreated': [], 'restarted': [], 'removed': 0, 'in_sync': 0}
+    updates = {}
+    replaced_networks = {}
+
+    # networks and volumes first, containers are recreated against them
+    for instance in instances:
+        props = instance.runtime_properties
+        spec = props.get('create_spec')
+        if not spec:
+            continue
+        if props.get('network_id'):
+            if props['network_id'] in observed['networks']:
+                changes['in_sync'] += 1
+                continue
+            network_id = client.api.create_network(**spec)['Id']
+            replaced_networks[props['network_id']] = network_id
+            updates[instance.id] = {'network_id': network_id}
+            changes['recreated'].append(instance.id)
+        elif props.get('volume_created'):
+            if props['volume_id'] in observed['volumes']:
+                changes['in_sync'] += 1
+                continue
+            client.api.create_volume(**spec)
+            changes['recreated'].append(instance.id)
+
+    def heal_container(instance):
+        # runs in worker threads, so report the action and leave the bookkeeping to the caller
+        props = instance.runtime_properties
+        spec = props.get('create_spec')
+        if not spec or not props.get('container_id'):
+            return None, None
+        started = instance.state == 'started'
+        summary = observed['containers'].get(props['container_id'])
+        if summary is None:
+            endpoints = [(name, replaced_networks.get(network_id, network_id), aliases)
+                         for name, network_id, aliases in spec['endpoints']]
+            container_id = create_container(client, spec['parameters'], endpoints)
+            if started:
+                client.api.start(container_id)
+            return 'recreated', {'container_id': container_id, 'create_spec': dict(spec, endpoints=endpoints)}
+        elif started and summary.get('State') != 'running':
+            client.api.start(summary['Id'])
+            return 'restarted', None
+        return 'in_sync', None
+
+    for instance, (action, update) in zip(instances, run_parallel(heal_container, instances, limit)):
+        if action == 'in_sync':
+            changes['in_sync'] += 1
+        elif action:
+            changes[action].append(instance.id)
+        if update:
+            updates[instance.id] = update
+
+    if remove_orphans:
+        removed = run_parallel(lambda c: ignore_missing(client.api.remove_container, c, force=True),
+                               _orphans(observed['containers'], live_instance_ids), limit)
+        removed += run_parallel(lambda n: remove_network(client, n),
+                                _orphans(observed['networks'], live_instance_ids), limit)
+        removed += run_parallel(lambda v: ignore_missing(client.api.remove_volume, v, force=True),
+                                _orphans(observed['volumes'], live_instance_ids), limit)
+        changes['removed'] = sum(removed)
+    return changes, updates
@@ -0,0 +1,34 @@
+from docker_plugin.build_context import DEFAULT_CHUNK_SIZE
+
+SEED_LABEL = 'cloudify.docker.seed'
+SEED_MOUNT = '/seed'
+
+
+def _stream_file(path, chunk_size):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def stream_tarball(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield a tar archive as it is; the daemon unpacks gzip, bzip2 and xz itself."""
+    return _stream_file(path, chunk_size)
+
+
+def seed_volume(client, volume_name, helper_image, archive, path='/', labels=None):
+    """Unpack ``archive``, an iterable of chunks, at ``path`` in the volume.
+
+    The archive goes through ``put_archive`` of a helper container that mounts
+    the volume and is never started.
+    """
+    helper = client.api.create_container(
+        helper_image, command=['true'], labels=labels,
+        host_config=client.api.create_host_config(binds={volume_name: {'bind': SEED_MOUNT, 'mode': 'rw'}}),
+    )['Id']
+    try:
+        client.api.put_archive(helper, SEED_MOUNT + '/' + path.strip('/'), archive)
+    finally:
+        client.api.remove_container(helper, force=True)
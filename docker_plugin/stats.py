@@ -0,0 +1,119 @@
+import json
+import time
+from array import array
+
+import docker.errors
+
+from docker_plugin.concurrency import DEFAULT_PARALLELISM, run_parallel
+
+
+def cpu_cores(sample):
+    """Cores a container used between the two CPU readings of one ``stats(stream=False)`` sample."""
+    cpu = sample.get('cpu_stats') or {}
+    precpu = sample.get('precpu_stats') or {}
+    used = (cpu.get('cpu_usage') or {}).get('total_usage', 0) - (precpu.get('cpu_usage') or {}).get('total_usage', 0)
+    system = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    if used <= 0 or system <= 0:
+        return 0.0
+    online = cpu.get('online_cpus') or len((cpu.get('cpu_usage') or {}).get('percpu_usage') or []) or 1
+    return float(used) / system * online
+
+
+def memory_bytes(sample):
+    """Memory a container uses, without the page cache the kernel can reclaim."""
+    memory = sample.get('memory_stats') or {}
+    return max(0, memory.get('usage', 0) - (memory.get('stats') or {}).get('cache', 0))
+
+
+METRICS = ('cpu_percent', 'memory_bytes', 'net_rx_bytes_per_second', 'net_tx_bytes_per_second',
+           'blkio_read_bytes_per_second', 'blkio_write_bytes_per_second')
+COUNTERS = METRICS[2:]
+
+
+def _counters(sample):
+    networks = (sample.get('networks') or {}).values()
+    blkio = (sample.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []
+    return (
+        sum(n.get('rx_bytes', 0) for n in networks),
+        sum(n.get('tx_bytes', 0) for n in networks),
+        sum(b.get('value', 0) for b in blkio if b.get('op', '').lower() == 'read'),
+        sum(b.get('value', 0) for b in blkio if b.get('op', '').lower() == 'write'),
+    )
+
+
+class Window(object):
+    """The last ``size`` values of each metric, in fixed-size arrays."""
+
+    def __init__(self, size):
+        self.size = size
+        self.values = {metric: array('d', [0.0]) * size for metric in METRICS}
+        self.counts = dict.fromkeys(METRICS, 0)
+
+    def add(self, values):
+        for metric, value in values.items():
+            self.values[metric][self.counts[metric] % self.size] = value
+            self.counts[metric] += 1
+
+    def aggregate(self):
+        result = {}
+        for metric in METRICS:
+            values = sorted(self.values[metric][:min(self.counts[metric], self.size)])
+            if values:
+                result[metric] = {
+                    'mean': round(sum(values) / len(values), 3),
+                    'p95': round(values[int(round(0.95 * (len(values) - 1)))], 3),
+                    'max': round(values[-1], 3),
+                }
+        return result
+
+
+def _sample_or_none(client, container_id):
+    try:
+        return client.api.stats(container_id, stream=False)
+    except docker.errors.NotFound:
+        return None
+
+
+def sample(client, labels, rounds, interval, limit=DEFAULT_PARALLELISM, timeseries=None, clock=time.time,
+           sleep=time.sleep):
+    """Sample the running containers carrying ``labels`` every ``interval`` seconds, ``rounds`` times.
+
+    Each round is one list call and one concurrent ``stats`` call per container.
+    Byte counters become per second rates from one round to the next, so a
+    container's first round only gives its CPU and memory. Each round's values
+    are also written to ``timeseries``, a file object, one JSON line per container.
+    Returns the aggregates per container name and of the sums over all of them.
+    """
+    windows = {}
+    total = Window(rounds)
+    previous = {}
+    for round_index in range(rounds):
+        started = clock()
+        running = client.api.containers(filters={'label': labels})
+        samples = run_parallel(lambda c: (c, _sample_or_none(client, c['Id'])), running, limit)
+        now = clock()
+        sums = {}
+        for summary, stats in samples:
+            if stats is None:
+                continue
+            name = (summary.get('Names') or [summary['Id']])[0].lstrip('/')
+            values = {'cpu_percent': cpu_cores(stats) * 100, 'memory_bytes': float(memory_bytes(stats))}
+            counters = _counters(stats)
+            if name in previous and now > previous[name][0]:
+                then, before = previous[name]
+                # a restarted container starts its counters over
+                values.update((metric, max(0.0, float(value - last) / (now - then)))
+                              for metric, value, last in zip(COUNTERS, counters, before))
+            previous[name] = (now, counters)
+            windows.setdefault(name, Window(rounds)).add(values)
+            for metric, value in values.items():
+                sums[metric] = sums.get(metric, 0.0) + value
+            if timeseries is not None:
+                timeseries.write(json.dumps(dict(values, time=round(now, 3), container=name), sort_keys=True) + '\n')
+        total.add(sums)
+        if round_index < rounds - 1:
+            sleep(max(0, interval - (clock() - started)))
+    return {
+        'containers': {name: window.aggregate() for name, window in windows.items()},
+        'total': total.aggregate(),
+    }
@@ -1,35 +1,62 @@
+from contextlib import contextmanager
 from functools import wraps
 import os
-import tempfile
+import re
+import time
 import docker
+import requests
 
 import docker.errors
+from docker.types import EndpointSpec, ServiceMode, UpdateConfig
 from cloudify.decorators import operation
-from docker.tls import TLSConfig
+from cloudify.manager import get_rest_client
+from cloudify.utils import get_manager_rest_service_host
+from cloudify_rest_client.exceptions import CloudifyClientError
+from docker.models.containers import _create_container_args
+
+from docker_plugin.build_context import BuildContextCache, DEFAULT_DOWNLOAD_CONCURRENCY, DEFAULT_MAX_BYTES, \
+    DEFAULT_SWEEP_MAX_AGE, context_digest, read_manifest_content, source_key, stream_context
+from docker_plugin.client_pool import CLIENT_POOL, connkwargs_key, host_key, make_docker_client
+from docker_plugin import metrics
+from docker_plugin.concurrency import DEFAULT_PARALLELISM, run_parallel
+from docker_plugin.execute import run_exec
+from docker_plugin.image_archive import load_archive, read_manifest
+from docker_plugin.inventory import DEFAULT_TTL as DEFAULT_INVENTORY_TTL, ImageInventory, normalize_reference
+from docker_plugin.logs import follow_logs, log_settings
+from docker_plugin.locks import bounded_slot, file_lock
+from docker_plugin.metrics import OperationMetrics
+from docker_plugin.placement import SPREAD, measure_hosts, place, requested_resources
+from docker_plugin.reconcile import INSTANCE_LABEL, reconcile
+from docker_plugin.seed import SEED_LABEL, seed_volume, stream_tarball
+from docker_plugin.stats import sample
+from docker_plugin.readiness import DEFAULT_PORT_TIMEOUT, DEFAULT_TIMEOUT as DEFAULT_READINESS_TIMEOUT, \
+    probe_ports, published_ports, start_and_wait
+from docker_plugin.teardown import DEFAULT_CONCURRENCY as DEFAULT_TEARDOWN_CONCURRENCY, DEFAULT_STOP_TIMEOUT, \
+    ignore_missing, teardown
+from docker_plugin.warm_pool import claim, drain, fill, pool_key, refill_in_background
 
 CONTAINER_IN_HOST_TYPE = 'docker.using_docker_host'
 CONNECTED_TO_CONTAINER = 'docker.container_connected_to_container'
 CONNECTED_TO_VOLUME = 'docker.container_connected_to_volume'
 CONNECTED_TO_NETWORK = 'docker.container_connected_to_network'
 FROM_IMAGE = 'docker.container_from_image'
+CONNECTED_TO_SWARM_MANAGER = 'docker.connected_to_swarm_manager'
+PLACEMENT_CANDIDATE = 'docker.container_placement_candidate'
+
+FINGERPRINT_LABEL = 'cloudify.docker.fingerprint'
+DEPLOYMENT_LABEL = 'cloudify.deployment'
+NODE_LABEL = 'cloudify.node'
+SHARED_NETWORK_USER_LABEL = 'cloudify.docker.shared_network_user'
+GROUP_LABEL = 'cloudify.docker.group'
+SNAPSHOT_LABEL = 'cloudify.docker.snapshot_of'
+SNAPSHOT_REPOSITORY = 'cloudify-snapshots'
+DEFAULT_SEED_HELPER_IMAGE = 'busybox:latest'
 
 
 def find_relationship(rels, kind):
     return [rel for rel in rels if kind in rel.type_hierarchy]
 
 
-def make_docker_client(connkwargs):
-    connkwargs = connkwargs.copy()
-
-    tls_enabled = connkwargs.pop('tls_enabled', False)
-    tls_settings = connkwargs.pop('tls_settings', {})
-    tls = tls_enabled
-    if tls_enabled and tls_settings:
-        tls = TLSConfig(**tls_settings)
-
-    return docker.DockerClient(tls=tls, **connkwargs)
-
-
 @operation
 def prepare_client(ctx, **override_connkwargs):
     connkwargs = ctx.node.properties['connection_kwargs']
@@ -38,17 +65,20 @@ def prepare_client(ctx, **override_connkwargs):
     connkwargs['tls_enabled'] = tls_enabled
     connkwargs['tls_settings'] = tls_settings
     connkwargs.update(override_connkwargs)
-    client = make_docker_client(connkwargs)
+    client = CLIENT_POOL.get(connkwargs)
     if not client.ping():
+        CLIENT_POOL.discard(connkwargs)
         raise RuntimeError('Docker client error')
     ctx.instance.runtime_properties['connection_kwargs'] = connkwargs
 
 
-def docker_client_for_instance(instance):
-    host_rels = find_relationship(instance.relationships, CONTAINER_IN_HOST_TYPE)
+def connection_kwargs_for_instance(instance):
+    host_rels = find_relationship(instance.relationships, CONTAINER_IN_HOST_TYPE) or \
+        find_relationship(instance.relationships, CONNECTED_TO_SWARM_MANAGER)
     if not host_rels:
-        # no docker host relationship, just connect to localhost
-        return docker.DockerClient()
+        # the docker host itself, a container placed on one of its candidate hosts,
+        # or no docker host relationship and just localhost
+        return instance.runtime_properties.get('connection_kwargs') or {}
 
     if len(host_rels) > 1:
         msg = '{0} needs one relationship to a host but has {1}'.format(instance.node.name, len(host_rels))
@@ -56,15 +86,126 @@ def docker_client_for_instance(instance):
 
     host = host_rels[0].target.instance
     props = host.runtime_properties
-    connkwargs = props['connection_kwargs']
+    return props['connection_kwargs']
 
-    return make_docker_client(connkwargs)
+
+def docker_client_for_instance(instance):
+    return CLIENT_POOL.get(connection_kwargs_for_instance(instance))
+
+
+def docker_host_address(instance):
+    host_rels = find_relationship(instance.relationships, CONTAINER_IN_HOST_TYPE)
+    if len(host_rels) != 1:
+        return instance.runtime_properties.get('docker_host_ip') or '127.0.0.1'
+    return host_rels[0].target.node.properties.get('ip') or '127.0.0.1'
+
+
+def _api_metrics_settings(instance):
+    host_rels = find_relationship(instance.relationships, CONTAINER_IN_HOST_TYPE)
+    if len(host_rels) != 1:
+        return {}
+    return host_rels[0].target.node.properties.get('api_metrics') or {}
+
+
+def place_instance(ctx):
+    """Choose one of the container's candidate hosts by load and record its connection in the runtime properties.
+
+    Done once, by the first operation; the later ones find the connection there.
+    Networks, volumes and built or loaded images only exist on their own host,
+    so only the candidates that have them are considered; an image pulled from
+    a repository is pulled on the chosen host when it is not there yet.
+    """
+    candidates = find_relationship(ctx.instance.relationships, PLACEMENT_CANDIDATE)
+    if not candidates or ctx.instance.runtime_properties.get('connection_kwargs'):
+        return
+    hosts = {rel.target.instance.id: rel.target for rel in candidates}
+    clients = {key: CLIENT_POOL.get(host.instance.runtime_properties['connection_kwargs'])
+               for key, host in hosts.items()}
+    image, pullable = _placement_image(ctx)
+    missing = _missing_dependencies(ctx, clients, None if pullable else image)
+    for key, names in sorted(missing.items()):
+        ctx.logger.warning('Not placing on {0}, it does not have {1}'.format(key, ', '.join(names)))
+    if len(missing) == len(clients):
+        raise RuntimeError('None of the {0} candidate hosts of {1} has its image, networks, volumes and connected '
+                           'containers'.format(len(clients), ctx.node.name))
+    loads, errors = measure_hosts({key: client for key, client in clients.items() if key not in missing})
+    for key, error in sorted(errors.items()):
+        ctx.logger.warning('Not placing on {0}, it could not be measured: {1}'.format(key, error))
+
+    cpus, memory = requested_resources(ctx.node.properties.get('additional_create_parameters') or {})
+    replicas = ctx.node.properties.get('replicas') or 1
+    key = place(loads, cpus * replicas, memory * replicas, ctx.node.properties.get('placement_strategy') or SPREAD,
+                scope=ctx.deployment.id or 'default')
+    host = hosts[key]
+    ctx.logger.info('Placed on {0}: {1[used_cpus]:.2f} of {1[cpus]} cores and {1[used_memory]} of {1[memory]} '
+                    'bytes of memory in use'.format(key, loads[key]))
+    if pullable:
+        _pull_placement_image(clients[key], ctx, image, pullable)
+    ctx.instance.runtime_properties.update({
+        'connection_kwargs': host.instance.runtime_properties['connection_kwargs'],
+        'docker_host': key,
+        'docker_host_ip': host.node.properties.get('ip'),
+    })
+
+
+def _placement_image(ctx):
+    # the image id, and its repository reference when any host can pull it
+    image = find_image(ctx)
+    rel = find_relationship(ctx.instance.relationships, FROM_IMAGE)[0]
+    pullable = rel.target.node.properties.get('repository') and not rel.target.instance.runtime_properties.get(
+        'snapshot')
+    return image, find_image(ctx, reference=True) if pullable else None
+
+
+def _missing_dependencies(ctx, clients, image):
+    """What of the image, networks, volumes and connected containers each host lacks, for the hosts lacking any.
+
+    Connected containers are reached through networks on their own host, so
+    the container has to be on the same one.
+    """
+    connected = {name: connkwargs_key(connection_kwargs_for_instance(rel.target.instance))
+                 for name, rel in find_connected_nodes(ctx, CONNECTED_TO_CONTAINER).items()}
+    required = [('network', d['network_id'])
+                for d in find_connected_nodes(ctx, CONNECTED_TO_NETWORK, _make_network_details).values()]
+    required += [('volume', d['volume_name'])
+                 for d in find_connected_nodes(ctx, CONNECTED_TO_VOLUME, _make_volume_details).values()]
+    if image:
+        required.append(('image', image))
+
+    def lacks(key):
+        api = clients[key].api
+        names = ['connected container {0}'.format(name) for name, host in sorted(connected.items())
+                 if host != host_key(clients[key])]
+        return key, names + ['{0} {1}'.format(kind, name) for kind, name in required
+                             if not ignore_missing(getattr(api, 'inspect_' + kind), name)]
+
+    return {key: names for key, names in run_parallel(lacks, sorted(clients)) if names}
+
+
+def _pull_placement_image(client, ctx, image, reference):
+    if ignore_missing(client.api.inspect_image, image):
+        return
+    repository, tag = _split_reference(reference)
+    pulled = _ensure_pulled(client, ctx, _image_inventory(client, ctx), repository, tag)
+    if pulled != image:
+        raise RuntimeError('{0} is {1} on the chosen host, not {2} as on the host of the image'.format(
+            reference, pulled, image))
+
+
+def _report_api_metrics(instance, recorder, settings):
+    summaries = instance.runtime_properties.get('docker_api_metrics') or {}
+    summaries[recorder.operation] = recorder.summary()
+    instance.runtime_properties['docker_api_metrics'] = summaries
+    if settings.get('prometheus_file'):
+        recorder.write_prometheus(settings['prometheus_file'])
+    if settings.get('jsonl_file'):
+        recorder.write_jsonl(settings['jsonl_file'])
 
 
 def with_docker_client(settings_from=None):
     def decorator(f):
         @wraps(f)
-        def _inner(ctx, *a):
+        def _inner(ctx, *a, **kw):
             if settings_from is None:
                 instance = ctx.instance
             elif settings_from == 'source':
@@ -74,85 +215,345 @@ def with_docker_client(settings_from=None):
             else:
                 raise ValueError('Invalid settings_from: {0}'.format(settings_from))
 
-            client = docker_client_for_instance(instance)
-            return f(client, ctx, *a)
+            recorder = OperationMetrics(ctx.operation.name or f.__name__, instance.id)
+            with metrics.recording(recorder):
+                try:
+                    if settings_from is None:
+                        place_instance(ctx)
+                    with recorder.timed('client.acquire', ''):
+                        client = docker_client_for_instance(instance)
+                    ctx.logger.debug('Docker client pool: {0}'.format(CLIENT_POOL.stats()))
+                    return f(client, ctx, *a, **kw)
+                finally:
+                    _report_api_metrics(instance, recorder, _api_metrics_settings(instance))
 
         return _inner
 
     return decorator
 
 
-def _get_build_path(download_func, base_path):
-    build_dir = tempfile.mkdtemp()
+def blueprint_source(ctx):
+    """Where blueprint resources come from: the blueprint, as uploaded at its created_at.
+
+    A blueprint deleted and uploaded again under the same id is another source,
+    so what was cached or built from the previous upload is not reused.
+    """
+    try:
+        manager = get_manager_rest_service_host()
+    except RuntimeError:
+        manager = None
+    if not manager:
+        # no manager to ask, e.g. cfy local or outside of an operation
+        return ctx.blueprint.id
     try:
-        files_lst = download_func(base_path)
-    except IOError:
-        files = ['Dockerfile']
+        blueprint = get_rest_client().blueprints.get(ctx.blueprint.id, _include=['created_at'])
+    except (CloudifyClientError, requests.exceptions.RequestException) as e:
+        ctx.logger.warning('Could not ask the manager when {0} was uploaded: {1}'.format(ctx.blueprint.id, e))
+        return ctx.blueprint.id
+    return '{0}@{1}'.format(ctx.blueprint.id, blueprint.created_at)
+
+
+@contextmanager
+def _get_build_path(ctx, base_path, build_args):
+    """Yield ``(path, content_hash)``; the cached context stays on disk until the block ends."""
+    props = ctx.node.properties
+    cache = BuildContextCache(
+        cache_dir=props.get('build_cache_dir') or None,
+        max_bytes=props.get('build_cache_max_bytes') or DEFAULT_MAX_BYTES,
+        concurrency=props.get('download_concurrency') or DEFAULT_DOWNLOAD_CONCURRENCY,
+    )
+    with cache.checkout(ctx.download_resource, blueprint_source(ctx), base_path, build_args) as checkout:
+        path, content_hash, cached = checkout
+        if cached:
+            ctx.logger.info('Using cached build context {0}'.format(content_hash))
+        ctx.instance.runtime_properties['build_context_hash'] = content_hash
+        yield path, content_hash
+
+
+@contextmanager
+def _build_source(ctx, dockerfile, build_args, streamed):
+    if streamed:
+        # the resources of one upload of a blueprint never change, so the source identifies the content
+        yield None, source_key(blueprint_source(ctx), dockerfile, build_args)
     else:
-        with open(files_lst) as f:
-            files = [filename.strip() for filename in f if filename.strip()]
+        with _get_build_path(ctx, dockerfile, build_args) as source:
+            yield source
+
+
+def _pull_streamed(client, ctx, repository, tag):
+    name = '{0}:{1}'.format(repository, tag)
+    reported = {}
+    for event in client.api.pull(repository, tag=tag, stream=True, decode=True):
+        if 'error' in event:
+            raise RuntimeError('Pulling {0} failed: {1}'.format(name, event['error']))
+        status = event.get('status')
+        layer = event.get('id')
+        # progress ticks are frequent, only report each layer's status changes
+        if status and reported.get(layer) != status:
+            reported[layer] = status
+            ctx.logger.info('{0}: {1}'.format(layer, status) if layer else status)
+    return client.images.get(name)
+
+
+def _image_inventory(client, ctx):
+    ttl = ctx.node.properties.get('image_inventory_ttl', DEFAULT_INVENTORY_TTL)
+    return ImageInventory(host_key(client), ttl=ttl)
+
+
+def _split_reference(ref):
+    repository, _, tag = ref.rpartition(':')
+    if not repository or '/' in tag:
+        return ref, 'latest'
+    return repository, tag
+
+
+def _ensure_pulled(client, ctx, inventory, repository, tag):
+    name = '{0}:{1}'.format(repository, tag)
+    known = inventory.lookup(client, name)
+    if known:
+        return known['id']
+
+    host = host_key(client)
+    with file_lock('pull', host, name):
+        # the inventory may be stale, or another node pulled the image while we were waiting
+        try:
+            image = client.images.get(name)
+        except docker.errors.ImageNotFound:
+            with bounded_slot(ctx.node.properties.get('max_concurrent_pulls'), 'pull', host):
+                ctx.logger.info('Pulling {0}'.format(name))
+                if ctx.node.properties.get('stream_pull_progress'):
+                    image = _pull_streamed(client, ctx, repository, tag)
+                else:
+                    image = client.images.pull(repository, tag=tag)
+        inventory.add(image.id, tags=[name])
+    return image.id
+
+
+def build_image_from_repository(client, ctx, inventory):
+    tag = ctx.node.properties.get('tag') or 'latest'
+    return _ensure_pulled(client, ctx, inventory, ctx.node.properties['repository'], tag)
 
-    for filename in files:
-        download_func(os.path.join(base_path, filename), target_path=os.path.join(build_dir, filename))
-    return build_dir
 
+def build_image_from_tarball(client, ctx, inventory):
+    """Load the image from a ``docker save`` archive, a blueprint resource or a local path.
 
-def build_image_from_repository(client, ctx):
-    tag = ctx.node.properties.get('tag') or 'latest'
-    name = '{0}:{1}'.format(ctx.node.properties['repository'], tag)
+    Nothing is sent when the image in the archive's manifest is already on the host.
+    """
+    path = ctx.node.properties['image_tarball']
+    downloaded = not os.path.isabs(path)
+    if downloaded:
+        path = ctx.download_resource(path)
     try:
-        image = client.images.get(name)
-    except docker.errors.ImageNotFound:
-        ctx.logger.info('Pulling {0}'.format(name))
+        images = read_manifest(path)
+        name = ctx.node.properties.get('image_name')
+        image = next((i for i in images if name and normalize_reference(name) in i['tags']), images[0])
+        if inventory.lookup(client, image['id']):
+            return image['id']
+
+        with file_lock('load', host_key(client), image['id']):
+            try:
+                client.api.inspect_image(image['id'])
+            except docker.errors.ImageNotFound:
+                ctx.logger.info('Loading {0} from {1}'.format(', '.join(image['tags']) or image['id'],
+                                                              ctx.node.properties['image_tarball']))
+                load_archive(client.api, path)
+                try:
+                    client.api.inspect_image(image['id'])
+                except docker.errors.ImageNotFound:
+                    raise RuntimeError('{0} did not load {1}'.format(ctx.node.properties['image_tarball'],
+                                                                     image['id']))
+            for loaded in images:
+                inventory.add(loaded['id'], tags=loaded['tags'])
+    finally:
+        if downloaded:
+            os.remove(path)
+    return image['id']
+
+
+def _pull_cache_sources(client, ctx, inventory, cache_from):
+    for ref in cache_from:
+        repository, tag = _split_reference(ref)
+        try:
+            _ensure_pulled(client, ctx, inventory, repository, tag)
+        except docker.errors.APIError as e:
+            ctx.logger.warning('Could not pull cache source {0}: {1}'.format(ref, e))
+
+
+def _build_streamed(client, ctx, name, dockerfile, build_args, **build_kwargs):
+    files = read_manifest_content(ctx.get_resource, dockerfile)
+    digest = context_digest(build_args)
+    context = stream_context(ctx.download_resource, dockerfile, files, digest=digest)
+    image = client.images.build(fileobj=context, custom_context=True, tag=name, rm=True, forcerm=True,
+                                buildargs=build_args, **build_kwargs)
+    ctx.instance.runtime_properties['build_context_hash'] = digest.hexdigest()
+    return image
 
-        image = client.images.pull(ctx.node.properties['repository'], tag=tag)
 
-    return image
+def _image_labels(client, inventory, name):
+    known = inventory.lookup(client, name)
+    if known:
+        return known['id'], known['labels']
+    try:
+        image = client.images.get(name)
+    except docker.errors.ImageNotFound:
+        return None, None
+    return image.id, image.labels
 
 
-def build_image_from_dockerfile(client, ctx):
+def build_image_from_dockerfile(client, ctx, inventory):
     name = ctx.node.properties['image_name']
     dockerfile = ctx.node.properties['dockerfile']
     build_args = ctx.node.properties['build_args']
-    try:
-        image = client.images.get(name)
-    except docker.errors.ImageNotFound:
-        ctx.logger.info('Building {0} from {1}'.format(name, dockerfile))
-        path = _get_build_path(ctx.download_resource, dockerfile)
-        image = client.images.build(path=path, tag=name, rm=True, forcerm=True, buildargs=build_args)
+    streamed = ctx.node.properties.get('build_context_mode') == 'stream'
+    # held through the build, so a concurrent eviction cannot remove the context under it
+    with _build_source(ctx, dockerfile, build_args, streamed) as (path, fingerprint):
+        image_id, labels = _image_labels(client, inventory, name)
+        if image_id and (labels or {}).get(FINGERPRINT_LABEL) == fingerprint:
+            return image_id
+        if image_id:
+            ctx.logger.info('{0} is out of date, rebuilding'.format(name))
+
+        cache_from = ctx.node.properties.get('cache_from') or []
+        if cache_from and ctx.node.properties.get('pull_cache_from'):
+            _pull_cache_sources(client, ctx, inventory, cache_from)
+
+        build_kwargs = {'labels': _resource_labels(ctx, {FINGERPRINT_LABEL: fingerprint})}
+        if cache_from:
+            build_kwargs['cache_from'] = cache_from
 
-        if not image.id:
-            raise RuntimeError('Unexpected error during build')
+        ctx.logger.info('Building {0} from {1}'.format(name, dockerfile))
+        if streamed:
+            image = _build_streamed(client, ctx, name, dockerfile, build_args, **build_kwargs)
+        else:
+            image = client.images.build(path=path, tag=name, rm=True, forcerm=True, buildargs=build_args,
+                                        **build_kwargs)
 
-        ctx.logger.info('Built {0}'.format(image.id))
+    if not image.id:
+        raise RuntimeError('Unexpected error during build')
 
-    return image
+    ctx.logger.info('Built {0}'.format(image.id))
+    inventory.add(image.id, tags=[name], labels=build_kwargs['labels'])
+    ctx.instance.runtime_properties['fingerprint'] = fingerprint
+    return image.id
 
 
 @operation()
 @with_docker_client()
 def build_image(client, ctx):
+    inventory = _image_inventory(client, ctx)
+    source_fingerprint = _source_fingerprint(ctx)
+    ctx.instance.runtime_properties['source_fingerprint'] = source_fingerprint
+    snapshot = _find_snapshot(client, ctx, inventory, source_fingerprint)
+    if snapshot:
+        ctx.logger.info('Using snapshot {0}'.format(snapshot['reference']))
+        ctx.instance.runtime_properties.update({'image': snapshot['id'], 'image_reference': snapshot['reference'],
+                                                'snapshot': snapshot['reference']})
+        return
     if ctx.node.properties.get('repository'):
-        image = build_image_from_repository(client, ctx)
+        image_id = build_image_from_repository(client, ctx, inventory)
+    elif ctx.node.properties.get('image_tarball'):
+        image_id = build_image_from_tarball(client, ctx, inventory)
     else:
-        image = build_image_from_dockerfile(client, ctx)
-    ctx.instance.runtime_properties['image'] = image.id
+        image_id = build_image_from_dockerfile(client, ctx, inventory)
+    ctx.instance.runtime_properties['image'] = image_id
+    # swarm nodes resolve images by name, the id is only known to this host
+    ctx.instance.runtime_properties['image_reference'] = _image_reference(ctx) or image_id
+
+
+def _image_reference(ctx):
+    if ctx.node.properties.get('repository'):
+        return '{0}:{1}'.format(ctx.node.properties['repository'], ctx.node.properties.get('tag') or 'latest')
+    return ctx.node.properties.get('image_name')
+
+
+def _source_fingerprint(ctx):
+    """What the image is made from, known before pulling, loading or building it."""
+    props = ctx.node.properties
+    if props.get('repository'):
+        return source_key('repository', _image_reference(ctx), None)
+    if props.get('image_tarball'):
+        tarball = props['image_tarball']
+        if os.path.isabs(tarball):
+            stat = os.stat(tarball)
+            return source_key(tarball, None, {'size': stat.st_size, 'mtime': stat.st_mtime})
+        return source_key(blueprint_source(ctx), tarball, None)
+    return source_key(blueprint_source(ctx), props.get('dockerfile'), props.get('build_args'))
+
+
+def snapshot_reference(node_id, deployment_id, fingerprint):
+    tag = re.sub(r'[^\w.-]', '-', '{0}-{1}'.format(deployment_id, fingerprint[:16]))
+    return '{0}/{1}:{2}'.format(SNAPSHOT_REPOSITORY, re.sub(r'[^a-z0-9._-]', '-', str(node_id).lower()), tag[-128:])
+
+
+def _find_snapshot(client, ctx, inventory, source_fingerprint):
+    node_id = ctx.node.properties.get('snapshot_of')
+    if not node_id:
+        return None
+    reference = snapshot_reference(node_id, ctx.deployment.id, source_fingerprint)
+    known = inventory.lookup(client, reference)
+    return {'id': known['id'], 'reference': reference} if known else None
+
+
+@operation()
+@with_docker_client()
+def snapshot_container(client, ctx):
+    """Commit the running container to an image a docker.Image with snapshot_of set to this node prefers.
+
+    The image is tagged with the node, the deployment and the source fingerprint
+    of the image the container was created from, so it is only reused for that source.
+    """
+    rels = find_relationship(ctx.instance.relationships, FROM_IMAGE)
+    source = rels[0].target.instance.runtime_properties if len(rels) == 1 else {}
+    fingerprint = source.get('source_fingerprint') or find_image(ctx)
+    reference = snapshot_reference(ctx.node.id, ctx.deployment.id, fingerprint)
+    repository, tag = _split_reference(reference)
+    labels = {SNAPSHOT_LABEL: str(ctx.node.id), FINGERPRINT_LABEL: fingerprint}
+    if ctx.deployment.id:
+        labels[DEPLOYMENT_LABEL] = str(ctx.deployment.id)
+    image_id = client.api.commit(ctx.instance.runtime_properties['container_id'], repository=repository, tag=tag,
+                                 message='Snapshot of {0}'.format(ctx.instance.id), conf={'Labels': labels})['Id']
+    _image_inventory(client, ctx).add(image_id, tags=[reference], labels=labels)
+    ctx.logger.info('Committed {0} to {1}'.format(ctx.instance.id, reference))
+    ctx.instance.runtime_properties['snapshot'] = {'image': image_id, 'reference': reference}
 
 
 @operation()
 @with_docker_client()
 def delete_image(client, ctx):
+    if ctx.instance.runtime_properties.get('snapshot'):
+        # the snapshot outlives the deployment's images, for the next install to use
+        return
     if not ctx.node.properties.get('keep'):
-        client.images.remove(ctx.instance.runtime_properties['image'])
+        image_id = ctx.instance.runtime_properties['image']
+        try:
+            client.images.remove(image_id)
+        except docker.errors.ImageNotFound:
+            # already removed, e.g. by prune_deployment
+            pass
+        except docker.errors.APIError:
+            # docker commit makes snapshots child images of it, and they outlive the deployment
+            if not _snapshots_of(client, image_id):
+                raise
+            ctx.logger.info('Keeping {0}, snapshots were committed on top of it'.format(image_id))
+            return
+        _image_inventory(client, ctx).remove(image_id)
+
 
+def _snapshots_of(client, image_id):
+    return [image['Id'] for image in client.api.images(all=True, filters={'label': SNAPSHOT_LABEL})
+            if image.get('ParentId') == image_id]
 
-def find_image(ctx):
+
+def find_image(ctx, reference=False):
     rels = find_relationship(ctx.instance.relationships, FROM_IMAGE)
     if len(rels) != 1:
         raise RuntimeError('{0} needs exactly one relationship to an Image '
                            'but has {1}'.format(ctx.node.name, len(rels)))
 
-    return rels[0].target.instance.runtime_properties['image']
+    runtime_properties = rels[0].target.instance.runtime_properties
+    if reference and runtime_properties.get('image_reference'):
+        return runtime_properties['image_reference']
+    return runtime_properties['image']
 
 
 def _make_volume_details(rel):
@@ -194,7 +595,7 @@ def make_connected_containers_networks(client, ctx, connected_containers):
 
         network_name = '{0}_to_{1}'.format(ctx.node.name, target_name)
 
-        network = target_client.networks.create(name=network_name)
+        network = target_client.networks.create(name=network_name, **_label_kwargs(ctx))
         network.connect(container)
         container.reload()
         target_ip = container.attrs['NetworkSettings']['Networks'][network_name]['IPAddress']
@@ -212,19 +613,181 @@ def make_connected_containers_networks(client, ctx, connected_containers):
     return container_details, networks
 
 
-@operation()
-@with_docker_client()
-def create_container(client, ctx, **override_parameters):
+def _label_kwargs(ctx):
+    labels = _resource_labels(ctx)
+    return {'labels': labels} if labels else {}
+
+
+def shared_network_name(ctx):
+    return ctx.node.properties.get('shared_network_name') or 'cloudify_{0}'.format(ctx.deployment.id)
+
+
+def _get_or_create_shared_network(client, ctx, network_name):
+    try:
+        return client.networks.get(network_name)
+    except docker.errors.NotFound:
+        return client.networks.create(name=network_name, labels={DEPLOYMENT_LABEL: str(ctx.deployment.id)})
+
+
+@contextmanager
+def shared_network_lock(client, ctx):
+    """Held in shared topology from connecting the targets until the container using the network is created.
+
+    The container's SHARED_NETWORK_USER_LABEL is what keeps release_shared_network
+    from removing the network, so it must not be released before that.
+    """
+    if ctx.node.properties.get('connection_topology') != 'shared':
+        yield
+        return
+    with file_lock('shared-network', host_key(client), shared_network_name(ctx)):
+        yield
+
+
+def make_shared_containers_network(client, ctx, connected_containers):
+    """Connect all targets to one deployment-wide network instead of one network per relationship.
+
+    Callers hold shared_network_lock.
+    """
+    network_name = shared_network_name(ctx)
+    container_details = {}
+    network = _get_or_create_shared_network(client, ctx, network_name)
+    for target_name, container_rel in sorted(connected_containers.items()):
+        container = client.containers.get(container_rel.target.instance.runtime_properties['container_id'])
+        attached = container.attrs['NetworkSettings']['Networks']
+        if network_name not in attached:
+            network.connect(container, aliases=[target_name])
+            container.reload()
+            attached = container.attrs['NetworkSettings']['Networks']
+
+        container_details[target_name] = {
+            'ip': attached[network_name]['IPAddress'],
+            'net_id': network.id,
+            'container_id': container.id
+        }
+
+    networks = {}
+    if connected_containers:
+        networks[network_name] = {
+            'network_id': network.id,
+            'network_name': network_name,
+            'network_options': None
+        }
+    return container_details, networks
+
+
+def release_shared_network(client, network_id, network_name):
+    """Remove the shared network once no container that relies on it is left.
+
+    Containers created in shared mode carry SHARED_NETWORK_USER_LABEL, so they
+    are the reference count; targets are only disconnected once it drops to 0.
+    """
+    with file_lock('shared-network', host_key(client), network_name):
+        users = client.api.containers(all=True, filters={
+            'network': network_id,
+            'label': '{0}={1}'.format(SHARED_NETWORK_USER_LABEL, network_name),
+        })
+        if users:
+            return
+        try:
+            network = client.networks.get(network_id)
+        except docker.errors.NotFound:
+            return
+        for container_id in network.attrs.get('Containers') or {}:
+            network.disconnect(container_id, force=True)
+        network.remove()
+
+
+def _resource_labels(ctx, extra=None):
+    labels = {}
+    if ctx.deployment.id:
+        labels[DEPLOYMENT_LABEL] = str(ctx.deployment.id)
+        labels[NODE_LABEL] = str(ctx.node.id)
+        labels[INSTANCE_LABEL] = str(ctx.instance.id)
+    labels.update(extra or {})
+    return labels
+
+
+def _with_labels(labels, extra):
+    if isinstance(labels, (list, tuple)):
+        labels = {label: '' for label in labels}
+    labels = dict(labels or {})
+    labels.update(extra)
+    return labels
+
+
+def _network_aliases(ctx, network):
+    network_aliases = ctx.node.properties['network_aliases']
+    if isinstance(network_aliases, dict):
+        aliases = network_aliases.get(network)
+    else:
+        aliases = network_aliases
+    return aliases or [ctx.node.id]
+
+
+def _create_attached(client, parameters, endpoints):
+    """Create a container attached to the first network, connect the rest in parallel.
+
+    docker-py's ``containers.create`` cannot pass endpoint aliases, so when there
+    are networks to attach the container is created through the low-level API.
+    Unless ``network`` or ``network_mode`` is given, such a container is not on
+    the default bridge network.
+    """
+    if not endpoints:
+        return client.containers.create(**parameters).id
+
+    if parameters.get('network') or parameters.get('network_mode'):
+        # networking is set explicitly, so every network is connected after creation
+        container_id = client.containers.create(**parameters).id
+        remaining = endpoints
+    else:
+        _, network_id, aliases = endpoints[0]
+        create_kwargs = dict(parameters, network=network_id, version=client.api._version)
+        create_kwargs = _create_container_args(create_kwargs)
+        create_kwargs['networking_config'] = client.api.create_networking_config({
+            network_id: client.api.create_endpoint_config(aliases=aliases)
+        })
+        container_id = client.api.create_container(**create_kwargs)['Id']
+        remaining = endpoints[1:]
+
+    _connect_endpoints(client, container_id, remaining)
+    return container_id
+
+
+def _connect_endpoints(client, container_id, endpoints):
+    def connect(endpoint):
+        _, network_id, aliases = endpoint
+        client.api.connect_container_to_network(container_id, network_id, aliases=aliases)
+
+    run_parallel(connect, endpoints)
+
+
+def _pool_endpoints(endpoints, runtime_properties):
+    """Split the endpoints into those pooled containers share and the per-instance <a>_to_<b> networks."""
+    if runtime_properties.get('shared_network'):
+        return endpoints, []
+    own = set(c['net_id'] for c in (runtime_properties.get('connected') or {}).values())
+    return [e for e in endpoints if e[1] not in own], [e for e in endpoints if e[1] in own]
+
+
+def _resolve_container_spec(client, ctx, override_parameters):
+    """Resolve the image, volume, network and connected container relationships into create parameters.
+
+    Returns the parameters, the network endpoints to attach and the runtime properties to record.
+    """
     image = find_image(ctx)
     volumes = find_connected_nodes(ctx, CONNECTED_TO_VOLUME, _make_volume_details)
     networks = find_connected_nodes(ctx, CONNECTED_TO_NETWORK, _make_network_details)
     connected_containers = find_connected_nodes(ctx, CONNECTED_TO_CONTAINER)
-    connected_containers_details, connected_containers_networks = \
-        make_connected_containers_networks(client, ctx, connected_containers)
+    shared = ctx.node.properties.get('connection_topology') == 'shared' and bool(connected_containers)
+    if shared:
+        connected_containers_details, connected_containers_networks = \
+            make_shared_containers_network(client, ctx, connected_containers)
+    else:
+        connected_containers_details, connected_containers_networks = \
+            make_connected_containers_networks(client, ctx, connected_containers)
 
     if set(networks) & set(connected_containers_networks):
         raise RuntimeError('Overlapping networks? {0} vs {1}'.format(networks, connected_containers_networks))
-    network_aliases = ctx.node.properties['network_aliases']
 
     networks.update(connected_containers_networks)
 
@@ -246,24 +809,73 @@ def create_container(client, ctx, **override_parameters):
     }
     parameters.update(ctx.node.properties['additional_create_parameters'])
     parameters.update(**override_parameters)
+    labels = _resource_labels(ctx, {SHARED_NETWORK_USER_LABEL: shared_network_name(ctx)} if shared else None)
+    if labels:
+        parameters['labels'] = _with_labels(parameters.get('labels'), labels)
+
+    endpoints = [
+        (details['network_name'], details['network_id'], _network_aliases(ctx, node_name))
+        for node_name, details in sorted(networks.items())
+    ]
+    runtime_properties = {
+        'networks': networks,
+        'volumes': volumes,
+        'image': image,
+        'connected': connected_containers_details,
+        # what reconcile_deployment recreates the container from
+        'create_spec': {'parameters': parameters, 'endpoints': endpoints},
+    }
+    if shared:
+        runtime_properties['shared_network'] = connected_containers_networks[shared_network_name(ctx)]
+    return parameters, endpoints, runtime_properties
 
-    container = client.containers.create(**parameters)
 
-    for network in networks:
-        if isinstance(network_aliases, dict):
-            aliases = network_aliases.get(network)
-        else:
-            aliases = network_aliases
-        if not aliases:
-            aliases = [ctx.node.id]
-        net = client.networks.get(network)
-        net.connect(container, aliases=aliases)
+@operation()
+@with_docker_client()
+def create_container(client, ctx, **override_parameters):
+    with shared_network_lock(client, ctx):
+        parameters, endpoints, runtime_properties = _resolve_container_spec(client, ctx, override_parameters)
+        container_id = None
+        pool_size = ctx.node.properties.get('warm_pool_size') or 0
+        if pool_size:
+            pooled, own = _pool_endpoints(endpoints, runtime_properties)
+            key = pool_key(parameters, pooled)
+            container_id = claim(client, key, parameters['name'])
+            if container_id:
+                ctx.logger.info('Claimed {0} from the warm pool'.format(container_id))
+                _connect_endpoints(client, container_id, own)
+            refill_in_background(connection_kwargs_for_instance(ctx.instance), key, parameters, pooled, pool_size)
+        if container_id is None:
+            container_id = _create_attached(client, parameters, endpoints)
+
+    ctx.instance.runtime_properties['container_id'] = container_id
+    ctx.instance.runtime_properties.update(runtime_properties)
+
+
+def _warm_pool_spec(client, ctx):
+    # the create parameters and shared endpoints of the node's pool
+    runtime_properties = ctx.instance.runtime_properties
+    if runtime_properties.get('create_spec'):
+        spec = runtime_properties['create_spec']
+        parameters, endpoints = spec['parameters'], spec['endpoints']
+    else:
+        parameters, endpoints, runtime_properties = _resolve_container_spec(client, ctx, {})
+    return parameters, _pool_endpoints(endpoints, runtime_properties)[0]
 
-    ctx.instance.runtime_properties['container_id'] = container.id
-    ctx.instance.runtime_properties['networks'] = networks
-    ctx.instance.runtime_properties['volumes'] = volumes
-    ctx.instance.runtime_properties['image'] = image
-    ctx.instance.runtime_properties['connected'] = connected_containers_details
+
+@operation()
+@with_docker_client()
+def fill_warm_pool(client, ctx, size=None):
+    """Create or remove stopped containers of the node's warm pool until it has ``size`` of them.
+
+    ``size`` defaults to the warm_pool_size property; 0 empties the pool.
+    """
+    size = (ctx.node.properties.get('warm_pool_size') or 0) if size is None else size
+    with shared_network_lock(client, ctx):
+        parameters, endpoints = _warm_pool_spec(client, ctx)
+        changed = fill(client, pool_key(parameters, endpoints), parameters, endpoints, size, _create_attached)
+    ctx.logger.info('{0} {1} containers of the warm pool of {2}'.format(
+        'Created' if changed >= 0 else 'Removed', abs(changed), parameters['name']))
 
 
 @operation()
@@ -271,14 +883,77 @@ def create_container(client, ctx, **override_parameters):
 def start_container(client, ctx):
     container_id = ctx.instance.runtime_properties['container_id']
     container = client.containers.get(container_id)
-    container.start()
+    wait_for = ctx.node.properties.get('wait_for')
+    if wait_for in ('running', 'healthy'):
+        timeout = ctx.node.properties.get('readiness_timeout') or DEFAULT_READINESS_TIMEOUT
+        start_and_wait(client, container, wait_for, timeout=timeout, logger=ctx.logger)
+    else:
+        container.start()
+        # the attributes were fetched before the start, when no addresses were assigned yet
+        container.reload()
 
     network_settings = container.attrs['NetworkSettings']['Networks']
     networks = ctx.instance.runtime_properties.get('networks', {})
     for network_name, network_details in networks.items():
-        network_details['ip'] = network_settings[network_name]['IPAddress']
+        network_details['ip'] = network_settings[network_details.get('network_name', network_name)]['IPAddress']
     ctx.instance.runtime_properties['networks'] = networks
 
+    if ctx.node.properties.get('probe_ports'):
+        published = published_ports(container, ctx.node.properties['port_bindings'], docker_host_address(ctx.instance))
+        timeout = ctx.node.properties.get('port_probe_timeout') or DEFAULT_PORT_TIMEOUT
+        ctx.instance.runtime_properties['port_ready_seconds'] = probe_ports(published, timeout)
+
+    if (ctx.node.properties.get('log_follow') or {}).get('on_start'):
+        _follow_container_logs(client, ctx, container)
+
+
+def _follow_container_logs(client, ctx, container, **overrides):
+    settings = log_settings(ctx.node.properties.get('log_follow'), overrides)
+    name = container.name
+
+    def forward(lines):
+        ctx.logger.info('[{0}] {1}'.format(name, '\n'.join(lines)))
+
+    ctx.instance.runtime_properties['logs'] = follow_logs(
+        client, container.id, forward, settings, tty=bool(container.attrs['Config'].get('Tty')))
+
+
+@operation()
+@with_docker_client()
+def follow_container_logs(client, ctx, **overrides):
+    """Forward the container's output to the operation log for a while; keep its tail."""
+    container = client.containers.get(ctx.instance.runtime_properties['container_id'])
+    _follow_container_logs(client, ctx, container, **overrides)
+
+
+@operation()
+@with_docker_client()
+def exec_command(client, ctx, command, user='', environment=None, workdir=None, tty=False, parallelism=0,
+                 fail_on_error=True):
+    """Run a command in the instance's container, or in every replica of a group, streaming its output.
+
+    ``parallelism`` caps how many containers of this node run the command at
+    once, across all the instances' operations on this machine.
+    """
+    settings = log_settings(ctx.node.properties.get('log_follow'))
+    container_ids = ctx.instance.runtime_properties.get('replica_ids') or \
+        [ctx.instance.runtime_properties['container_id']]
+
+    def run(container_id):
+        def forward(level):
+            return lambda lines: level('[{0}] {1}'.format(container_id[:12], '\n'.join(lines)))
+
+        with bounded_slot(parallelism, 'exec', ctx.deployment.id, ctx.node.id):
+            return run_exec(client, container_id, command, forward(ctx.logger.info), forward(ctx.logger.warning),
+                            settings, user=user, environment=environment, workdir=workdir, tty=tty)
+
+    results = run_parallel(run, [c for c in container_ids if c], parallelism or DEFAULT_PARALLELISM)
+    ctx.instance.runtime_properties['exec'] = {'command': command, 'results': results}
+    failed = [r for r in results if r['exit_code'] != 0]
+    if failed and fail_on_error:
+        raise RuntimeError('{0} exited with {1} in {2} of {3} containers'.format(
+            command, failed[0]['exit_code'], len(failed), len(results)))
+
 
 @operation()
 @with_docker_client()
@@ -288,19 +963,12 @@ def stop_container(client, ctx):
     except docker.errors.NotFound:
         pass
     else:
-        container.stop()
+        container.stop(timeout=ctx.node.properties.get('stop_timeout', DEFAULT_STOP_TIMEOUT))
 
 
 @operation()
 @with_docker_client()
 def delete_container(client, ctx):
-    connected = ctx.instance.runtime_properties.get('connected', {})
-    for target_name, connection_details in connected.items():
-        network = client.networks.get(connection_details['net_id'])
-        container = client.containers.get(connection_details['container_id'])
-        network.disconnect(container)
-        network.remove()
-
     try:
         container = client.containers.get(ctx.instance.runtime_properties['container_id'])
     except docker.errors.NotFound:
@@ -308,6 +976,232 @@ def delete_container(client, ctx):
     else:
         container.remove()
 
+    if ctx.node.properties.get('warm_pool_size') and ctx.instance.runtime_properties.get('create_spec') and \
+            ctx.workflow_id == 'uninstall':
+        # stopped members would keep the image, volumes and networks in use; a scale-in keeps the pool
+        # for the next scale-out
+        parameters, endpoints = _warm_pool_spec(client, ctx)
+        drained = drain(client, pool_key(parameters, endpoints), parameters['name'])
+        ctx.logger.info('Removed {0} containers of the warm pool of {1}'.format(drained, parameters['name']))
+
+    _release_networks(client, ctx.instance.runtime_properties)
+
+
+def _release_networks(client, runtime_properties):
+    # the container is gone by now, so its own endpoints no longer keep the networks in use
+    shared_network = runtime_properties.get('shared_network')
+    if shared_network:
+        release_shared_network(client, shared_network['network_id'], shared_network['network_name'])
+    else:
+        _remove_connected_networks(client, runtime_properties)
+
+
+def _remove_connected_networks(client, runtime_properties):
+    def remove(connection_details):
+        try:
+            network = client.networks.get(connection_details['net_id'])
+        except docker.errors.NotFound:
+            # already removed, e.g. by teardown_deployment
+            return
+        try:
+            network.disconnect(connection_details['container_id'], force=True)
+        except docker.errors.NotFound:
+            pass
+        network.remove()
+
+    run_parallel(remove, runtime_properties.get('connected', {}).values())
+
+
+def _replica_name(name, index):
+    return '{0}_{1}'.format(name, index)
+
+
+@operation()
+@with_docker_client()
+def create_container_group(client, ctx, **override_parameters):
+    """Create ``replicas`` identical containers from one resolved spec.
+
+    Relationships are resolved once and the containers are created by a bounded
+    thread pool. Their ids are kept as one list, in replica order.
+    """
+    with shared_network_lock(client, ctx):
+        parameters, endpoints, runtime_properties = _resolve_container_spec(client, ctx, override_parameters)
+        parameters['labels'] = _with_labels(parameters.get('labels'), {GROUP_LABEL: ctx.instance.id})
+        replicas = ctx.node.properties.get('replicas', 1)
+        ctx.instance.runtime_properties.update(runtime_properties)
+
+        created = [None] * replicas
+
+        def create(index):
+            created[index] = _create_attached(
+                client, dict(parameters, name=_replica_name(parameters['name'], index)), endpoints)
+
+        try:
+            run_parallel(create, range(replicas),
+                         ctx.node.properties.get('replica_concurrency') or DEFAULT_PARALLELISM)
+        finally:
+            # keep whatever was created, so that delete can clean up after a partial failure
+            ctx.instance.runtime_properties['replica_ids'] = created
+    ctx.logger.info('Created {0} replicas of {1}'.format(replicas, parameters['name']))
+
+
+@operation()
+@with_docker_client()
+def start_container_group(client, ctx):
+    replica_ids = ctx.instance.runtime_properties['replica_ids']
+    run_parallel(client.api.start, replica_ids,
+                 ctx.node.properties.get('replica_concurrency') or DEFAULT_PARALLELISM)
+
+    # one list call instead of an inspect per replica to learn the addresses
+    summaries = client.api.containers(filters={'label': '{0}={1}'.format(GROUP_LABEL, ctx.instance.id)})
+    attached = {summary['Id']: summary['NetworkSettings']['Networks'] for summary in summaries}
+    networks = ctx.instance.runtime_properties.get('networks', {})
+    ctx.instance.runtime_properties['replica_ips'] = {
+        details['network_name']: [
+            attached.get(container_id, {}).get(details['network_name'], {}).get('IPAddress')
+            for container_id in replica_ids
+        ]
+        for details in networks.values()
+    }
+
+
+@operation()
+@with_docker_client()
+def stop_container_group(client, ctx):
+    def stop(container_id):
+        try:
+            client.api.stop(container_id, timeout=ctx.node.properties.get('stop_timeout', DEFAULT_STOP_TIMEOUT))
+        except docker.errors.NotFound:
+            pass
+
+    run_parallel(stop, [c for c in ctx.instance.runtime_properties.get('replica_ids', []) if c],
+                 ctx.node.properties.get('replica_concurrency') or DEFAULT_PARALLELISM)
+
+
+@operation()
+@with_docker_client()
+def delete_container_group(client, ctx):
+    def remove(container_id):
+        try:
+            client.api.remove_container(container_id, force=True)
+        except docker.errors.NotFound:
+            pass
+
+    run_parallel(remove, [c for c in ctx.instance.runtime_properties.get('replica_ids', []) if c],
+                 ctx.node.properties.get('replica_concurrency') or DEFAULT_PARALLELISM)
+    _release_networks(client, ctx.instance.runtime_properties)
+
+
+@operation()
+@with_docker_client()
+def teardown_deployment(client, ctx, stop_timeout=DEFAULT_STOP_TIMEOUT, deadline=None,
+                        concurrency=DEFAULT_TEARDOWN_CONCURRENCY):
+    """Remove all of the deployment's containers, networks and volumes on this host at once.
+
+    Meant to run before uninstall, whose per-instance delete operations then
+    find nothing left to remove.
+    """
+    removed = teardown(client, '{0}={1}'.format(DEPLOYMENT_LABEL, ctx.deployment.id), stop_timeout=stop_timeout,
+                       deadline=deadline, limit=concurrency)
+    ctx.logger.info('Removed {containers} containers, {networks} networks and {volumes} volumes '
+                    'in {seconds}s'.format(**removed))
+    ctx.instance.runtime_properties['teardown'] = removed
+
+
+def _placed_on(node_instance, host_instance_id):
+    if (node_instance.runtime_properties or {}).get('docker_host') == host_instance_id:
+        return True
+    return any(rel.get('type') == CONTAINER_IN_HOST_TYPE and rel.get('target_id') == host_instance_id
+               for rel in node_instance.relationships or [])
+
+
+@operation()
+@with_docker_client()
+def reconcile_deployment(client, ctx, remove_orphans=True, concurrency=DEFAULT_TEARDOWN_CONCURRENCY):
+    """Diff the deployment's resources on this host against the runtime properties and heal the drift.
+
+    The daemon is asked once per kind of resource, by label, whatever the number
+    of node instances placed on the host.
+    """
+    rest = get_rest_client()
+    node_instances = rest.node_instances.list(deployment_id=ctx.deployment.id)
+    placed = [i for i in node_instances if _placed_on(i, ctx.instance.id)]
+    changes, updates = reconcile(client, '{0}={1}'.format(DEPLOYMENT_LABEL, ctx.deployment.id), placed,
+                                 set(i.id for i in node_instances), _create_attached,
+                                 remove_orphans=remove_orphans, limit=concurrency)
+    for node_instance in placed:
+        if node_instance.id in updates:
+            runtime_properties = dict(node_instance.runtime_properties, **updates[node_instance.id])
+            rest.node_instances.update(node_instance.id, runtime_properties=runtime_properties,
+                                       version=node_instance.version)
+
+    ctx.logger.info('Recreated {0}, restarted {1}, removed {2} orphaned resources, {3} in sync'.format(
+        len(changes['recreated']), len(changes['restarted']), changes['removed'], changes['in_sync']))
+    ctx.instance.runtime_properties['reconcile'] = changes
+
+
+@operation()
+@with_docker_client()
+def prune_deployment(client, ctx, containers=False, images=False, networks=False, volumes=False,
+                     build_cache_dir='', build_cache_max_age=DEFAULT_SWEEP_MAX_AGE):
+    """Prune the deployment's unused resources on this host and sweep the local build context cache.
+
+    Each kind of resource is removed by a single prune call filtered on the
+    deployment label, so only what the daemon considers unused goes away. That
+    includes the images, networks and volumes of live nodes no container uses,
+    hence each kind is opt-in. Snapshots are never pruned.
+    """
+    filters = {'label': '{0}={1}'.format(DEPLOYMENT_LABEL, ctx.deployment.id)}
+    pruned = {}
+    reclaimed = 0
+    if containers:
+        result = client.api.prune_containers(filters=filters)
+        pruned['containers'] = len(result.get('ContainersDeleted') or [])
+        reclaimed += result.get('SpaceReclaimed') or 0
+    if networks:
+        result = client.api.prune_networks(filters=filters)
+        pruned['networks'] = len(result.get('NetworksDeleted') or [])
+    if volumes:
+        result = client.api.prune_volumes(filters=filters)
+        pruned['volumes'] = len(result.get('VolumesDeleted') or [])
+        reclaimed += result.get('SpaceReclaimed') or 0
+    if images:
+        # unused rather than only dangling images: the deployment's builds are tagged
+        result = client.api.prune_images(filters=dict(filters, dangling=False, **{'label!': SNAPSHOT_LABEL}))
+        deleted = [image['Deleted'] for image in result.get('ImagesDeleted') or [] if image.get('Deleted')]
+        inventory = ImageInventory(host_key(client))
+        for image_id in deleted:
+            inventory.remove(image_id)
+        pruned['images'] = len(deleted)
+        reclaimed += result.get('SpaceReclaimed') or 0
+
+    build_cache_reclaimed = BuildContextCache(cache_dir=build_cache_dir or None).sweep(build_cache_max_age)
+    ctx.logger.info('Pruned {0}, reclaimed {1} bytes on the host and {2} bytes of build contexts'.format(
+        pruned, reclaimed, build_cache_reclaimed))
+    ctx.instance.runtime_properties['prune'] = dict(pruned, reclaimed_bytes=reclaimed,
+                                                    build_cache_reclaimed_bytes=build_cache_reclaimed)
+
+
+@operation()
+@with_docker_client()
+def sample_deployment_stats(client, ctx, seconds=60, interval=5, concurrency=DEFAULT_PARALLELISM,
+                            timeseries_file=''):
+    """Sample the resource usage of the deployment's running containers on this host over ``seconds``.
+
+    The mean, p95 and max of every metric, per container and summed over all
+    of them, go to the stats runtime property; each sample also goes to
+    ``timeseries_file`` when one is given.
+    """
+    rounds = int(seconds // interval) + 1 if interval else 1
+    labels = '{0}={1}'.format(DEPLOYMENT_LABEL, ctx.deployment.id)
+    if timeseries_file:
+        with open(timeseries_file, 'a') as timeseries:
+            aggregates = sample(client, labels, rounds, interval, limit=concurrency, timeseries=timeseries)
+    else:
+        aggregates = sample(client, labels, rounds, interval, limit=concurrency)
+    ctx.logger.info('Sampled {0} containers {1} times'.format(len(aggregates['containers']), rounds))
+    ctx.instance.runtime_properties['stats'] = dict(aggregates, rounds=rounds, interval=interval)
+
 
 @operation()
 @with_docker_client()
@@ -326,11 +1220,9 @@ def create_network(client, ctx):
     if not external:
         if network:
             raise RuntimeError('Network {0} already exists'.format(network_name))
-        network = client.networks.create(
-            name=network_name,
-            driver=props['driver'],
-            options=props['options']
-        )
+        create_spec = dict(name=network_name, driver=props['driver'], options=props['options'], **_label_kwargs(ctx))
+        network = client.networks.create(**create_spec)
+        ctx.instance.runtime_properties['create_spec'] = create_spec
 
     ctx.logger.info('Created network: {0}'.format(network.name))
     ctx.instance.runtime_properties['network_id'] = network.id
@@ -343,7 +1235,10 @@ def delete_network(client, ctx):
     if 'network_id' in ctx.instance.runtime_properties:
         if ctx.node.properties['external']:
             return
-        network = client.networks.get(ctx.instance.runtime_properties['network_id'])
+        try:
+            network = client.networks.get(ctx.instance.runtime_properties['network_id'])
+        except docker.errors.NotFound:
+            return
         network.remove()
 
 
@@ -353,28 +1248,101 @@ def create_volume(client, ctx):
     volume_name = ctx.node.properties['name'] or ctx.node.name
     mountpoint = ctx.node.properties.get('source')
     if not mountpoint:
-        volume = client.volumes.create(
-            name=volume_name,
-            driver=ctx.node.properties['driver'],
-            driver_opts=ctx.node.properties['driver_opts'],
-        )
+        create_spec = dict(name=volume_name, driver=ctx.node.properties['driver'],
+                           driver_opts=ctx.node.properties['driver_opts'], **_label_kwargs(ctx))
+        seed_hash = _seed_hash(ctx)
+        if seed_hash:
+            try:
+                seeded = (client.api.inspect_volume(volume_name).get('Labels') or {}).get(SEED_LABEL)
+                existed = True
+            except docker.errors.NotFound:
+                seeded, existed = None, False
+            labels = _with_labels(create_spec.get('labels'), {SEED_LABEL: seed_hash})
+            volume = client.volumes.create(**dict(create_spec, labels=labels))
+        else:
+            volume = client.volumes.create(**create_spec)
+        # what reconcile recreates the volume from, empty and so without the seed label
+        ctx.instance.runtime_properties['create_spec'] = create_spec
         ctx.logger.info('Created volume {0}'.format(volume.name))
         ctx.instance.runtime_properties['volume_created'] = True
         ctx.instance.runtime_properties['volume_id'] = volume.id
         mountpoint = volume.id
+        if seed_hash and seeded == seed_hash:
+            ctx.logger.info('Volume {0} is already seeded with {1}'.format(volume.name, seed_hash))
+        elif seed_hash:
+            if seeded is not None:
+                ctx.logger.warning('Volume {0} existed with another seed, its seed label stays {1}'.format(
+                    volume.name, seeded))
+            try:
+                _seed_volume(client, ctx, volume.name)
+            except Exception:
+                if not existed:
+                    # the volume already carries the seed label, a retry would take it as seeded
+                    ignore_missing(client.api.remove_volume, volume.name, force=True)
+                raise
+        ctx.instance.runtime_properties['seed_hash'] = seed_hash
     else:
         ctx.instance.runtime_properties['volume_created'] = False
     ctx.instance.runtime_properties['volume_name'] = volume_name
     ctx.instance.runtime_properties['volume_mountpoint'] = mountpoint
 
 
+def _seed_hash(ctx):
+    """Identifies the seed content: blueprint resources by the blueprint upload, a local file by its size and mtime."""
+    props = ctx.node.properties
+    path = props.get('seed_path') or '/'
+    if props.get('seed_tarball'):
+        tarball = props['seed_tarball']
+        if os.path.isabs(tarball):
+            stat = os.stat(tarball)
+            return source_key(tarball, path, {'size': stat.st_size, 'mtime': stat.st_mtime})
+        return source_key(blueprint_source(ctx), tarball, {'path': path})
+    if props.get('seed_resources'):
+        return source_key(blueprint_source(ctx), props['seed_resources'], {'path': path})
+    return None
+
+
+def _seed_archive(ctx):
+    props = ctx.node.properties
+    tarball = props.get('seed_tarball')
+    if tarball and os.path.isabs(tarball):
+        for chunk in stream_tarball(tarball):
+            yield chunk
+    elif tarball:
+        path = ctx.download_resource(tarball)
+        try:
+            for chunk in stream_tarball(path):
+                yield chunk
+        finally:
+            os.remove(path)
+    else:
+        content = ctx.get_resource(props['seed_resources'])
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        files = [filename.strip() for filename in content.splitlines() if filename.strip()]
+        for chunk in stream_context(ctx.download_resource, props['seed_resources'], files):
+            yield chunk
+
+
+def _seed_volume(client, ctx, volume_name):
+    helper_image = ctx.node.properties.get('seed_helper_image') or DEFAULT_SEED_HELPER_IMAGE
+    _ensure_pulled(client, ctx, _image_inventory(client, ctx), *_split_reference(helper_image))
+    started = time.time()
+    seed_volume(client, volume_name, helper_image, _seed_archive(ctx), ctx.node.properties.get('seed_path') or '/',
+                labels=_resource_labels(ctx) or None)
+    ctx.logger.info('Seeded volume {0} in {1:.1f}s'.format(volume_name, time.time() - started))
+
+
 @operation()
 @with_docker_client()
 def delete_volume(client, ctx):
     if not ctx.instance.runtime_properties.get('volume_created'):
         return
     volume_name = ctx.instance.runtime_properties['volume_name']
-    volume = client.volumes.get(ctx.instance.runtime_properties['volume_id'])
+    try:
+        volume = client.volumes.get(ctx.instance.runtime_properties['volume_id'])
+    except docker.errors.NotFound:
+        return
     volume.remove(force=True)
     ctx.logger.info('Removed volume {0}'.format(volume_name))
 
@@ -386,8 +1354,7 @@ def create_secret(client, ctx):
     secret = client.secrets.create(
         name=secret_name,
         data=ctx.node.properties['data'],
-        lables=ctx.node.properties['labels'],
-        driver=ctx.node.properties['driver'],
+        labels=ctx.node.properties['labels'],
     )
     ctx.instance.runtime_properties['secret_id'] = secret.id
     ctx.instance.runtime_properties['secret_name'] = secret_name
@@ -397,6 +1364,116 @@ def create_secret(client, ctx):
 @with_docker_client()
 def delete_secret(client, ctx):
     secret_name = ctx.instance.runtime_properties['secret_name']
-    secret = client.volumes.get(ctx.instance.runtime_properties['secret_id'])
-    secret.remove(force=True)
+    secret = client.secrets.get(ctx.instance.runtime_properties['secret_id'])
+    secret.remove()
     ctx.logger.info('Removed secret {0}'.format(secret_name))
+
+
+def _service_mode(ctx, replicas=None):
+    if ctx.node.properties.get('mode') == 'global':
+        return ServiceMode('global')
+    return ServiceMode('replicated', replicas if replicas is not None else ctx.node.properties['replicas'])
+
+
+def _service_ports(port_bindings):
+    # same {container port: published port} form as a docker.Container's port_bindings
+    ports = {}
+    for target, published in port_bindings.items():
+        port, _, protocol = str(target).partition('/')
+        ports[int(published)] = (int(port), protocol) if protocol else int(port)
+    return ports
+
+
+def _update_service(client, service_id, **changes):
+    """Change parts of a service's spec; the API replaces the whole spec on update."""
+    service = client.api.inspect_service(service_id)
+    spec = service['Spec']
+    kwargs = {
+        'task_template': spec['TaskTemplate'],
+        'name': spec['Name'],
+        'labels': spec.get('Labels'),
+        'mode': spec.get('Mode'),
+        'update_config': spec.get('UpdateConfig'),
+        'networks': spec.get('Networks'),
+        'endpoint_spec': spec.get('EndpointSpec'),
+    }
+    kwargs.update(changes)
+    client.api.update_service(service_id, service['Version']['Index'], **kwargs)
+
+
+@operation()
+@with_docker_client()
+def create_service(client, ctx):
+    """Create a swarm service, resolving the image, networks and volumes like create_container does."""
+    props = ctx.node.properties
+    volumes = find_connected_nodes(ctx, CONNECTED_TO_VOLUME, _make_volume_details)
+    networks = find_connected_nodes(ctx, CONNECTED_TO_NETWORK, _make_network_details)
+    parameters = {
+        'image': find_image(ctx, reference=True),
+        'command': props['command'],
+        'name': props['name'] or ctx.node.name,
+        'env': ['{0}={1}'.format(k, v) for k, v in sorted(props['environment'].items())],
+        'mounts': ['{0}:{1}:{2}'.format(v['volume_mountpoint'], v['mount_at'], v['mode'])
+                   for _, v in sorted(volumes.items())],
+        'networks': [n['network_name'] for _, n in sorted(networks.items())],
+        'mode': _service_mode(ctx),
+        'update_config': UpdateConfig(
+            parallelism=props['update_parallelism'],
+            # the API takes nanoseconds
+            delay=int(props['update_delay'] * 10 ** 9),
+            failure_action=props['update_failure_action'],
+        ),
+        'endpoint_spec': EndpointSpec(ports=_service_ports(props['port_bindings'])),
+    }
+    labels = _resource_labels(ctx)
+    if labels:
+        parameters['labels'] = labels
+        parameters['container_labels'] = labels
+    parameters.update(props['additional_service_parameters'])
+
+    service = client.services.create(**parameters)
+    ctx.logger.info('Created service {0}'.format(service.name))
+    ctx.instance.runtime_properties['service_id'] = service.id
+    ctx.instance.runtime_properties['service_name'] = service.name
+    ctx.instance.runtime_properties['replicas'] = props['replicas']
+
+
+def _running_tasks(client, service_id):
+    tasks = client.api.tasks(filters={'service': service_id, 'desired-state': 'running'})
+    return len([t for t in tasks if t['Status']['State'] == 'running'])
+
+
+@operation()
+@with_docker_client()
+def start_service(client, ctx):
+    """Wait until the swarm runs the desired number of tasks, when asked to."""
+    timeout = ctx.node.properties.get('readiness_timeout')
+    if not timeout or ctx.node.properties.get('mode') == 'global':
+        return
+    service_id = ctx.instance.runtime_properties['service_id']
+    desired = ctx.instance.runtime_properties['replicas']
+    deadline = time.time() + timeout
+    running = _running_tasks(client, service_id)
+    while running < desired:
+        if time.time() > deadline:
+            raise RuntimeError('{0} of {1} tasks of {2} running after {3}s'.format(
+                running, desired, ctx.instance.runtime_properties['service_name'], timeout))
+        time.sleep(1)
+        running = _running_tasks(client, service_id)
+
+
+@operation()
+@with_docker_client()
+def scale_service(client, ctx, replicas):
+    """Hand the new replica count to the swarm scheduler."""
+    _update_service(client, ctx.instance.runtime_properties['service_id'], mode=_service_mode(ctx, int(replicas)))
+    ctx.instance.runtime_properties['replicas'] = int(replicas)
+
+
+@operation()
+@with_docker_client()
+def delete_service(client, ctx):
+    try:
+        client.api.remove_service(ctx.instance.runtime_properties['service_id'])
+    except docker.errors.NotFound:
+        pass
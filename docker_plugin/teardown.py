@@ -0,0 +1,63 @@
+import time
+
+import docker.errors
+
+from docker_plugin.concurrency import run_parallel
+
+DEFAULT_STOP_TIMEOUT = 10
+DEFAULT_CONCURRENCY = 16
+
+
+def ignore_missing(func, *args, **kwargs):
+    try:
+        func(*args, **kwargs)
+        return True
+    except docker.errors.NotFound:
+        return False
+
+
+def remove_network(client, network_id):
+    try:
+        client.api.remove_network(network_id)
+    except docker.errors.NotFound:
+        return False
+    except docker.errors.APIError:
+        # still has endpoints of containers that are not ours; the list call does not return them
+        attached = client.api.inspect_network(network_id).get('Containers') or {}
+        for container_id in attached:
+            ignore_missing(client.api.disconnect_container_from_network, container_id, network_id, force=True)
+        ignore_missing(client.api.remove_network, network_id)
+    return True
+
+
+def teardown(client, labels, stop_timeout=DEFAULT_STOP_TIMEOUT, deadline=None, limit=DEFAULT_CONCURRENCY,
+             clock=time.time):
+    """Remove every container, network and volume carrying ``labels``, in that order.
+
+    Containers are stopped concurrently, each given ``stop_timeout`` seconds to
+    exit but never more than what is left of ``deadline``; whatever is still
+    running then is killed by the forced remove.
+    """
+    started = clock()
+    filters = {'label': labels}
+
+    def stop_and_remove(summary):
+        if summary.get('State') == 'running':
+            timeout = stop_timeout
+            if deadline is not None:
+                timeout = int(max(0, min(timeout, deadline - (clock() - started))))
+            if not ignore_missing(client.api.stop, summary['Id'], timeout=timeout):
+                return False
+        return ignore_missing(client.api.remove_container, summary['Id'], force=True)
+
+    containers = run_parallel(stop_and_remove, client.api.containers(all=True, filters=filters), limit)
+    networks = run_parallel(lambda network: remove_network(client, network['Id']),
+                            client.api.networks(filters=filters), limit)
+    volumes = run_parallel(lambda volume: ignore_missing(client.api.remove_volume, volume['Name'], force=True),
+                           client.api.volumes(filters=filters).get('Volumes') or [], limit)
+    return {
+        'containers': sum(containers),
+        'networks': sum(networks),
+        'volumes': sum(volumes),
+        'seconds': round(clock() - started, 3),
+    }
@@ -0,0 +1,175 @@
+"""Drive the plugin's operations against a fake Docker Engine and report their cost.
+
+    python docker_plugin/tests/benchmark.py --instances 1 10 100 1000 --latency 0.002
+
+For each operation it reports ops/sec, Docker API calls per operation (as seen
+by the plugin's API instrumentation) and p50/p99 latency.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+from cloudify.mocks import MockCloudifyContext, MockNodeContext, MockNodeInstanceContext, \
+    MockRelationshipSubjectContext
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [TESTS_DIR, os.path.dirname(os.path.dirname(TESTS_DIR))]
+
+from docker_plugin import tasks  # noqa: E402
+from docker_plugin.client_pool import CLIENT_POOL  # noqa: E402
+from docker_plugin.concurrency import run_parallel  # noqa: E402
+from fake_engine import FakeEngine  # noqa: E402
+
+CONTAINER_OPERATIONS = ('create_container', 'start_container', 'stop_container', 'delete_container')
+
+
+class _Relationship(object):
+    def __init__(self, type_hierarchy, node_name, properties=None, runtime_properties=None):
+        self.type = type_hierarchy
+        self.type_hierarchy = [type_hierarchy]
+        self.target = MockRelationshipSubjectContext(
+            node=MockNodeContext(node_name, properties or {}),
+            instance=MockNodeInstanceContext(node_name, runtime_properties or {}),
+        )
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Benchmark(object):
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.timings = {}
+        self.api_calls = {}
+        self.deployment_id = 'bench-{0}'.format(uuid4().hex[:8])
+
+    def host_relationship(self):
+        return _Relationship(tasks.CONTAINER_IN_HOST_TYPE, 'docker_host', {'ip': '127.0.0.1'},
+                             {'connection_kwargs': {'base_url': self.base_url}})
+
+    def context(self, node_name, properties, relationships=(), runtime_properties=None):
+        return MockCloudifyContext(
+            node_id='{0}_{1}'.format(node_name, uuid4().hex[:6]),
+            node_name=node_name,
+            deployment_id=self.deployment_id,
+            properties=properties,
+            runtime_properties=runtime_properties or {},
+            relationships=[self.host_relationship()] + list(relationships),
+        )
+
+    def run_operation(self, operation, ctx):
+        started = time.time()
+        getattr(tasks, operation)(ctx)
+        elapsed = time.time() - started
+        summary = ctx.instance.runtime_properties['docker_api_metrics'][operation]
+        calls = summary['calls'] - summary['by_call'].get('client.acquire', {}).get('count', 0)
+        self.timings.setdefault(operation, []).append(elapsed)
+        self.api_calls.setdefault(operation, []).append(calls)
+
+    def run(self, instances, concurrency=1):
+        image = self.context('image', {'repository': 'bench', 'tag': 'latest'})
+        network = self.context('network', {'name': '{0}_net'.format(self.deployment_id), 'driver': None,
+                                           'options': {}, 'external': False})
+        volume = self.context('volume', {'name': '{0}_vol'.format(self.deployment_id), 'driver': 'local',
+                                         'driver_opts': {}, 'mount_at': '/data', 'mode': 'rw', 'source': None})
+        self.run_operation('build_image', image)
+        self.run_operation('create_network', network)
+        self.run_operation('create_volume', volume)
+
+        relationships = [
+            _Relationship(tasks.FROM_IMAGE, 'image', runtime_properties=image.instance.runtime_properties),
+            _Relationship(tasks.CONNECTED_TO_NETWORK, 'network',
+                          runtime_properties=network.instance.runtime_properties),
+            _Relationship(tasks.CONNECTED_TO_VOLUME, 'volume', {'mount_at': '/data', 'mode': 'rw'},
+                          volume.instance.runtime_properties),
+        ]
+        containers = [
+            self.context('worker', {
+                'name': '{0}_worker_{1}'.format(self.deployment_id, i),
+                'command': None,
+                'port_bindings': {},
+                'environment': {},
+                'network_aliases': {},
+                'additional_create_parameters': {},
+            }, relationships)
+            for i in range(instances)
+        ]
+        started = time.time()
+        for operation in CONTAINER_OPERATIONS:
+            run_parallel(lambda ctx: self.run_operation(operation, ctx), containers, concurrency)
+        wall = time.time() - started
+
+        self.run_operation('delete_volume', volume)
+        self.run_operation('delete_network', network)
+        self.run_operation('delete_image', image)
+        return wall
+
+    def report(self):
+        rows = []
+        for operation, timings in sorted(self.timings.items()):
+            total = sum(timings)
+            rows.append({
+                'operation': operation,
+                'count': len(timings),
+                'ops_per_sec': len(timings) / total if total else 0.0,
+                'api_calls_per_op': float(sum(self.api_calls[operation])) / len(timings),
+                'p50_ms': percentile(timings, 0.5) * 1000,
+                'p99_ms': percentile(timings, 0.99) * 1000,
+            })
+        return rows
+
+
+def format_report(rows):
+    lines = ['{0:<18} {1:>6} {2:>10} {3:>12} {4:>9} {5:>9}'.format(
+        'operation', 'count', 'ops/sec', 'api calls/op', 'p50 ms', 'p99 ms')]
+    for row in rows:
+        lines.append('{operation:<18} {count:>6} {ops_per_sec:>10.1f} {api_calls_per_op:>12.2f} '
+                     '{p50_ms:>9.2f} {p99_ms:>9.2f}'.format(**row))
+    return '\n'.join(lines)
+
+
+def parse_endpoint_latency(values):
+    latencies = {}
+    for value in values or []:
+        name, _, seconds = value.rpartition('=')
+        latencies[name] = float(seconds)
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--instances', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of every endpoint, in seconds')
+    parser.add_argument('--endpoint-latency', action='append', metavar='"POST /containers/create=0.01"',
+                        help='delay of one endpoint, in seconds')
+    parser.add_argument('--tcp', action='store_true', help='listen on a local TCP port instead of a unix socket')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        for instances in args.instances:
+            engine = FakeEngine(socket_path=os.path.join(workdir, 'docker.sock'), tcp=args.tcp,
+                                latency=args.latency, endpoint_latency=parse_endpoint_latency(args.endpoint_latency))
+            with engine:
+                CLIENT_POOL.clear()
+                benchmark = Benchmark(engine.base_url)
+                wall = benchmark.run(instances, args.concurrency)
+            print('{0} instances, {1:.2f}s for the container lifecycle'.format(instances, wall))
+            print(format_report(benchmark.report()))
+            print('')
+    finally:
+        CLIENT_POOL.clear()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,763 @@
+"""A small in-memory stand-in for the Docker Engine HTTP API.
+
+It implements just the endpoints the plugin uses, with a configurable delay
+per endpoint, so the plugin's request pattern can be measured without a
+daemon. Endpoints are named like ``docker_plugin.metrics.call_name`` does,
+e.g. ``POST /containers/{id}/start``.
+"""
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import struct
+import tarfile
+import zlib
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, TCPServer, UnixStreamServer
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, TCPServer, UnixStreamServer
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+
+from docker_plugin.metrics import call_name
+
+
+class NotFound(Exception):
+    def __init__(self, kind, key):
+        # docker-py maps a 404 to ImageNotFound by this wording, as the daemon uses it
+        super(NotFound, self).__init__('No such {0}: {1}'.format(kind, key))
+
+
+class Conflict(Exception):
+    pass
+
+
+class RawStream(object):
+    """A body of unknown length ended by closing the connection, like a hijacked exec stream."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+
+class EngineState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.images = {}
+        self.containers = {}
+        self.networks = {}
+        self.volumes = {}
+        self.execs = {}
+        self.volume_files = {}
+        self.cpus = 8
+        self.memory = 16 * 1024 ** 3
+        self._ids = itertools.count(1)
+        self._ips = itertools.count(2)
+        self.kinds = {id(self.containers): 'container', id(self.networks): 'network', id(self.volumes): 'volume'}
+
+    def new_id(self, kind):
+        return hashlib.sha256('{0}{1}'.format(kind, next(self._ids)).encode('utf-8')).hexdigest()
+
+    def new_ip(self):
+        n = next(self._ips)
+        return '10.{0}.{1}.{2}'.format(n // 65536 % 256, n // 256 % 256, n % 256)
+
+    def find_image(self, ref):
+        if ':' not in ref.rsplit('/', 1)[-1] and not ref.startswith('sha256:'):
+            ref = '{0}:latest'.format(ref)
+        for image in self.images.values():
+            if ref in (image['Id'], image['Id'][len('sha256:'):]) or ref in image['RepoTags']:
+                return image
+        raise NotFound('image', ref)
+
+    def add_image(self, tag, labels=None, parent='', image_id=None):
+        image_id = image_id or 'sha256:' + self.new_id('image')
+        for image in self.images.values():
+            if tag in image['RepoTags']:
+                image['RepoTags'].remove(tag)
+        self.images[image_id] = {'Id': image_id, 'RepoTags': [tag], 'RepoDigests': [], 'Labels': labels or {},
+                                 'Config': {'Labels': labels or {}}, 'Size': 1024, 'ParentId': parent}
+        return self.images[image_id]
+
+    def find(self, collection, key):
+        for item in collection.values():
+            if key in (item['Id'], item.get('Name'), item.get('Name', '').lstrip('/')) or \
+                    (len(key) >= 12 and item['Id'].startswith(key)):
+                return item
+        raise NotFound(self.kinds[id(collection)], key)
+
+
+class FakeEngine(object):
+    """Fake daemon listening on a unix socket (default) or on a local TCP port."""
+
+    def __init__(self, socket_path=None, tcp=False, latency=0.0, endpoint_latency=None):
+        self.latency = latency
+        self.endpoint_latency = endpoint_latency or {}
+        self.state = EngineState()
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+        self.socket_path = socket_path
+        self.tcp = tcp
+        self.server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        if self.tcp:
+            return 'tcp://127.0.0.1:{0}'.format(self.server.server_address[1])
+        return 'unix://{0}'.format(self.socket_path)
+
+    def start(self):
+        engine = self
+
+        class Handler(_Handler):
+            pass
+
+        Handler.engine = engine
+        if self.tcp:
+            self.server = _ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        else:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.server = _ThreadingUnixServer(self.socket_path, Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if not self.tcp and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def record(self, name):
+        with self._calls_lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        delay = self.endpoint_latency.get(name, self.latency)
+        if delay:
+            time.sleep(delay)
+
+
+class _ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+ROUTES = []
+
+
+def route(method, pattern):
+    def decorator(f):
+        ROUTES.append((method, re.compile('^{0}$'.format(pattern)), f))
+        return f
+
+    return decorator
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    engine = None
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return 'fake-engine'
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            data = b''
+            while True:
+                size = int(self.rfile.readline().strip().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        path = re.sub(r'^/v1\.\d+', '', url.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self._read_body()
+        self.engine.record(call_name(method, path))
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                args = [unquote(arg) for arg in match.groups()]
+                payload = json.loads(body.decode('utf-8')) if body and handler.accepts_json else body
+                try:
+                    with self.engine.state.lock:
+                        result = handler(self.engine.state, query, payload, *args)
+                except NotFound as e:
+                    return self._send(404, {'message': str(e)})
+                except Conflict as e:
+                    return self._send(409, {'message': str(e)})
+                return self._send(*result)
+        self._send(404, {'message': 'page not found'})
+
+    def _send(self, status, payload=None, chunks=None):
+        self.send_response(status)
+        if chunks is not None:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in chunks:
+                data = chunk if isinstance(chunk, bytes) else json.dumps(chunk).encode('utf-8') + b'\r\n'
+                self.wfile.write('{0:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        if isinstance(payload, RawStream):
+            self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+            self.end_headers()
+            for chunk in payload.chunks:
+                self.wfile.write(chunk)
+            self.close_connection = True
+            return
+        if isinstance(payload, bytes):
+            data = payload
+            self.send_header('Content-Type', 'text/plain')
+        else:
+            data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _json(f):
+    f.accepts_json = True
+    return f
+
+
+def _raw(f):
+    f.accepts_json = False
+    return f
+
+
+def _labels_match(labels, label_filters):
+    for label_filter in label_filters:
+        key, _, value = label_filter.partition('=')
+        if key not in labels or (value and labels[key] != value):
+            return False
+    return True
+
+
+def _filters(query):
+    filters = json.loads(query.get('filters') or '{}')
+    return {k: list(v) if isinstance(v, (list, dict)) else [v] for k, v in filters.items()}
+
+
+@route('GET', r'/_ping')
+@_raw
+def ping(state, query, body):
+    return 200, b'OK'
+
+
+@route('GET', r'/version')
+@_raw
+def version(state, query, body):
+    return 200, {'ApiVersion': '1.26', 'Version': 'fake'}
+
+
+@route('GET', r'/info')
+@_raw
+def info(state, query, body):
+    running = sum(1 for c in state.containers.values() if c['State']['Running'])
+    return 200, {'NCPU': state.cpus, 'MemTotal': state.memory, 'Containers': len(state.containers),
+                 'ContainersRunning': running}
+
+
+@route('GET', r'/images/json')
+@_raw
+def list_images(state, query, body):
+    return 200, [{k: image[k] for k in ('Id', 'ParentId', 'RepoTags', 'RepoDigests', 'Labels', 'Size')}
+                 for image in state.images.values()]
+
+
+@route('GET', r'/images/(.+)/json')
+@_raw
+def inspect_image(state, query, body, name):
+    return 200, state.find_image(name)
+
+
+def registry_image_id(tag):
+    """The id of ``tag`` as pulled from the registry, the same on every engine."""
+    return 'sha256:' + hashlib.sha256('registry/{0}'.format(tag).encode('utf-8')).hexdigest()
+
+
+@route('POST', r'/images/create')
+@_raw
+def pull_image(state, query, body):
+    tag = '{0}:{1}'.format(query['fromImage'], query.get('tag') or 'latest')
+    state.add_image(tag, image_id=registry_image_id(tag))
+    return 200, None, [
+        {'status': 'Pulling from {0}'.format(query['fromImage']), 'id': query.get('tag') or 'latest'},
+        {'status': 'Pull complete', 'id': 'layer0'},
+        {'status': 'Status: Downloaded newer image for {0}'.format(tag)},
+    ]
+
+
+@route('POST', r'/build')
+@_raw
+def build_image(state, query, body):
+    labels = json.loads(query.get('labels') or '{}')
+    tag = query.get('t') or 'built:latest'
+    if ':' not in tag.rsplit('/', 1)[-1]:
+        tag += ':latest'
+    image = state.add_image(tag, labels)
+    return 200, None, [
+        {'stream': 'Step 1/1 : FROM scratch\n'},
+        {'stream': 'Successfully built {0}\n'.format(image['Id'][len('sha256:'):len('sha256:') + 12])},
+    ]
+
+
+@route('POST', r'/images/load')
+@_raw
+def load_image(state, query, body):
+    try:
+        with tarfile.open(fileobj=io.BytesIO(body), mode='r:*') as tar:
+            manifest = json.loads(tar.extractfile('manifest.json').read().decode('utf-8'))
+    except (tarfile.TarError, EOFError, zlib.error) as e:
+        # like the daemon, a broken archive is reported in the body of a 200
+        return 200, None, [{'errorDetail': {'message': str(e)}, 'error': str(e)}]
+    loaded = []
+    for entry in manifest:
+        image_id = 'sha256:' + entry['Config'].rsplit('/', 1)[-1].replace('.json', '')
+        for image in state.images.values():
+            image['RepoTags'] = [t for t in image['RepoTags'] if t not in entry.get('RepoTags', [])]
+        state.images[image_id] = {'Id': image_id, 'RepoTags': list(entry.get('RepoTags') or []), 'RepoDigests': [],
+                                  'Labels': {}, 'Config': {'Labels': {}}, 'Size': 1024, 'ParentId': ''}
+        loaded.append({'stream': 'Loaded image ID: {0}\n'.format(image_id)})
+    return 200, None, loaded
+
+
+@route('POST', r'/commit')
+@_json
+def commit(state, query, body):
+    container = state.find(state.containers, query['container'])
+    labels = dict(container['Config']['Labels'], **(body or {}).get('Labels') or {})
+    try:
+        parent = state.find_image(container['Image'])['Id']
+    except NotFound:
+        parent = ''
+    image = state.add_image('{0}:{1}'.format(query['repo'], query.get('tag') or 'latest'), labels, parent)
+    return 201, {'Id': image['Id']}
+
+
+@route('DELETE', r'/images/(.+)')
+@_raw
+def remove_image(state, query, body, name):
+    image = state.find_image(name)
+    if any(child['ParentId'] == image['Id'] for child in state.images.values()):
+        raise Conflict('conflict: unable to delete {0} (cannot be forced) - image has dependent child images'.format(
+            image['Id'][len('sha256:'):][:12]))
+    del state.images[image['Id']]
+    return 200, [{'Deleted': image['Id']}]
+
+
+@route('POST', r'/images/prune')
+@_raw
+def prune_images(state, query, body):
+    filters = _filters(query)
+    used = set(c['Image'] for c in state.containers.values())
+    deleted = []
+    for image in list(state.images.values()):
+        if used & set([image['Id']] + image['RepoTags']):
+            continue
+        if not _labels_match(image['Labels'], filters.get('label', [])):
+            continue
+        if any(_labels_match(image['Labels'], [label]) for label in filters.get('label!', [])):
+            continue
+        del state.images[image['Id']]
+        deleted.append(image)
+    return 200, {'ImagesDeleted': [{'Deleted': image['Id']} for image in deleted],
+                 'SpaceReclaimed': sum(image['Size'] for image in deleted)}
+
+
+def _attach(state, container, network, aliases=None):
+    network['Containers'][container['Id']] = {'Name': container['Name'].lstrip('/')}
+    container['NetworkSettings']['Networks'][network['Name']] = {
+        'NetworkID': network['Id'],
+        'Aliases': aliases,
+        'IPAddress': state.new_ip() if container['State']['Running'] else '',
+    }
+
+
+@route('POST', r'/containers/create')
+@_json
+def create_container(state, query, body):
+    name = query.get('name') or 'container_{0}'.format(len(state.containers))
+    if any(c['Name'] == '/' + name for c in state.containers.values()):
+        raise Conflict('name {0} is already in use'.format(name))
+    state.find_image(body['Image'])
+    container_id = state.new_id('container')
+    host_config = body.get('HostConfig') or {}
+    container = state.containers[container_id] = {
+        'Id': container_id,
+        'Name': '/' + name,
+        'Image': body['Image'],
+        'Config': {'Image': body['Image'], 'Labels': body.get('Labels') or {}, 'Healthcheck': body.get('Healthcheck')},
+        'HostConfig': host_config,
+        'State': {'Running': False, 'Status': 'created'},
+        'NetworkSettings': {'Networks': {}, 'Ports': {}},
+    }
+    endpoints = (body.get('NetworkingConfig') or {}).get('EndpointsConfig') or {}
+    for network_name, endpoint in endpoints.items():
+        _attach(state, container, state.find(state.networks, network_name), (endpoint or {}).get('Aliases'))
+    return 201, {'Id': container_id, 'Warnings': None}
+
+
+def _container_summary(container):
+    return {
+        'Id': container['Id'],
+        'Names': [container['Name']],
+        'Image': container['Image'],
+        'Labels': container['Config']['Labels'],
+        'State': container['State']['Status'],
+        'NetworkSettings': container['NetworkSettings'],
+    }
+
+
+@route('GET', r'/containers/json')
+@_raw
+def list_containers(state, query, body):
+    filters = _filters(query)
+    result = []
+    for container in state.containers.values():
+        if not query.get('all') in ('1', 'True', 'true') and not container['State']['Running']:
+            continue
+        if not _labels_match(container['Config']['Labels'], filters.get('label', [])):
+            continue
+        networks = filters.get('network')
+        if networks and not any(n['NetworkID'] in networks or name in networks
+                                for name, n in container['NetworkSettings']['Networks'].items()):
+            continue
+        result.append(_container_summary(container))
+    return 200, result
+
+
+@route('GET', r'/containers/([^/]+)/json')
+@_raw
+def inspect_container(state, query, body, container_id):
+    return 200, state.find(state.containers, container_id)
+
+
+@route('POST', r'/containers/([^/]+)/start')
+@_raw
+def start_container(state, query, body, container_id):
+    container = state.find(state.containers, container_id)
+    container['State'].update({'Running': True, 'Status': 'running'})
+    for endpoint in container['NetworkSettings']['Networks'].values():
+        endpoint['IPAddress'] = endpoint['IPAddress'] or state.new_ip()
+    return 204, None
+
+
+def _log_frames(container, lines, follow):
+    for line in lines:
+        data = line.encode('utf-8') + b'\n'
+        yield struct.pack('>BxxxL', 1, len(data)) + data
+    # a followed stream stays open while the container runs, as long as a test could wait for it
+    deadline = time.time() + 10
+    while follow and container['State']['Running'] and time.time() < deadline:
+        time.sleep(0.05)
+
+
+@route('GET', r'/containers/([^/]+)/logs')
+@_raw
+def container_logs(state, query, body, container_id):
+    container = state.find(state.containers, container_id)
+    lines = list(container.get('Logs') or [])
+    if query.get('tail', 'all') != 'all':
+        lines = lines[len(lines) - int(query['tail']):] if int(query['tail']) else []
+    return 200, None, _log_frames(container, lines, query.get('follow') == '1')
+
+
+def _stats_sample(state, container):
+    # "Usage" of a container is the cores and memory it keeps using and the bytes it moves per sample;
+    # the counters advance by one second per sample
+    usage = container.get('Usage') or {}
+    samples = container['Samples'] = container.get('Samples', 0) + 1
+    cpu_seconds = usage.get('cpus', 0) * 1e9
+
+    def cpu_stats(n):
+        return {'cpu_usage': {'total_usage': int(n * cpu_seconds)}, 'system_cpu_usage': int(n * state.cpus * 1e9),
+                'online_cpus': state.cpus}
+
+    return {
+        'read': '2017-01-01T00:00:{0:02d}Z'.format(samples % 60),
+        'cpu_stats': cpu_stats(samples),
+        'precpu_stats': cpu_stats(samples - 1),
+        'memory_stats': {'usage': usage.get('memory', 0) + 1024, 'limit': state.memory, 'stats': {'cache': 1024}},
+        'networks': {'eth0': {'rx_bytes': samples * usage.get('net', 0), 'tx_bytes': samples * usage.get('net', 0)}},
+        'blkio_stats': {'io_service_bytes_recursive': [
+            {'major': 8, 'minor': 0, 'op': 'Read', 'value': samples * usage.get('blkio', 0)},
+            {'major': 8, 'minor': 0, 'op': 'Write', 'value': 0},
+        ]},
+    }
+
+
+@route('GET', r'/containers/([^/]+)/stats')
+@_raw
+def container_stats(state, query, body, container_id):
+    return 200, _stats_sample(state, state.find(state.containers, container_id))
+
+
+def _frame(stream, text):
+    data = text.encode('utf-8')
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+@route('POST', r'/containers/([^/]+)/exec')
+@_json
+def create_exec(state, query, body, container_id):
+    container = state.find(state.containers, container_id)
+    if not container['State']['Running']:
+        raise Conflict('container {0} is not running'.format(container_id))
+    exec_id = state.new_id('exec')
+    state.execs[exec_id] = {'ID': exec_id, 'ContainerID': container['Id'], 'Cmd': body['Cmd'], 'Running': False,
+                            'ExitCode': None}
+    return 201, {'Id': exec_id}
+
+
+def _run_exec(exec_instance):
+    # "echo" prints its arguments, "fail" also writes to stderr and exits with 1
+    command = exec_instance['Cmd']
+    yield _frame(1, 'ran {0}\n'.format(' '.join(command)))
+    if command[0] == 'echo':
+        yield _frame(1, ' '.join(command[1:]) + '\n')
+    if command[0] == 'fail':
+        yield _frame(2, 'failed\n')
+    exec_instance['ExitCode'] = 1 if command[0] == 'fail' else 0
+
+
+@route('POST', r'/exec/([^/]+)/start')
+@_json
+def start_exec(state, query, body, exec_id):
+    if exec_id not in state.execs:
+        raise NotFound('exec instance', exec_id)
+    return 200, RawStream(_run_exec(state.execs[exec_id]))
+
+
+@route('GET', r'/exec/([^/]+)/json')
+@_raw
+def inspect_exec(state, query, body, exec_id):
+    if exec_id not in state.execs:
+        raise NotFound('exec instance', exec_id)
+    return 200, state.execs[exec_id]
+
+
+@route('POST', r'/containers/([^/]+)/rename')
+@_raw
+def rename_container(state, query, body, container_id):
+    container = state.find(state.containers, container_id)
+    name = '/' + query['name']
+    if any(c['Name'] == name for c in state.containers.values()):
+        raise Conflict('name {0} is already in use'.format(name))
+    container['Name'] = name
+    return 204, None
+
+
+@route('PUT', r'/containers/([^/]+)/archive')
+@_raw
+def put_archive(state, query, body, container_id):
+    # only unpacks into volumes, whose files are kept by path in volume_files
+    container = state.find(state.containers, container_id)
+    for bind in container['HostConfig'].get('Binds') or []:
+        volume_name, mount = bind.split(':')[:2]
+        if (query['path'].rstrip('/') + '/').startswith(mount.rstrip('/') + '/'):
+            prefix = query['path'][len(mount):].strip('/')
+            files = state.volume_files.setdefault(state.find(state.volumes, volume_name)['Name'], {})
+            with tarfile.open(fileobj=io.BytesIO(body), mode='r:*') as tar:
+                for member in tar.getmembers():
+                    if member.isfile():
+                        files['/'.join(p for p in (prefix, member.name) if p)] = tar.extractfile(member).read()
+            return 200, None
+    raise NotFound('path', query['path'])
+
+
+@route('POST', r'/containers/([^/]+)/stop')
+@_raw
+def stop_container(state, query, body, container_id):
+    container = state.find(state.containers, container_id)
+    container['State'].update({'Running': False, 'Status': 'exited'})
+    return 204, None
+
+
+@route('DELETE', r'/containers/([^/]+)')
+@_raw
+def remove_container(state, query, body, container_id):
+    container = state.find(state.containers, container_id)
+    if container['State']['Running'] and query.get('force') not in ('1', 'True', 'true'):
+        raise Conflict('container {0} is running'.format(container_id))
+    for network in state.networks.values():
+        network['Containers'].pop(container['Id'], None)
+    del state.containers[container['Id']]
+    return 204, None
+
+
+@route('POST', r'/containers/prune')
+@_raw
+def prune_containers(state, query, body):
+    filters = _filters(query)
+    deleted = [c['Id'] for c in state.containers.values()
+               if not c['State']['Running'] and _labels_match(c['Config']['Labels'], filters.get('label', []))]
+    for container_id in deleted:
+        remove_container(state, {}, None, container_id)
+    return 200, {'ContainersDeleted': deleted, 'SpaceReclaimed': 0}
+
+
+@route('POST', r'/networks/create')
+@_json
+def create_network(state, query, body):
+    if any(n['Name'] == body['Name'] for n in state.networks.values()):
+        raise Conflict('network {0} already exists'.format(body['Name']))
+    network_id = state.new_id('network')
+    state.networks[network_id] = {'Id': network_id, 'Name': body['Name'], 'Driver': body.get('Driver') or 'bridge',
+                                  'Labels': body.get('Labels') or {}, 'Containers': {}}
+    return 201, {'Id': network_id, 'Warning': ''}
+
+
+@route('GET', r'/networks')
+@_raw
+def list_networks(state, query, body):
+    filters = _filters(query)
+    result = []
+    for network in state.networks.values():
+        if filters.get('name') and network['Name'] not in filters['name']:
+            continue
+        if filters.get('id') and network['Id'] not in filters['id']:
+            continue
+        if not _labels_match(network['Labels'], filters.get('label', [])):
+            continue
+        result.append(network)
+    return 200, result
+
+
+@route('GET', r'/networks/([^/]+)')
+@_raw
+def inspect_network(state, query, body, network_id):
+    return 200, state.find(state.networks, network_id)
+
+
+@route('POST', r'/networks/([^/]+)/connect')
+@_json
+def connect_network(state, query, body, network_id):
+    network = state.find(state.networks, network_id)
+    container = state.find(state.containers, body['Container'])
+    _attach(state, container, network, (body.get('EndpointConfig') or {}).get('Aliases'))
+    return 200, None
+
+
+@route('POST', r'/networks/([^/]+)/disconnect')
+@_json
+def disconnect_network(state, query, body, network_id):
+    network = state.find(state.networks, network_id)
+    container = state.find(state.containers, body['Container'])
+    network['Containers'].pop(container['Id'], None)
+    container['NetworkSettings']['Networks'].pop(network['Name'], None)
+    return 200, None
+
+
+@route('DELETE', r'/networks/([^/]+)')
+@_raw
+def remove_network(state, query, body, network_id):
+    network = state.find(state.networks, network_id)
+    if network['Containers']:
+        raise Conflict('network {0} has active endpoints'.format(network['Name']))
+    del state.networks[network['Id']]
+    return 204, None
+
+
+@route('POST', r'/networks/prune')
+@_raw
+def prune_networks(state, query, body):
+    filters = _filters(query)
+    deleted = [n for n in state.networks.values()
+               if not n['Containers'] and _labels_match(n['Labels'], filters.get('label', []))]
+    for network in deleted:
+        del state.networks[network['Id']]
+    return 200, {'NetworksDeleted': [n['Name'] for n in deleted]}
+
+
+@route('POST', r'/volumes/create')
+@_json
+def create_volume(state, query, body):
+    name = body.get('Name') or state.new_id('volume')
+    if name in state.volumes:
+        # like the daemon, creating an existing volume returns it unchanged
+        return 201, state.volumes[name]
+    state.volumes[name] = {'Id': name, 'Name': name, 'Driver': body.get('Driver') or 'local',
+                           'Labels': body.get('Labels') or {}, 'Mountpoint': '/var/lib/docker/volumes/' + name}
+    return 201, state.volumes[name]
+
+
+@route('GET', r'/volumes')
+@_raw
+def list_volumes(state, query, body):
+    filters = _filters(query)
+    volumes = [v for v in state.volumes.values() if _labels_match(v['Labels'], filters.get('label', []))]
+    return 200, {'Volumes': volumes, 'Warnings': None}
+
+
+@route('GET', r'/volumes/([^/]+)')
+@_raw
+def inspect_volume(state, query, body, name):
+    return 200, state.find(state.volumes, name)
+
+
+@route('DELETE', r'/volumes/([^/]+)')
+@_raw
+def remove_volume(state, query, body, name):
+    volume = state.find(state.volumes, name)
+    del state.volumes[volume['Name']]
+    return 204, None
+
+
+@route('POST', r'/volumes/prune')
+@_raw
+def prune_volumes(state, query, body):
+    filters = _filters(query)
+    mounted = set(bind.split(':', 1)[0] for c in state.containers.values()
+                  for bind in c.get('HostConfig', {}).get('Binds') or [])
+    deleted = [name for name, v in state.volumes.items()
+               if name not in mounted and _labels_match(v['Labels'], filters.get('label', []))]
+    for name in deleted:
+        del state.volumes[name]
+    return 200, {'VolumesDeleted': deleted, 'SpaceReclaimed': 0}
@@ -1,13 +1,46 @@
 import docker
+import hashlib
+import fcntl
+import io
+import json
 import mock
+import os
+import shutil
+import socket
+import tarfile
+import tempfile
+import time
 import unittest
 
 from uuid import uuid1
 
 from cloudify.mocks import MockCloudifyContext
-
-from docker_plugin.tasks import make_docker_client, build_image, delete_image, create_container, FROM_IMAGE, \
-    start_container, stop_container, delete_container, create_network, delete_network, create_volume, delete_volume
+from cloudify.state import current_ctx
+from cloudify_rest_client.node_instances import NodeInstance
+
+from benchmark import Benchmark
+from fake_engine import FakeEngine, registry_image_id
+from docker_plugin.build_context import BuildContextCache, stream_context
+from docker_plugin.client_pool import CLIENT_POOL, ClientPool, host_key
+from docker_plugin.build_context import source_key
+from docker_plugin.metrics import OperationMetrics, call_name, instrument, recording
+from docker_plugin.locks import _lock_path
+from docker_plugin.logs import LogFollower
+from docker_plugin.placement import place
+from docker_plugin.readiness import probe_port
+from docker_plugin.reconcile import INSTANCE_LABEL
+from docker_plugin.seed import SEED_LABEL
+from docker_plugin.stats import Window
+from docker_plugin.teardown import teardown
+from docker_plugin.tasks import CONNECTED_TO_SWARM_MANAGER, CONNECTED_TO_VOLUME, create_service, scale_service, \
+    FINGERPRINT_LABEL, make_docker_client, build_image, delete_image, create_container, FROM_IMAGE, \
+    CONNECTED_TO_NETWORK, CONNECTED_TO_CONTAINER, CONTAINER_IN_HOST_TYPE, SHARED_NETWORK_USER_LABEL, \
+    start_container, stop_container, delete_container, create_network, delete_network, create_volume, delete_volume, \
+    create_container_group, start_container_group, stop_container_group, delete_container_group, \
+    teardown_deployment, reconcile_deployment, prune_deployment, follow_container_logs, exec_command, \
+    DEPLOYMENT_LABEL, PLACEMENT_CANDIDATE, sample_deployment_stats, fill_warm_pool, snapshot_container, \
+    SNAPSHOT_LABEL, _source_fingerprint, _get_build_path, _pool_endpoints, blueprint_source, \
+    _seed_hash
 
 
 class TestPlugin(unittest.TestCase):
@@ -16,6 +49,10 @@ class TestPlugin(unittest.TestCase):
 
     def setUp(self):
         super(TestPlugin, self).setUp()
+        CLIENT_POOL.clear()
+        inventory_dir = mock.patch('docker_plugin.inventory.INVENTORY_DIR', self.given_temp_dir())
+        inventory_dir.start()
+        self.addCleanup(inventory_dir.stop)
 
     def test_should_make_docker_client_without_tls(self):
         settings = self.given_empty_tls_setting()
@@ -24,6 +61,83 @@ class TestPlugin(unittest.TestCase):
 
         self.then_client_is_connected(client)
 
+    def test_should_reuse_pooled_client_for_same_settings(self):
+        client = self.given_simple_client()
+        pool = ClientPool()
+
+        with mock.patch(self.docker_client_name, client):
+            first = pool.get({'base_url': 'tcp://host:2375', 'tls_enabled': False})
+            second = pool.get({'base_url': 'tcp://host:2375', 'tls_settings': {}})
+
+        self.assertIs(first, second)
+        self.assertEqual(1, client.call_count)
+        self.assertEqual({'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0}, pool.stats())
+
+    def test_should_tell_unix_socket_hosts_apart(self):
+        client = self.given_simple_client()
+        client.side_effect = lambda **kwargs: mock.MagicMock(api=mock.Mock(base_url='http+docker://localunixsocket'))
+        pool = ClientPool()
+
+        with mock.patch(self.docker_client_name, client):
+            first = pool.get({'base_url': 'unix://var/run/a.sock'})
+            second = pool.get({'base_url': 'unix://var/run/b.sock'})
+
+        self.assertNotEqual(host_key(first), host_key(second))
+
+    def test_should_evict_idle_and_unhealthy_clients(self):
+        client = self.given_simple_client()
+        now = [0]
+        pool = ClientPool(max_idle=10, health_check_interval=5, clock=lambda: now[0])
+
+        with mock.patch(self.docker_client_name, client):
+            pool.get({'base_url': 'tcp://a:2375'})
+            now[0] = 20
+            pool.get({'base_url': 'tcp://a:2375'})
+            client.return_value.ping.return_value = False
+            now[0] = 26
+            pool.get({'base_url': 'tcp://a:2375'})
+
+        self.assertEqual(3, client.call_count)
+        self.assertEqual(2, pool.stats()['evictions'])
+
+    def test_should_name_api_calls_without_ids(self):
+        base_url = 'http+docker://localunixsocket'
+
+        self.assertEqual('POST /containers/{id}/start',
+                         call_name('post', base_url + '/v1.30/containers/abc123/start', base_url))
+        self.assertEqual('GET /images/json', call_name('get', base_url + '/v1.30/images/json?all=0', base_url))
+        self.assertEqual('GET /_ping', call_name('get', base_url + '/_ping', base_url))
+
+    def test_should_record_api_calls_of_current_operation(self):
+        client = self.given_client_with_fake_transport()
+        recorder = OperationMetrics('create')
+
+        with recording(recorder):
+            client.api.request('post', 'http://docker/v1.30/containers/create', data='{"Image": "x"}')
+            client.api.request('post', 'http://docker/v1.30/containers/create', data='{}')
+        client.api.request('get', 'http://docker/v1.30/containers/json')
+
+        stats = recorder.summary()['by_call']['POST /containers/create']
+        self.assertEqual((1, 2, 16, 20), (len(recorder.summary()['by_call']), stats['count'], stats['sent'],
+                                         stats['received']))
+
+    def test_should_write_api_metrics_to_runtime_properties_and_files(self):
+        metrics_dir = self.given_temp_dir()
+        ctx = self.given_ctx_with_metrics_host(metrics_dir)
+        client = self.given_client_with_image_inventory()
+
+        with mock.patch(self.docker_client_name, client):
+            build_image(ctx)
+            build_image(ctx)
+
+        summary = ctx.instance.runtime_properties['docker_api_metrics']['build_image']
+        self.assertEqual(['client.acquire'], list(summary['by_call']))
+        with open(os.path.join(metrics_dir, 'docker.prom')) as f:
+            self.assertIn('docker_plugin_api_calls_total{host="",call="client.acquire",operation="build_image"} 2',
+                          f.read())
+        with open(os.path.join(metrics_dir, 'docker.jsonl')) as f:
+            self.assertEqual(2, len(f.readlines()))
+
     def test_should_build_existing_image_from_repository(self):
         client = self.given_mock_client()
         ctx = self.given_ctx_with_existing_docker_from_repository()
@@ -42,6 +156,181 @@ class TestPlugin(unittest.TestCase):
 
         self.then_image_is_built(ctx)
 
+    def test_should_reuse_cached_build_context(self):
+        cache = BuildContextCache(cache_dir=self.given_temp_dir())
+        download = self.given_download_func({'ctx/': 'Dockerfile\nscript.py\n',
+                                             'ctx/Dockerfile': 'FROM scratch', 'ctx/script.py': 'print(1)'})
+
+        path, content_hash, cached = cache.get(download, 'bp', 'ctx/', {'a': 1})
+        same_path, same_hash, same_cached = cache.get(download, 'bp', 'ctx/', {'a': 1})
+
+        self.assertFalse(cached)
+        self.assertTrue(same_cached)
+        self.assertEqual((path, content_hash), (same_path, same_hash))
+        self.assertEqual(['Dockerfile', 'script.py'], sorted(os.listdir(path)))
+        self.assertEqual(3, download.call_count)
+
+    def test_should_download_build_context_again_after_blueprint_reupload(self):
+        ctx = self.given_mock_ctx({'build_cache_dir': self.given_temp_dir()})
+        resources = {'ctx/Dockerfile': 'FROM scratch'}
+        ctx.download_resource = self.given_download_func(resources)
+        rest = self.given_manager()
+
+        rest.blueprints.get.return_value.created_at = '2026-01-01T00:00:00'
+        with _get_build_path(ctx, 'ctx/', {}) as (_, first):
+            pass
+        resources['ctx/Dockerfile'] = 'FROM busybox'
+        with _get_build_path(ctx, 'ctx/', {}) as (_, reused):
+            pass
+        rest.blueprints.get.return_value.created_at = '2026-01-02T00:00:00'
+        with _get_build_path(ctx, 'ctx/', {}) as (_, reuploaded):
+            pass
+
+        self.assertEqual(first, reused)
+        self.assertNotEqual(first, reuploaded)
+
+    def test_should_key_build_context_on_blueprint_without_manager(self):
+        ctx = self.given_mock_ctx({'build_cache_dir': self.given_temp_dir()})
+        ctx.download_resource = self.given_download_func({'ctx/Dockerfile': 'FROM scratch'})
+        current_ctx.set(ctx)
+        self.addCleanup(current_ctx.clear)
+
+        self.assertEqual(ctx.blueprint.id, blueprint_source(ctx))
+        with _get_build_path(ctx, 'ctx/', {}) as (path, _):
+            self.assertEqual(['Dockerfile'], os.listdir(path))
+
+    def given_manager(self):
+        rest = mock.Mock()
+        for patch in (mock.patch('docker_plugin.tasks.get_rest_client', return_value=rest),
+                      mock.patch('docker_plugin.tasks.get_manager_rest_service_host', return_value=['manager'])):
+            patch.start()
+            self.addCleanup(patch.stop)
+        return rest
+
+    def test_should_evict_least_recently_used_build_context(self):
+        cache = BuildContextCache(cache_dir=self.given_temp_dir(), max_entries=1)
+        download = self.given_download_func({'ctx/Dockerfile': 'FROM scratch'})
+
+        first, _, _ = cache.get(download, 'bp', 'ctx/', {'a': 1})
+        second, _, _ = cache.get(download, 'bp', 'ctx/', {'a': 2})
+
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+
+    def test_should_not_evict_build_context_in_use(self):
+        cache_dir = self.given_temp_dir()
+        download = self.given_download_func({'ctx/Dockerfile': 'FROM scratch'})
+        building = BuildContextCache(cache_dir=cache_dir, max_entries=1)
+        other = BuildContextCache(cache_dir=cache_dir, max_entries=1)
+
+        with building.checkout(download, 'bp', 'ctx/', {'a': 1}) as (first, _, _):
+            second, _, _ = other.get(download, 'bp', 'ctx/', {'a': 2})
+            self.assertTrue(os.path.exists(first))
+            other.sweep(max_age=0)
+            self.assertTrue(os.path.exists(first))
+            self.assertFalse(os.path.exists(second))
+
+        other.sweep(max_age=0)
+        self.assertFalse(os.path.exists(first))
+
+    def test_should_stream_build_context_as_tar(self):
+        download = self.given_download_func({'ctx/Dockerfile': 'FROM scratch', 'ctx/script.py': 'x' * 1000})
+
+        data = b''.join(stream_context(download, 'ctx', ['script.py', 'Dockerfile'], chunk_size=100))
+
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            self.assertEqual(['Dockerfile', 'script.py'], tar.getnames())
+            self.assertEqual(b'x' * 1000, tar.extractfile('script.py').read())
+
+    def test_should_build_image_from_streamed_context(self):
+        ctx = self.given_ctx_with_streamed_dockerfile()
+        client = self.given_client_without_built_image()
+
+        with mock.patch(self.docker_client_name, client):
+            build_image(ctx)
+
+        self.then_image_is_built(ctx)
+        self.then_image_is_built_from_stream(client)
+
+    def test_should_not_pull_image_pulled_while_waiting_for_lock(self):
+        client = self.given_client_with_image_pulled_concurrently()
+        ctx = self.given_ctx_with_docker_from_repository()
+
+        with mock.patch(self.docker_client_name, client):
+            build_image(ctx)
+
+        self.then_image_is_built(ctx)
+        self.assertFalse(client.return_value.images.pull.called)
+
+    def test_should_pull_image_with_streamed_progress(self):
+        client = self.given_client_with_streamed_pull()
+        ctx = self.given_mock_ctx({'repository': 'notexisting', 'stream_pull_progress': True})
+
+        with mock.patch(self.docker_client_name, client):
+            build_image(ctx)
+
+        self.then_image_is_built(ctx)
+        self.assertEqual({'tag': 'latest', 'stream': True, 'decode': True},
+                         client.return_value.api.pull.call_args.kwargs)
+
+    def test_should_find_image_in_host_inventory(self):
+        client = self.given_client_with_image_inventory()
+        ctx = self.given_ctx_with_existing_docker_from_repository()
+
+        with mock.patch(self.docker_client_name, client):
+            build_image(ctx)
+            build_image(ctx)
+
+        self.then_image_is_built(ctx)
+        self.assertEqual(1, client.return_value.api.images.call_count)
+        self.assertFalse(client.return_value.images.get.called)
+
+    def test_should_remove_deleted_image_from_inventory(self):
+        client = self.given_client_with_image_inventory()
+        ctx = self.given_ctx_with_existing_docker_from_repository()
+
+        with mock.patch(self.docker_client_name, client):
+            build_image(ctx)
+            delete_image(ctx)
+            client.return_value.images.get.side_effect = docker.errors.ImageNotFound(mock.Mock())
+            client.return_value.images.pull.return_value.id = 'sha256:new'
+            build_image(ctx)
+
+        self.assertEqual('sha256:new', ctx.instance.runtime_properties['image'])
+
+    def test_should_not_rebuild_image_with_matching_fingerprint(self):
+        ctx = self.given_ctx_with_streamed_dockerfile()
+        client = self.given_client_with_built_image(source_key(None, 'ctx', {}))
+
+        with mock.patch(self.docker_client_name, client):
+            build_image(ctx)
+
+        self.assertEqual('sha256:old', ctx.instance.runtime_properties['image'])
+        self.assertFalse(client.return_value.images.build.called)
+
+    def test_should_rebuild_streamed_image_after_blueprint_reupload(self):
+        ctx = self.given_ctx_with_streamed_dockerfile()
+        client = self.given_client_with_built_image(source_key(None, 'ctx', {}))
+        self.given_manager().blueprints.get.return_value.created_at = '2026-01-02T00:00:00'
+
+        with mock.patch(self.docker_client_name, client):
+            build_image(ctx)
+
+        self.assertEqual({FINGERPRINT_LABEL: source_key('None@2026-01-02T00:00:00', 'ctx', {})},
+                         client.return_value.images.build.call_args.kwargs['labels'])
+
+    def test_should_rebuild_stale_image_using_cache_sources(self):
+        ctx = self.given_ctx_with_streamed_dockerfile(cache_from=['cache:v1'])
+        client = self.given_client_with_built_image('outdated')
+
+        with mock.patch(self.docker_client_name, client):
+            build_image(ctx)
+
+        kwargs = client.return_value.images.build.call_args.kwargs
+        self.assertEqual(['cache:v1'], kwargs['cache_from'])
+        self.assertEqual({FINGERPRINT_LABEL: source_key(None, 'ctx', {})}, kwargs['labels'])
+        self.assertEqual(1, client.return_value.images.pull.call_count)
+
     def test_should_remove_image(self):
         ctx = self.given_ctx_with_image()
         client = self.given_simple_client()
@@ -51,6 +340,16 @@ class TestPlugin(unittest.TestCase):
 
         self.then_image_is_deleted(client)
 
+    def test_should_ignore_image_removed_already(self):
+        ctx = self.given_ctx_with_image()
+        client = self.given_simple_client()
+        client.return_value.images.remove.side_effect = docker.errors.ImageNotFound('gone')
+
+        with mock.patch(self.docker_client_name, client):
+            delete_image(ctx)
+
+        self.then_image_is_deleted(client)
+
     def test_should_not_remove_image_whit_keep_property(self):
         ctx = self.given_ctx_with_image_and_keep_property()
         client = self.given_simple_client()
@@ -69,6 +368,83 @@ class TestPlugin(unittest.TestCase):
 
         self.then_container_is_created(client)
 
+    def test_should_attach_first_network_at_create_time(self):
+        ctx = self.given_ctx_with_relationship(networks=['net_a', 'net_b'])
+        client = self.given_simple_client()
+        client.return_value.api.create_container.return_value = {'Id': 'test_container_id'}
+
+        with mock.patch(self.docker_client_name, client):
+            create_container(ctx)
+
+        self.then_container_is_created_with_network(client, 'net_a_id')
+        self.assertEqual(1, client.return_value.api.connect_container_to_network.call_count)
+        self.assertEqual(('test_container_id', 'net_b_id'),
+                         client.return_value.api.connect_container_to_network.call_args.args)
+        self.assertFalse(client.return_value.networks.get.called)
+        self.assertEqual('test_container_id', ctx.instance.runtime_properties['container_id'])
+
+    def test_should_connect_containers_through_shared_network(self):
+        ctx = self.given_ctx_with_relationship(connected=['db', 'cache'], connection_topology='shared')
+        client, network = self.given_client_with_shared_network()
+
+        with mock.patch(self.docker_client_name, client):
+            create_container(ctx)
+
+        self.assertEqual(2, network.connect.call_count)
+        self.assertFalse(client.return_value.networks.create.called)
+        self.assertEqual({'ip': '10.0.0.2', 'net_id': 'shared_id', 'container_id': 'db_id'},
+                         ctx.instance.runtime_properties['connected']['db'])
+        self.assertEqual(['cloudify_None'], list(ctx.instance.runtime_properties['networks']))
+        labels = client.return_value.api.create_container.call_args.kwargs['labels']
+        self.assertEqual({SHARED_NETWORK_USER_LABEL: 'cloudify_None'}, labels)
+
+    def test_should_hold_shared_network_lock_until_container_is_created(self):
+        ctx = self.given_ctx_with_relationship(connected=['db', 'cache'], connection_topology='shared')
+        client, _ = self.given_client_with_shared_network()
+        held = []
+
+        def create(**kwargs):
+            path = _lock_path('shared-network', host_key(client.return_value), 'cloudify_None')
+            with open(path, 'a') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                    held.append(False)
+                except (IOError, OSError):
+                    held.append(True)
+            return {'Id': 'test_container_id'}
+
+        client.return_value.api.create_container.side_effect = create
+        with mock.patch(self.docker_client_name, client):
+            create_container(ctx)
+
+        self.assertEqual([True], held)
+
+    def test_should_keep_shared_network_while_it_has_users(self):
+        ctx = self.given_ctx_with_shared_network_container()
+        client, container = self.given_mock_client_with_container()
+        client.return_value.api.containers.return_value = [{'Id': 'other'}]
+
+        with mock.patch(self.docker_client_name, client):
+            delete_container(ctx)
+
+        self.then_container_is_removed(container)
+        self.assertFalse(client.return_value.networks.get.called)
+
+    def test_should_remove_shared_network_after_last_user(self):
+        ctx = self.given_ctx_with_shared_network_container()
+        client, container = self.given_mock_client_with_container()
+        client.return_value.api.containers.return_value = []
+        network = client.return_value.networks.get.return_value
+        network.attrs = {'Containers': {'target_id': {}}}
+
+        with mock.patch(self.docker_client_name, client):
+            delete_container(ctx)
+
+        self.then_container_is_removed(container)
+        self.assertEqual(('target_id',), network.disconnect.call_args.args)
+        self.assertEqual(1, network.remove.call_count)
+
     def test_should_not_create_container_without_relation(self):
         ctx = self.given_ctx_with_image()
         client = self.given_mock_client()
@@ -86,6 +462,57 @@ class TestPlugin(unittest.TestCase):
 
         self.then_container_is_started(container)
 
+    def test_should_wait_for_healthy_container(self):
+        ctx = self.given_mock_ctx({'wait_for': 'healthy'}, {'container_id': 'test_container_id'})
+        client, container = self.given_mock_client_with_container()
+        self.given_container_with_healthcheck(container, final_status='healthy')
+        client.return_value.api.events.return_value = iter([
+            {'Action': 'start'}, {'Action': 'health_status: starting'}, {'Action': 'health_status: healthy'},
+        ])
+
+        with mock.patch(self.docker_client_name, client):
+            start_container(ctx)
+
+        self.then_container_is_started(container)
+        self.assertEqual(1, container.reload.call_count)
+        self.assertEqual({'type': 'container', 'container': 'test_container_id'},
+                         client.return_value.api.events.call_args.kwargs['filters'])
+
+    def test_should_fail_when_container_is_not_ready_in_time(self):
+        ctx = self.given_mock_ctx({'wait_for': 'healthy', 'readiness_timeout': 1},
+                                  {'container_id': 'test_container_id'})
+        client, container = self.given_mock_client_with_container()
+        self.given_container_with_healthcheck(container, final_status='starting')
+        client.return_value.api.events.return_value = iter([{'Action': 'start'}])
+
+        with mock.patch(self.docker_client_name, client):
+            with self.assertRaises(RuntimeError):
+                start_container(ctx)
+
+    def test_should_probe_published_ports(self):
+        listener = self.given_listening_socket()
+        port = listener.getsockname()[1]
+        ctx = self.given_mock_ctx({'probe_ports': True, 'port_bindings': {'80/tcp': port}},
+                                  {'container_id': 'test_container_id'})
+        client, container = self.given_mock_client_with_container()
+        container.attrs = {'NetworkSettings': {
+            'Networks': {},
+            'Ports': {'80/tcp': [{'HostIp': '0.0.0.0', 'HostPort': str(port)}]},
+        }}
+
+        with mock.patch(self.docker_client_name, client):
+            start_container(ctx)
+
+        self.assertEqual(['80/tcp'], list(ctx.instance.runtime_properties['port_ready_seconds']))
+
+    def test_should_give_up_probing_closed_port(self):
+        listener = self.given_listening_socket()
+        address = listener.getsockname()
+        listener.close()
+
+        with self.assertRaises(RuntimeError):
+            probe_port(address, timeout=0.2)
+
     def test_should_stop_container(self):
         ctx = self.given_ctx_with_container()
         client, container = self.given_mock_client_with_container()
@@ -112,6 +539,65 @@ class TestPlugin(unittest.TestCase):
             with self.assertRaises(RuntimeError):
                 create_network(ctx)
 
+    def test_should_create_service_through_swarm_manager(self):
+        ctx = self.given_ctx_with_service(replicas=3)
+        client = self.given_simple_client()
+        client.return_value.services.create.return_value.name = 'web'
+
+        with mock.patch(self.docker_client_name, client):
+            create_service(ctx)
+
+        self.assertEqual('tcp://manager:2375', client.call_args.kwargs['base_url'])
+        kwargs = client.return_value.services.create.call_args.kwargs
+        self.assertEqual(('nginx:1.13', ['net_a'], {'replicated': {'Replicas': 3}}, ['/data:/srv:rw']),
+                         (kwargs['image'], kwargs['networks'], kwargs['mode'], kwargs['mounts']))
+        self.assertEqual({'Parallelism': 2, 'Delay': 5 * 10 ** 9, 'FailureAction': 'pause'}, kwargs['update_config'])
+        self.assertEqual([{'Protocol': 'tcp', 'PublishedPort': 8080, 'TargetPort': 80}],
+                         kwargs['endpoint_spec']['Ports'])
+        self.assertEqual(3, ctx.instance.runtime_properties['replicas'])
+
+    def test_should_scale_service_keeping_its_spec(self):
+        ctx = self.given_ctx_with_service(replicas=3, runtime_properties={'service_id': 'svc', 'replicas': 3})
+        client = self.given_simple_client()
+        spec = {'Name': 'web', 'TaskTemplate': {'ContainerSpec': {'Image': 'nginx:1.13'}},
+                'Mode': {'Replicated': {'Replicas': 3}}, 'Networks': [{'Target': 'net_a'}]}
+        client.return_value.api.inspect_service.return_value = {'Spec': spec, 'Version': {'Index': 7}}
+
+        with mock.patch(self.docker_client_name, client):
+            scale_service(ctx, replicas=10)
+
+        args, kwargs = client.return_value.api.update_service.call_args
+        self.assertEqual(('svc', 7), args)
+        self.assertEqual(({'replicated': {'Replicas': 10}}, spec['TaskTemplate'], spec['Networks']),
+                         (kwargs['mode'], kwargs['task_template'], kwargs['networks']))
+        self.assertEqual(10, ctx.instance.runtime_properties['replicas'])
+
+    def given_ctx_with_service(self, replicas, runtime_properties=None):
+        manager_rel = mock.Mock(type_hierarchy=[CONNECTED_TO_SWARM_MANAGER])
+        manager_rel.target.instance.runtime_properties = {'connection_kwargs': {'base_url': 'tcp://manager:2375'}}
+        image_rel = mock.Mock(type_hierarchy=[FROM_IMAGE])
+        image_rel.target.instance.runtime_properties = {'image': self.image_id, 'image_reference': 'nginx:1.13'}
+        network_rel = mock.Mock(type_hierarchy=[CONNECTED_TO_NETWORK])
+        network_rel.target.node.name = 'net'
+        network_rel.target.instance.runtime_properties = {'network_id': 'net_a_id', 'network_name': 'net_a'}
+        volume_rel = mock.Mock(type_hierarchy=[CONNECTED_TO_VOLUME])
+        volume_rel.target.node.properties = {'mode': 'rw', 'mount_at': '/srv'}
+        volume_rel.target.instance.runtime_properties = {'volume_name': 'data', 'volume_mountpoint': '/data'}
+        properties = {
+            'name': 'web',
+            'command': None,
+            'environment': {},
+            'port_bindings': {80: 8080},
+            'mode': 'replicated',
+            'replicas': replicas,
+            'update_parallelism': 2,
+            'update_delay': 5,
+            'update_failure_action': 'pause',
+            'additional_service_parameters': {},
+        }
+        return MockCloudifyContext(node_id=uuid1(), properties=properties, runtime_properties=runtime_properties,
+                                   relationships=[manager_rel, image_rel, network_rel, volume_rel])
+
     def test_should_create_network(self):
         ctx = self.given_ctx_with_network()
         client = self.given_client_without_network()
@@ -175,6 +661,593 @@ class TestPlugin(unittest.TestCase):
 
         self.then_volume_is_not_deleted(client, volume)
 
+    def given_listening_socket(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        return listener
+
+    @staticmethod
+    def given_client_with_fake_transport():
+        response = mock.Mock()
+        response.headers = {'Content-Length': '10'}
+        response.raw.retries = None
+        client = mock.Mock()
+        client.api.base_url = 'http://docker'
+        client.api._cloudify_instrumented = False
+        client.api.request.return_value = response
+        return instrument(client)
+
+    def given_ctx_with_metrics_host(self, metrics_dir):
+        host_rel = mock.Mock()
+        host_rel.type_hierarchy = CONTAINER_IN_HOST_TYPE
+        host_rel.target.instance.runtime_properties = {'connection_kwargs': {}}
+        host_rel.target.node.properties = {'api_metrics': {
+            'prometheus_file': os.path.join(metrics_dir, 'docker.prom'),
+            'jsonl_file': os.path.join(metrics_dir, 'docker.jsonl'),
+        }}
+        return MockCloudifyContext(node_id=uuid1(), properties={'repository': 'existing'}, relationships=[host_rel])
+
+    def given_temp_dir(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        return path
+
+    def given_download_func(self, resources):
+        def download(resource_path, target_path=None):
+            if resource_path not in resources:
+                raise IOError(resource_path)
+            if target_path is None:
+                target_path = os.path.join(self.given_temp_dir(), 'resource')
+            with open(target_path, 'w') as f:
+                f.write(resources[resource_path])
+            return target_path
+
+        return mock.Mock(side_effect=download)
+
+    def test_should_run_container_lifecycle_against_fake_engine(self):
+        # TCP keeps this independent of the requests version docker-py 2.4's unix socket adapter needs
+        with FakeEngine(tcp=True) as engine:
+            benchmark = Benchmark(engine.base_url)
+            benchmark.run(instances=3, concurrency=2)
+
+        report = {row['operation']: row for row in benchmark.report()}
+        self.assertEqual(3, report['create_container']['count'])
+        self.assertEqual(1.0, report['create_container']['api_calls_per_op'])
+        self.assertEqual(({}, {}, {}, {}), (engine.state.containers, engine.state.networks, engine.state.volumes,
+                                             engine.state.images))
+
+    def test_should_run_container_group_lifecycle_against_fake_engine(self):
+        with FakeEngine(tcp=True) as engine:
+            ctx, network_name = self.given_ctx_with_container_group(engine, replicas=5)
+
+            create_container_group(ctx)
+            start_container_group(ctx)
+            ips = ctx.instance.runtime_properties['replica_ips'][network_name]
+            stop_container_group(ctx)
+            delete_container_group(ctx)
+
+        self.assertEqual(5, len(set(ctx.instance.runtime_properties['replica_ids'])))
+        self.assertEqual(5, len(set(ips)))
+        self.assertNotIn(None, ips)
+        self.assertEqual({}, engine.state.containers)
+        self.assertEqual(1, engine.calls['GET /containers/json'])
+
+    def test_should_tear_down_labelled_resources_of_deployment(self):
+        with FakeEngine(tcp=True) as engine:
+            ctx = self.given_ctx_with_deployment_resources(engine)
+
+            teardown_deployment(ctx, stop_timeout=1)
+
+        self.assertEqual({'containers': 2, 'networks': 1, 'volumes': 1},
+                         {k: v for k, v in ctx.instance.runtime_properties['teardown'].items() if k != 'seconds'})
+        self.assertEqual(['/other'], [c['Name'] for c in engine.state.containers.values()])
+        self.assertEqual(({}, {}), (engine.state.networks, engine.state.volumes))
+
+    def test_should_bound_stop_timeout_by_deadline(self):
+        client = mock.Mock()
+        client.api.containers.return_value = [{'Id': 'a', 'State': 'running'}, {'Id': 'b', 'State': 'exited'}]
+        client.api.networks.return_value = []
+        client.api.volumes.return_value = {'Volumes': None}
+        now = iter([0, 8, 9])
+
+        removed = teardown(client, 'cloudify.deployment=dep', stop_timeout=10, deadline=12, clock=lambda: next(now))
+
+        self.assertEqual([mock.call('a', timeout=4)], client.api.stop.call_args_list)
+        self.assertEqual(2, client.api.remove_container.call_count)
+        self.assertEqual(2, removed['containers'])
+
+    def given_ctx_with_deployment_resources(self, engine):
+        labels = {DEPLOYMENT_LABEL: 'dep'}
+        engine.state.add_image('app:latest')
+        for name, running, container_labels in (('web', True, labels), ('job', False, labels), ('other', True, {})):
+            engine.state.containers[name + '_id'] = {
+                'Id': name + '_id', 'Name': '/' + name, 'Image': 'app:latest',
+                'Config': {'Image': 'app:latest', 'Labels': container_labels},
+                'State': {'Running': running, 'Status': 'running' if running else 'exited'},
+                'NetworkSettings': {'Networks': {}, 'Ports': {}},
+            }
+        engine.state.networks['net_id'] = {'Id': 'net_id', 'Name': 'net', 'Driver': 'bridge', 'Labels': labels,
+                                           'Containers': {}}
+        engine.state.volumes['data'] = {'Id': 'data', 'Name': 'data', 'Driver': 'local', 'Labels': labels,
+                                        'Mountpoint': '/data'}
+        return MockCloudifyContext(node_id='docker_host', deployment_id='dep',
+                                   runtime_properties={'connection_kwargs': {'base_url': engine.base_url}})
+
+    def test_should_reconcile_drifted_resources_with_list_calls(self):
+        rest = mock.Mock()
+        with FakeEngine(tcp=True) as engine, mock.patch('docker_plugin.tasks.get_rest_client', return_value=rest):
+            host_ctx, instances = self.given_deployment_with_drift(engine, containers=3)
+            rest.node_instances.list.return_value = instances
+            before = dict(engine.calls)
+
+            reconcile_deployment(host_ctx)
+
+            running = sorted(c['Name'] for c in engine.state.containers.values() if c['State']['Running'])
+        calls = {name: count - before.get(name, 0) for name, count in engine.calls.items()}
+        changes = host_ctx.instance.runtime_properties['reconcile']
+        self.assertEqual(([instances[0].id], [instances[1].id], 1, 3),
+                         (changes['recreated'], changes['restarted'], changes['removed'], changes['in_sync']))
+        self.assertEqual(['/worker_0', '/worker_1', '/worker_2'], running)
+        self.assertEqual((1, 1, 1), (calls['GET /containers/json'], calls['GET /networks'], calls['GET /volumes']))
+        updated_id, update = rest.node_instances.update.call_args
+        self.assertEqual((instances[0].id,), updated_id)
+        self.assertNotEqual(instances[0].runtime_properties['container_id'],
+                            update['runtime_properties']['container_id'])
+
+    def given_deployment_with_drift(self, engine, containers):
+        benchmark = Benchmark(engine.base_url)
+        engine.state.add_image('app:latest')
+        network = benchmark.context('net', {'name': 'app_net', 'driver': None, 'options': {}, 'external': False})
+        volume = benchmark.context('data', {'name': 'app_data', 'driver': 'local', 'driver_opts': {}, 'source': None})
+        create_network(network)
+        create_volume(volume)
+        image_rel = mock.Mock(type_hierarchy=FROM_IMAGE)
+        image_rel.target.instance.runtime_properties = {'image': 'app:latest'}
+        network_rel = mock.Mock(type_hierarchy=CONNECTED_TO_NETWORK)
+        network_rel.target.node.name = 'net'
+        network_rel.target.instance.runtime_properties = network.instance.runtime_properties
+        workers = []
+        for i in range(containers):
+            worker = benchmark.context('worker', {
+                'name': 'worker_{0}'.format(i), 'command': None, 'port_bindings': {}, 'environment': {},
+                'network_aliases': {}, 'additional_create_parameters': {},
+            }, [image_rel, network_rel])
+            create_container(worker)
+            start_container(worker)
+            workers.append(worker)
+
+        del engine.state.containers[workers[0].instance.runtime_properties['container_id']]
+        engine.state.containers[workers[1].instance.runtime_properties['container_id']]['State'].update(
+            {'Running': False, 'Status': 'exited'})
+        engine.state.containers['orphan_id'] = {
+            'Id': 'orphan_id', 'Name': '/orphan', 'Image': 'app:latest',
+            'Config': {'Image': 'app:latest', 'Labels': {DEPLOYMENT_LABEL: benchmark.deployment_id,
+                                                         INSTANCE_LABEL: 'worker_gone'}},
+            'State': {'Running': True, 'Status': 'running'}, 'NetworkSettings': {'Networks': {}, 'Ports': {}},
+        }
+
+        instances = [
+            NodeInstance({'id': ctx.instance.id, 'state': 'started', 'version': 2,
+                          'runtime_properties': dict(ctx.instance.runtime_properties),
+                          'relationships': [{'type': CONTAINER_IN_HOST_TYPE, 'target_id': 'docker_host'}]})
+            for ctx in workers + [network, volume]
+        ]
+        host_ctx = MockCloudifyContext(node_id='docker_host', deployment_id=benchmark.deployment_id,
+                                       runtime_properties={'connection_kwargs': {'base_url': engine.base_url}})
+        return host_ctx, instances
+
+    def test_should_prune_deployment_resources_and_sweep_build_cache(self):
+        cache_dir = self.given_build_cache_with_stale_entries()
+        with FakeEngine(tcp=True) as engine:
+            ctx = self.given_ctx_with_deployment_resources(engine)
+            engine.state.add_image('leftover:latest', {DEPLOYMENT_LABEL: 'dep'})
+            engine.state.add_image('snapshot:latest', {DEPLOYMENT_LABEL: 'dep', SNAPSHOT_LABEL: 'web'})
+
+            prune_deployment(ctx, images=True, networks=True, build_cache_dir=cache_dir, build_cache_max_age=60)
+
+        pruned = ctx.instance.runtime_properties['prune']
+        self.assertEqual((1, 1, 1024, 5), (pruned['networks'], pruned['images'],
+                                           pruned['reclaimed_bytes'], pruned['build_cache_reclaimed_bytes']))
+        self.assertNotIn('volumes', pruned)
+        self.assertEqual(1, len(engine.state.volumes))
+        self.assertEqual(['app:latest', 'snapshot:latest'],
+                         sorted(tag for image in engine.state.images.values() for tag in image['RepoTags']))
+        self.assertEqual(3, len(engine.state.containers))
+        self.assertEqual(['contexts', 'index'], sorted(os.listdir(cache_dir)))
+        self.assertEqual(['fresh'], os.listdir(os.path.join(cache_dir, 'contexts')))
+
+    def given_build_cache_with_stale_entries(self):
+        cache_dir = self.given_temp_dir()
+        stale = time.time() - 3600
+        for path, content in (('.staging-abc/Dockerfile', 'FROM'), ('contexts/old/Dockerfile', 'x'),
+                              ('contexts/fresh/Dockerfile', 'FROM scratch'), ('index/old', 'old'),
+                              ('index/gone', 'missing')):
+            path = os.path.join(cache_dir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+        for path in ('.staging-abc', 'contexts/old'):
+            os.utime(os.path.join(cache_dir, path), (stale, stale))
+        return cache_dir
+
+    def test_should_forward_logs_in_batches_and_keep_bounded_tail(self):
+        batches = []
+        now = [0.0]
+        follower = LogFollower(batches.append, batch_lines=2, max_lines_per_second=3, tail_lines=3, tail_bytes=10,
+                               clock=lambda: now[0])
+
+        follower.feed(b'one\ntw')
+        follower.feed(b'o\nthree\nfour\nfive')
+        follower.close()
+
+        self.assertEqual([['one', 'two'], ['three', '[2 lines not forwarded, over 3 lines/s]']], batches)
+        self.assertEqual({'lines': 5, 'bytes': 23, 'dropped': 2, 'tail': 'four\nfive'}, follower.summary())
+
+    def test_should_stop_following_logs_of_running_container(self):
+        with FakeEngine(tcp=True) as engine:
+            ctx = self.given_ctx_with_logging_container(engine, ['line {0}'.format(i) for i in range(500)])
+
+            started = time.time()
+            follow_container_logs(ctx, seconds=0.3, history_lines=200)
+            elapsed = time.time() - started
+
+        logs = ctx.instance.runtime_properties['logs']
+        self.assertLess(elapsed, 5)
+        self.assertEqual((200, 0), (logs['lines'], logs['dropped']))
+        self.assertEqual('line 499', logs['tail'].splitlines()[-1])
+        self.assertEqual(100, len(logs['tail'].splitlines()))
+
+    def test_should_exec_command_in_every_replica(self):
+        with FakeEngine(tcp=True) as engine:
+            ctx, _ = self.given_ctx_with_container_group(engine, replicas=3)
+            create_container_group(ctx)
+            start_container_group(ctx)
+
+            exec_command(ctx, command='echo hello world', parallelism=2)
+
+        results = ctx.instance.runtime_properties['exec']['results']
+        self.assertEqual(ctx.instance.runtime_properties['replica_ids'], [r['container_id'] for r in results])
+        self.assertEqual([(0, 'ran echo hello world\nhello world', '')] * 3,
+                         [(r['exit_code'], r['stdout'], r['stderr']) for r in results])
+        self.assertEqual(3, engine.calls['POST /exec/{id}/start'])
+
+    def test_should_fail_when_command_fails(self):
+        with FakeEngine(tcp=True) as engine:
+            ctx = self.given_ctx_with_logging_container(engine, [])
+
+            self.assertRaises(RuntimeError, exec_command, ctx, command=['fail', 'now'])
+
+        result = ctx.instance.runtime_properties['exec']['results'][0]
+        self.assertEqual((1, 'failed'), (result['exit_code'], result['stderr']))
+
+    def test_should_place_container_on_least_loaded_candidate(self):
+        with FakeEngine(tcp=True) as busy, FakeEngine(tcp=True) as idle:
+            ctx = self.given_ctx_with_placement_candidates({'busy': busy, 'idle': idle}, busy_cpus=6)
+
+            create_container(ctx)
+
+            placed = list(idle.state.containers.values())
+        self.assertEqual(('idle', idle.base_url), (ctx.instance.runtime_properties['docker_host'],
+                                                   ctx.instance.runtime_properties['connection_kwargs']['base_url']))
+        self.assertEqual([('/worker', registry_image_id('app:latest'))], [(c['Name'], c['Image']) for c in placed])
+        self.assertEqual((1, 1), (busy.calls['GET /containers/{id}/stats'], idle.calls['POST /images/create']))
+        self.assertNotIn('POST /images/create', busy.calls)
+
+    def test_should_only_place_container_on_hosts_with_its_volumes(self):
+        with FakeEngine(tcp=True) as busy, FakeEngine(tcp=True) as idle:
+            busy.state.volumes['data'] = {'Id': 'data', 'Name': 'data', 'Driver': 'local', 'Labels': {}}
+            volume = mock.Mock(type_hierarchy=[CONNECTED_TO_VOLUME])
+            volume.target.node.properties = {'mode': 'rw', 'mount_at': '/data'}
+            volume.target.instance.runtime_properties = {'volume_name': 'data', 'volume_mountpoint': 'data'}
+            ctx = self.given_ctx_with_placement_candidates({'busy': busy, 'idle': idle}, busy_cpus=1, extra=[volume])
+
+            create_container(ctx)
+
+        self.assertEqual('busy', ctx.instance.runtime_properties['docker_host'])
+        self.assertNotIn('GET /containers/{id}/stats', idle.calls)
+
+    def test_should_place_container_on_host_of_connected_container(self):
+        with FakeEngine(tcp=True) as busy, FakeEngine(tcp=True) as idle:
+            connected = mock.Mock(type_hierarchy=[CONNECTED_TO_CONTAINER])
+            connected.target.node.name = 'busy'
+            connected.target.instance.relationships = []
+            connected.target.instance.runtime_properties = {'connection_kwargs': {'base_url': busy.base_url},
+                                                            'container_id': 'busy_id'}
+            ctx = self.given_ctx_with_placement_candidates({'busy': busy, 'idle': idle}, busy_cpus=1,
+                                                           extra=[connected])
+
+            create_container(ctx)
+
+        self.assertEqual('busy', ctx.instance.runtime_properties['docker_host'])
+        self.assertEqual(['/busy', '/worker'], sorted(c['Name'] for c in busy.state.containers.values()))
+
+    def test_should_count_recent_placements_against_hosts(self):
+        load = {'cpus': 4, 'memory': 8 * 1024 ** 3, 'used_cpus': 1.0, 'used_memory': 0, 'containers': 1}
+        loads = {'a': load, 'b': dict(load, used_cpus=2.0)}
+
+        with mock.patch('docker_plugin.placement.RESERVATION_DIR', self.given_temp_dir()):
+            spread = [place(loads, 1.5, 0, scope='dep') for _ in range(3)]
+            packed = place(loads, 0.5, 0, strategy='binpack', scope='other')
+
+        self.assertEqual(['a', 'b', 'a'], spread)
+        self.assertEqual('b', packed)
+        self.assertRaises(RuntimeError, place, loads, 8, 0, scope='other')
+
+    def given_ctx_with_placement_candidates(self, engines, busy_cpus, extra=()):
+        engines['busy'].state.containers['busy_id'] = {
+            'Id': 'busy_id', 'Name': '/busy', 'Image': 'other:latest', 'Usage': {'cpus': busy_cpus},
+            'Config': {'Image': 'other:latest', 'Labels': {}},
+            'State': {'Running': True, 'Status': 'running'}, 'NetworkSettings': {'Networks': {}, 'Ports': {}},
+        }
+        # pulled on the image's own host, which is none of the candidates
+        relationships = [mock.Mock(type_hierarchy=[FROM_IMAGE])] + list(extra)
+        relationships[0].target.node.properties = {'repository': 'app', 'tag': 'latest'}
+        relationships[0].target.instance.runtime_properties = {'image': registry_image_id('app:latest'),
+                                                               'image_reference': 'app:latest'}
+        for name, engine in sorted(engines.items()):
+            rel = mock.Mock(type_hierarchy=[PLACEMENT_CANDIDATE])
+            rel.target.instance.id = name
+            rel.target.instance.runtime_properties = {'connection_kwargs': {'base_url': engine.base_url}}
+            rel.target.node.properties = {'ip': '127.0.0.1'}
+            relationships.append(rel)
+        properties = {'name': 'worker', 'command': None, 'port_bindings': {}, 'environment': {},
+                      'additional_create_parameters': {'nano_cpus': 2 * 10 ** 9}, 'placement_strategy': 'spread',
+                      'network_aliases': {}}
+        reservations = mock.patch('docker_plugin.placement.RESERVATION_DIR', self.given_temp_dir())
+        reservations.start()
+        self.addCleanup(reservations.stop)
+        return MockCloudifyContext(node_id=uuid1(), node_name='worker', properties=properties,
+                                   relationships=relationships)
+
+    def test_should_sample_stats_of_deployment_containers(self):
+        timeseries_file = os.path.join(self.given_temp_dir(), 'stats.jsonl')
+        with FakeEngine(tcp=True) as engine:
+            ctx = self.given_ctx_with_deployment_resources(engine)
+            engine.state.containers['web_id']['Usage'] = {'cpus': 0.5, 'memory': 64 * 1024 ** 2, 'net': 1000}
+
+            sample_deployment_stats(ctx, seconds=0.2, interval=0.1, timeseries_file=timeseries_file)
+
+        stats = ctx.instance.runtime_properties['stats']
+        self.assertEqual(['web'], list(stats['containers']))
+        web = stats['containers']['web']
+        self.assertEqual({'mean': 50.0, 'p95': 50.0, 'max': 50.0}, web['cpu_percent'])
+        self.assertEqual(64 * 1024 ** 2, web['memory_bytes']['max'])
+        self.assertGreater(web['net_rx_bytes_per_second']['mean'], 0)
+        self.assertEqual(web['cpu_percent'], stats['total']['cpu_percent'])
+        with open(timeseries_file) as f:
+            self.assertEqual(3, len(f.readlines()))
+
+    def test_should_keep_last_values_in_stats_window(self):
+        window = Window(3)
+
+        for value in range(1, 6):
+            window.add({'cpu_percent': value})
+
+        self.assertEqual({'cpu_percent': {'mean': 4.0, 'p95': 5.0, 'max': 5.0}}, window.aggregate())
+
+    def test_should_load_image_from_tarball_once(self):
+        path, image_id = self.given_image_tarball('app:1.0')
+        with FakeEngine(tcp=True) as engine:
+            benchmark = Benchmark(engine.base_url)
+            contexts = [benchmark.context('image', {'image_tarball': path, 'image_name': 'app:1.0'}) for _ in range(2)]
+
+            for ctx in contexts:
+                build_image(ctx)
+
+            loaded = engine.state.find_image('app:1.0')
+        self.assertEqual([image_id] * 2, [ctx.instance.runtime_properties['image'] for ctx in contexts])
+        self.assertEqual(image_id, loaded['Id'])
+        self.assertEqual(1, engine.calls['POST /images/load'])
+
+    def test_should_fail_on_truncated_image_tarball(self):
+        path, image_id = self.given_image_tarball('app:1.0', layer=os.urandom(256 * 1024))
+        with open(path, 'rb+') as f:
+            f.truncate(os.path.getsize(path) // 2)
+        with FakeEngine(tcp=True) as engine:
+            ctx = Benchmark(engine.base_url).context('image', {'image_tarball': path, 'image_name': 'app:1.0'})
+
+            self.assertRaises(RuntimeError, build_image, ctx)
+
+        self.assertNotIn(image_id, engine.state.images)
+        self.assertNotIn('image', ctx.instance.runtime_properties)
+
+    def given_image_tarball(self, tag, layer=None):
+        config = b'{"config": {}}'
+        digest = hashlib.sha256(config).hexdigest()
+        layers = ['layer.tar'] if layer else []
+        manifest = json.dumps([{'Config': digest + '.json', 'RepoTags': [tag], 'Layers': layers}]).encode('utf-8')
+        path = os.path.join(self.given_temp_dir(), 'image.tar.gz')
+        with tarfile.open(path, 'w:gz') as tar:
+            for name, data in ((digest + '.json', config), ('manifest.json', manifest), ('layer.tar', layer)):
+                if data is None:
+                    continue
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return path, 'sha256:' + digest
+
+    def test_should_claim_container_from_warm_pool_and_refill_it(self):
+        with FakeEngine(tcp=True) as engine:
+            ctx, network_name = self.given_ctx_with_container_group(engine, replicas=1)
+            ctx.node.properties['warm_pool_size'] = 2
+            fill_warm_pool(ctx)
+            pooled = set(engine.state.containers)
+
+            create_container(ctx)
+
+            container_id = ctx.instance.runtime_properties['container_id']
+            claimed = engine.state.containers[container_id]
+            deadline = time.time() + 10
+            while engine.calls['POST /containers/{id}/rename'] < 4 and time.time() < deadline:
+                time.sleep(0.05)
+            names = sorted(c['Name'] for c in engine.state.containers.values())
+
+            ctx._context['workflow_id'] = 'scale'
+            delete_container(ctx)
+            scaled_in = len(engine.state.containers)
+            ctx._context['workflow_id'] = 'uninstall'
+            delete_container(ctx)
+            left = list(engine.state.containers)
+        self.assertIn(container_id, pooled)
+        self.assertEqual(('/worker', [network_name]), (claimed['Name'], list(claimed['NetworkSettings']['Networks'])))
+        self.assertEqual(['/worker', '/worker_warm_', '/worker_warm_'], [n[:len('/worker_warm_')] for n in names])
+        # two members made by fill, the claim, and the member the detached refill made
+        self.assertEqual((3, 4), (engine.calls['POST /containers/create'],
+                                  engine.calls['POST /containers/{id}/rename']))
+        self.assertEqual((2, []), (scaled_in, left))
+
+    def test_should_keep_dedicated_networks_out_of_warm_pool(self):
+        endpoints = [('net', 'net_id', []), ('web_to_db', 'web_to_db_id', ['db'])]
+        connected = {'db': {'net_id': 'web_to_db_id', 'container_id': 'db_id'}}
+
+        pooled, own = _pool_endpoints(endpoints, {'connected': connected})
+        shared, _ = _pool_endpoints(endpoints, {'connected': connected, 'shared_network': {'network_id': 'x'}})
+
+        self.assertEqual(([('net', 'net_id', [])], [('web_to_db', 'web_to_db_id', ['db'])]), (pooled, own))
+        self.assertEqual(endpoints, shared)
+
+    def test_should_prefer_snapshot_of_container_over_pull(self):
+        with FakeEngine(tcp=True) as engine:
+            container_ctx, image_ctx = self.given_snapshot_of_running_container(engine)
+
+            snapshot_container(container_ctx)
+            build_image(image_ctx)
+            delete_image(image_ctx)
+
+            snapshot = container_ctx.instance.runtime_properties['snapshot']
+            labels = engine.state.find_image(snapshot['reference'])['Labels']
+        self.assertEqual((snapshot['image'], snapshot['reference']),
+                         (image_ctx.instance.runtime_properties['image'],
+                          image_ctx.instance.runtime_properties['image_reference']))
+        self.assertEqual(('worker', 'app'), (labels[SNAPSHOT_LABEL], labels['role']))
+        self.assertNotIn('POST /images/create', engine.calls)
+
+    def test_should_keep_image_snapshots_were_committed_on(self):
+        with FakeEngine(tcp=True) as engine:
+            container_ctx, image_ctx = self.given_snapshot_of_running_container(engine)
+            build_image(image_ctx)
+            source = image_ctx.instance.runtime_properties['image']
+
+            snapshot_container(container_ctx)
+            delete_image(image_ctx)
+
+            snapshot = engine.state.find_image(container_ctx.instance.runtime_properties['snapshot']['image'])
+            kept = source in engine.state.images
+        self.assertEqual((True, source), (kept, snapshot['ParentId']))
+
+    def test_should_not_prefer_snapshot_after_blueprint_reupload(self):
+        ctx = self.given_mock_ctx({'dockerfile': 'ctx/Dockerfile'})
+        rest = self.given_manager()
+
+        rest.blueprints.get.return_value.created_at = '2026-01-01T00:00:00'
+        first = _source_fingerprint(ctx)
+        rest.blueprints.get.return_value.created_at = '2026-01-02T00:00:00'
+
+        self.assertNotEqual(first, _source_fingerprint(ctx))
+
+    def given_snapshot_of_running_container(self, engine):
+        benchmark = Benchmark(engine.base_url)
+        image_ctx = benchmark.context('app', {'repository': 'app', 'tag': '1.0', 'snapshot_of': 'worker'})
+        engine.state.containers['worker_id'] = {
+            'Id': 'worker_id', 'Name': '/worker', 'Image': 'app:1.0',
+            'Config': {'Image': 'app:1.0', 'Labels': {'role': 'app'}},
+            'State': {'Running': True, 'Status': 'running'}, 'NetworkSettings': {'Networks': {}, 'Ports': {}},
+        }
+        image_rel = mock.Mock(type_hierarchy=[FROM_IMAGE])
+        image_rel.target.instance.runtime_properties = {'image': 'sha256:app',
+                                                        'source_fingerprint': _source_fingerprint(image_ctx)}
+        container_ctx = benchmark.context('worker', {}, [image_rel], {'container_id': 'worker_id'})
+        return container_ctx, image_ctx
+
+    def test_should_seed_volume_once_from_resources(self):
+        with FakeEngine(tcp=True) as engine:
+            engine.state.add_image('busybox:latest')
+            contexts = [self.given_ctx_with_seeded_volume(engine, {'a.txt': b'a' * 70000, 'b/c.txt': b'c'})
+                        for _ in range(2)]
+
+            for ctx in contexts:
+                create_volume(ctx)
+
+            volume = engine.state.volumes['data']
+        self.assertEqual({'data/a.txt': b'a' * 70000, 'data/b/c.txt': b'c'}, engine.state.volume_files['data'])
+        self.assertEqual(contexts[0].instance.runtime_properties['seed_hash'], volume['Labels'][SEED_LABEL])
+        self.assertEqual((1, {}), (engine.calls['PUT /containers/{id}/archive'], engine.state.containers))
+
+    def test_should_seed_volume_again_when_seeding_failed(self):
+        with FakeEngine(tcp=True) as engine:
+            engine.state.add_image('busybox:latest')
+            ctx = self.given_ctx_with_seeded_volume(engine, {'a.txt': b'a'})
+            download = ctx.download_resource.side_effect
+            ctx.download_resource.side_effect = IOError('resource unavailable')
+
+            self.assertRaises(Exception, create_volume, ctx)
+            ctx.download_resource.side_effect = download
+            create_volume(ctx)
+
+        self.assertEqual({'data/a.txt': b'a'}, engine.state.volume_files['data'])
+
+    def test_should_seed_volume_again_after_blueprint_reupload(self):
+        ctx = self.given_mock_ctx({'seed_resources': 'seed', 'seed_path': '/data'})
+        rest = self.given_manager()
+
+        rest.blueprints.get.return_value.created_at = '2026-01-01T00:00:00'
+        first = _seed_hash(ctx)
+        rest.blueprints.get.return_value.created_at = '2026-01-02T00:00:00'
+
+        self.assertNotEqual(first, _seed_hash(ctx))
+
+    def given_ctx_with_seeded_volume(self, engine, files):
+        resources_dir = self.given_temp_dir()
+
+        def download_resource(path):
+            target = os.path.join(resources_dir, uuid1().hex)
+            with open(target, 'wb') as f:
+                f.write(files[path[len('seed/'):]])
+            return target
+
+        ctx = Benchmark(engine.base_url).context('vol', {
+            'name': 'data', 'driver': 'local', 'driver_opts': {}, 'source': None,
+            'seed_resources': 'seed', 'seed_path': '/data',
+        })
+        ctx.get_resource = mock.Mock(return_value='\n'.join(sorted(files)).encode('utf-8'))
+        ctx.download_resource = mock.Mock(side_effect=download_resource)
+        return ctx
+
+    def given_ctx_with_logging_container(self, engine, lines):
+        engine.state.containers['logger_id'] = {
+            'Id': 'logger_id', 'Name': '/logger', 'Image': 'app:latest', 'Logs': lines,
+            'Config': {'Image': 'app:latest', 'Labels': {}, 'Tty': False},
+            'State': {'Running': True, 'Status': 'running'}, 'NetworkSettings': {'Networks': {}, 'Ports': {}},
+        }
+        return MockCloudifyContext(node_id='logger', properties={'log_follow': {'batch_lines': 50}},
+                                   runtime_properties={'container_id': 'logger_id', 'connection_kwargs': {
+                                       'base_url': engine.base_url}})
+
+    def given_ctx_with_container_group(self, engine, replicas):
+        benchmark = Benchmark(engine.base_url)
+        engine.state.add_image('group:latest')
+        network = engine.state.networks.setdefault('net_id', {
+            'Id': 'net_id', 'Name': 'group_net', 'Driver': 'bridge', 'Labels': {}, 'Containers': {}})
+        image_rel = mock.Mock(type_hierarchy=FROM_IMAGE)
+        image_rel.target.instance.runtime_properties = {'image': 'group:latest'}
+        network_rel = mock.Mock(type_hierarchy=CONNECTED_TO_NETWORK)
+        network_rel.target.node.name = 'net'
+        network_rel.target.instance.runtime_properties = {'network_id': network['Id'], 'network_name': network['Name']}
+        ctx = benchmark.context('workers', {
+            'name': 'worker',
+            'command': None,
+            'port_bindings': {},
+            'environment': {},
+            'network_aliases': {},
+            'additional_create_parameters': {},
+            'replicas': replicas,
+            'replica_concurrency': 4,
+        }, [image_rel, network_rel])
+        return ctx, network['Name']
+
     @staticmethod
     def given_empty_tls_setting():
         return {}
@@ -188,6 +1261,7 @@ class TestPlugin(unittest.TestCase):
 
         mock_images = mock.Mock()
         mock_images.images.get.side_effect = get
+        mock_images.api.images.return_value = []
         client = mock.MagicMock(return_value=mock_images)
         return client
 
@@ -206,9 +1280,60 @@ class TestPlugin(unittest.TestCase):
         mock_images = mock.Mock()
         mock_images.images.get.side_effect = get
         mock_images.images.pull.side_effect = pull
+        mock_images.api.images.return_value = []
         client = mock.MagicMock(return_value=mock_images)
         return client
 
+    def given_client_without_built_image(self):
+        image = mock.Mock()
+        image.id = self.image_id
+        mock_images = mock.Mock()
+        mock_images.images.get.side_effect = docker.errors.ImageNotFound(mock.Mock())
+        mock_images.images.build.return_value = image
+        mock_images.api.images.return_value = []
+        return mock.MagicMock(return_value=mock_images)
+
+    def given_client_with_image_pulled_concurrently(self):
+        image = mock.Mock()
+        image.id = self.image_id
+        mock_images = mock.Mock()
+        mock_images.images.get.return_value = image
+        mock_images.api.images.return_value = []
+        return mock.MagicMock(return_value=mock_images)
+
+    def given_client_with_streamed_pull(self):
+        image = mock.Mock()
+        image.id = self.image_id
+        mock_images = mock.Mock()
+        mock_images.images.get.side_effect = [docker.errors.ImageNotFound(mock.Mock()), image]
+        mock_images.api.images.return_value = []
+        mock_images.api.pull.return_value = iter([
+            {'status': 'Pulling from notexisting', 'id': 'latest'},
+            {'status': 'Downloading', 'id': 'abc', 'progress': '1/2'},
+            {'status': 'Downloading', 'id': 'abc', 'progress': '2/2'},
+            {'status': 'Pull complete', 'id': 'abc'},
+        ])
+        return mock.MagicMock(return_value=mock_images)
+
+    def given_client_with_built_image(self, fingerprint):
+        image = mock.Mock()
+        image.id = self.image_id
+        mock_images = mock.Mock()
+        mock_images.api.images.return_value = [
+            {'Id': 'sha256:old', 'RepoTags': ['built:latest'], 'Labels': {FINGERPRINT_LABEL: fingerprint}},
+        ]
+        mock_images.images.get.side_effect = docker.errors.ImageNotFound(mock.Mock())
+        mock_images.images.pull.return_value = image
+        mock_images.images.build.return_value = image
+        return mock.MagicMock(return_value=mock_images)
+
+    def given_client_with_image_inventory(self):
+        mock_images = mock.Mock()
+        mock_images.api.images.return_value = [
+            {'Id': self.image_id, 'RepoTags': ['existing:latest'], 'RepoDigests': [], 'Labels': None},
+        ]
+        return mock.MagicMock(return_value=mock_images)
+
     def given_simple_client(self):
         mock_images = mock.Mock()
         client = mock.MagicMock(return_value=mock_images)
@@ -248,6 +1373,40 @@ class TestPlugin(unittest.TestCase):
         client = mock.MagicMock(return_value=mock_containers)
         return client, mock_container
 
+    def given_client_with_shared_network(self):
+        network = mock.MagicMock()
+        network.id = 'shared_id'
+
+        def get(container_id):
+            container = mock.MagicMock()
+            container.id = container_id
+            container.attrs = {'NetworkSettings': {'Networks': {}}}
+
+            def reload():
+                container.attrs = {'NetworkSettings': {'Networks': {'cloudify_None': {'IPAddress': '10.0.0.2'}}}}
+
+            container.reload.side_effect = reload
+            return container
+
+        mock_client = mock.Mock()
+        mock_client.networks.get.return_value = network
+        mock_client.containers.get.side_effect = get
+        mock_client.api.create_container.return_value = {'Id': 'test_container_id'}
+        return mock.MagicMock(return_value=mock_client), network
+
+    @staticmethod
+    def given_container_with_healthcheck(container, final_status):
+        container.id = 'test_container_id'
+        container.attrs = {'Config': {'Healthcheck': {'Test': ['CMD', 'true']}}}
+
+        def reload():
+            container.attrs = {
+                'State': {'Running': True, 'Health': {'Status': final_status}},
+                'NetworkSettings': {'Networks': {}},
+            }
+
+        container.reload.side_effect = reload
+
     def given_client_with_volume(self):
         mock_volume = mock.MagicMock()
 
@@ -272,17 +1431,48 @@ class TestPlugin(unittest.TestCase):
         }
         return self.given_mock_ctx(properties)
 
+    def given_ctx_with_streamed_dockerfile(self, cache_from=None):
+        properties = {
+            'image_name': 'built',
+            'dockerfile': 'ctx',
+            'build_args': {},
+            'build_context_mode': 'stream',
+            'cache_from': cache_from or [],
+            'pull_cache_from': bool(cache_from),
+        }
+        ctx = self.given_mock_ctx(properties)
+        ctx.get_resource = mock.Mock(return_value=b'Dockerfile\n')
+        ctx.download_resource = self.given_download_func({'ctx/Dockerfile': 'FROM scratch'})
+        return ctx
+
     def given_ctx_with_image(self):
         return self.given_mock_ctx({}, {'image': self.image_id})
 
     def given_ctx_with_image_and_keep_property(self):
         return self.given_mock_ctx({'keep': True}, {'image': self.image_id})
 
-    def given_ctx_with_relationship(self):
+    def given_ctx_with_relationship(self, networks=(), connected=(), connection_topology='dedicated'):
         test_node_id = uuid1()
         rel = mock.Mock()
         rel.type_hierarchy = FROM_IMAGE
         rel.target.instance.runtime_properties = {'image': self.image_id}
+        rels = [rel]
+        for network_name in networks:
+            net_rel = mock.Mock()
+            net_rel.type_hierarchy = CONNECTED_TO_NETWORK
+            net_rel.target.node.name = network_name
+            net_rel.target.instance.runtime_properties = {
+                'network_id': '{0}_id'.format(network_name),
+                'network_name': network_name,
+            }
+            rels.append(net_rel)
+        for target_name in connected:
+            container_rel = mock.Mock()
+            container_rel.type_hierarchy = CONNECTED_TO_CONTAINER
+            container_rel.target.node.name = target_name
+            container_rel.target.instance.relationships = []
+            container_rel.target.instance.runtime_properties = {'container_id': '{0}_id'.format(target_name)}
+            rels.append(container_rel)
 
         properties = {
             'network_aliases': {},
@@ -291,16 +1481,25 @@ class TestPlugin(unittest.TestCase):
             'port_bindings': {},
             'environment': {},
             'additional_create_parameters': {},
+            'connection_topology': connection_topology,
         }
         return MockCloudifyContext(
             node_id=test_node_id,
             properties=properties,
-            relationships=[rel]
+            relationships=rels
         )
 
     def given_ctx_with_container(self):
         return self.given_mock_ctx({}, {'container_id': 'test_container_id'})
 
+    def given_ctx_with_shared_network_container(self):
+        runtime_properties = {
+            'container_id': 'test_container_id',
+            'connected': {'db': {'ip': '10.0.0.2', 'net_id': 'shared_id', 'container_id': 'target_id'}},
+            'shared_network': {'network_id': 'shared_id', 'network_name': 'cloudify_dep'},
+        }
+        return self.given_mock_ctx({}, runtime_properties)
+
     def given_ctx_with_network(self):
         properties = {
             'name': 'test_network',
@@ -341,6 +1540,11 @@ class TestPlugin(unittest.TestCase):
     def then_image_is_built(self, ctx):
         self.assertEqual(self.image_id, ctx.instance.runtime_properties['image'])
 
+    def then_image_is_built_from_stream(self, client):
+        kwargs = client.return_value.images.build.call_args.kwargs
+        self.assertTrue(kwargs['custom_context'])
+        self.assertNotIn('path', kwargs)
+
     def then_client_is_connected(self, client):
         self.assertTrue(client.ping())
 
@@ -356,6 +1560,13 @@ class TestPlugin(unittest.TestCase):
         args = {'command': None, 'environment': {}, 'image': self.image_id, 'name': None, 'ports': {}, 'volumes': {}}
         self.assertEqual(args, client.return_value.containers.create.call_args.kwargs)
 
+    def then_container_is_created_with_network(self, client, network_id):
+        self.assertFalse(client.return_value.containers.create.called)
+        kwargs = client.return_value.api.create_container.call_args.kwargs
+        self.assertEqual(client.return_value.api.create_networking_config.return_value, kwargs['networking_config'])
+        self.assertEqual(({network_id: client.return_value.api.create_endpoint_config.return_value},),
+                         client.return_value.api.create_networking_config.call_args.args)
+
     def then_container_is_started(self, container):
         self.assertEqual(1, container.start.call_count)
 
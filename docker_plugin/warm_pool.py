@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from uuid import uuid4
+
+import docker.errors
+
+from docker_plugin.client_pool import CLIENT_POOL, host_key
+from docker_plugin.concurrency import DEFAULT_PARALLELISM, run_parallel
+from docker_plugin.locks import file_lock
+from docker_plugin.reconcile import INSTANCE_LABEL
+from docker_plugin.teardown import ignore_missing
+
+WARM_POOL_LABEL = 'cloudify.docker.warm_pool'
+NAME_MARKER = '_warm_'
+# members keep this name until their networks are attached, so they cannot be claimed half made
+STAGING_MARKER = '_warming_'
+REFILL_LOG = os.path.join(tempfile.gettempdir(), 'cloudify-docker-warm-pool.log')
+
+
+def _pool_parameters(parameters):
+    # the spec without what differs between the node's instances
+    pooled = dict(parameters)
+    pooled.pop('name', None)
+    labels = pooled.get('labels')
+    if isinstance(labels, (list, tuple)):
+        labels = {label: '' for label in labels}
+    pooled['labels'] = {k: v for k, v in (labels or {}).items() if k != INSTANCE_LABEL}
+    return pooled
+
+
+def pool_key(parameters, endpoints):
+    """Identifies the pool whose containers match this create spec."""
+    spec = json.dumps([_pool_parameters(parameters), [list(e) for e in endpoints]], sort_keys=True, default=str)
+    return hashlib.sha256(spec.encode('utf-8')).hexdigest()[:16]
+
+
+def _members(client, key, name, markers=(NAME_MARKER,)):
+    # claimed containers keep the pool label, so members are told apart by their name
+    prefixes = tuple('/{0}{1}'.format(name, marker) for marker in markers)
+    filters = {'label': '{0}={1}'.format(WARM_POOL_LABEL, key)}
+    return [c for c in client.api.containers(all=True, filters=filters)
+            if any(n.startswith(prefixes) for n in c.get('Names') or [])]
+
+
+def _remove(client, members, limit):
+    return sum(run_parallel(lambda c: ignore_missing(client.api.remove_container, c['Id'], force=True),
+                            members, limit))
+
+
+def claim(client, key, name):
+    """Rename a free container of the pool to ``name`` and return its id, None when the pool is empty.
+
+    The pool's lock makes picking and renaming one step for every operation on this machine.
+    """
+    with file_lock('warm_pool', host_key(client), key):
+        for member in _members(client, key, name):
+            if ignore_missing(client.api.rename, member['Id'], name):
+                return member['Id']
+    return None
+
+
+def fill(client, key, parameters, endpoints, size, create, limit=DEFAULT_PARALLELISM):
+    """Create or remove free containers of the pool until there are ``size``; returns the change.
+
+    Fills of a pool take turns, but only removing members holds the lock of
+    claim, so a claim never waits for containers being created.
+    """
+    name = parameters['name']
+    with file_lock('warm_pool_fill', host_key(client), key):
+        with file_lock('warm_pool', host_key(client), key):
+            members = _members(client, key, name)
+            if len(members) > size:
+                _remove(client, members[size:], limit)
+                return size - len(members)
+        pooled = _pool_parameters(parameters)
+        pooled['labels'][WARM_POOL_LABEL] = key
+
+        def create_member(_):
+            suffix = uuid4().hex[:12]
+            container_id = create(client, dict(pooled, name='{0}{1}{2}'.format(name, STAGING_MARKER, suffix)),
+                                  endpoints)
+            client.api.rename(container_id, '{0}{1}{2}'.format(name, NAME_MARKER, suffix))
+
+        run_parallel(create_member, range(size - len(members)), limit)
+        return size - len(members)
+
+
+def drain(client, key, name, limit=DEFAULT_PARALLELISM):
+    """Remove every member of the pool, including those a failed fill left half made; returns how many."""
+    with file_lock('warm_pool_fill', host_key(client), key):
+        with file_lock('warm_pool', host_key(client), key):
+            return _remove(client, _members(client, key, name, (NAME_MARKER, STAGING_MARKER)), limit)
+
+
+def refill_in_background(connkwargs, key, parameters, endpoints, size):
+    """Top the pool up from a detached process, so that the claiming operation does not wait for it.
+
+    The process outlives the operation; its errors go to REFILL_LOG.
+    """
+    with open(REFILL_LOG, 'ab') as log:
+        process = subprocess.Popen([sys.executable, '-m', 'docker_plugin.warm_pool'], stdin=subprocess.PIPE,
+                                   stdout=log, stderr=log, close_fds=True, preexec_fn=os.setsid)
+    process.stdin.write(json.dumps({'connkwargs': connkwargs, 'key': key, 'parameters': parameters,
+                                    'endpoints': endpoints, 'size': size}).encode('utf-8'))
+    process.stdin.close()
+    return process
+
+
+def main():
+    # the create function lives with the operations, which import this module
+    from docker_plugin.tasks import _create_attached
+
+    request = json.loads(sys.stdin.read())
+    client = CLIENT_POOL.get(request['connkwargs'])
+    try:
+        fill(client, request['key'], request['parameters'], request['endpoints'], request['size'], _create_attached)
+    except docker.errors.APIError as e:
+        sys.stderr.write('Could not refill the warm pool {0}: {1}\n'.format(request['key'], e))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())